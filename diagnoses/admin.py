@@ -1,3 +1,22 @@
 from django.contrib import admin
 
+from .models import FuzzyRule, PendingDiagnosis
+
 # Register your models here.
+
+
+@admin.register(FuzzyRule)
+class FuzzyRuleAdmin(admin.ModelAdmin):
+    list_display = ('disease_group', 'order', 'rule', 'consequent', 'weight')
+    list_filter = ('disease_group', 'consequent')
+    ordering = ('disease_group', 'order')
+
+    @admin.display(description='Rule')
+    def rule(self, obj):
+        return str(obj).split(': ', 1)[1]
+
+
+@admin.register(PendingDiagnosis)
+class PendingDiagnosisAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'created_at', 'attempts', 'last_error')
+    list_filter = ('attempts',)
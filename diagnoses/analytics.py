@@ -0,0 +1,90 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DailyGroupRollup, DiagnosisGroupProbability
+
+
+def rollup_totals(rows):
+    # rows: (día, grupo, probabilidad, quedó primero); devuelve {(día, grupo): [diagnósticos, primeros, suma]}
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for day, group_id, probability, top in rows:
+        entry = totals[day, group_id]
+        entry[0] += 1
+        entry[1] += int(top)
+        entry[2] += probability
+    return totals
+
+
+def record_diagnoses(diagnoses):
+    # Suma a los totales diarios los diagnósticos recién insertados; se llama dentro de su transacción.
+    # Las probabilidades están en la caché de prefetch en el orden del ranking
+    add_totals(rollup_totals(
+        (timezone.localdate(diagnosis.created_at), item.disease_group_id, item.probability_level, index == 0)
+        for diagnosis in diagnoses
+        for index, item in enumerate(diagnosis._prefetched_objects_cache['diagnosisgroupprobability_set'])
+    ))
+
+
+def add_totals(totals):
+    # Tres consultas por lote sea cual sea su tamaño: crear las filas que falten, bloquearlas y actualizarlas
+    if not totals:
+        return
+    DailyGroupRollup.objects.bulk_create(
+        [DailyGroupRollup(date=day, disease_group_id=group_id) for day, group_id in totals], ignore_conflicts=True
+    )
+    rollups = DailyGroupRollup.objects.select_for_update().filter(
+        date__in={day for day, _ in totals}, disease_group_id__in={group_id for _, group_id in totals}
+    )
+    changed = []
+    for rollup in rollups:
+        entry = totals.get((rollup.date, rollup.disease_group_id))
+        if entry is None:
+            continue
+        rollup.diagnoses += entry[0]
+        rollup.top_diagnoses += entry[1]
+        rollup.probability_sum += entry[2]
+        changed.append(rollup)
+    DailyGroupRollup.objects.bulk_update(changed, ['diagnoses', 'top_diagnoses', 'probability_sum'])
+
+
+def start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild_daily_rollups(date_from=None, date_to=None, chunk_size=2000):
+    # Recalcula desde DiagnosisGroupProbability los días del rango (ambos inclusive); devuelve las filas escritas.
+    # Sirve para cargar el histórico y para corregir los totales tras borrar diagnósticos
+    rollups = DailyGroupRollup.objects.all()
+    probabilities = DiagnosisGroupProbability.objects.all()
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+        probabilities = probabilities.filter(diagnosis__created_at__gte=start_of(date_from))
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+        probabilities = probabilities.filter(diagnosis__created_at__lt=start_of(date_to + timedelta(days=1)))
+
+    rows = probabilities.order_by('diagnosis_id', '-probability_level', 'pk').values_list(
+        'diagnosis_id', 'diagnosis__created_at', 'disease_group_id', 'probability_level',
+    ).iterator(chunk_size=chunk_size)
+
+    def ranked(rows):
+        # El primero de cada diagnóstico es el de mayor probabilidad, como en el ranking guardado
+        previous = None
+        for diagnosis_id, created_at, group_id, probability in rows:
+            yield timezone.localdate(created_at), group_id, probability, diagnosis_id != previous
+            previous = diagnosis_id
+
+    with transaction.atomic():
+        totals = rollup_totals(ranked(rows))
+        rollups.delete()
+        DailyGroupRollup.objects.bulk_create([
+            DailyGroupRollup(
+                date=day, disease_group_id=group_id,
+                diagnoses=count, top_diagnoses=top, probability_sum=probability_sum,
+            )
+            for (day, group_id), (count, top, probability_sum) in totals.items()
+        ], batch_size=chunk_size)
+    return len(totals)
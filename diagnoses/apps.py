@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class DiagnosesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'diagnoses'
+
+    def ready(self):
+        # Registrar las señales que invalidan el motor difuso compilado
+        from . import signals  # noqa: F401
+
+        # Compilar el motor al arrancar cada proceso servidor y no en su primera petición
+        from .warm_start import should_warm_start, start_warm_start
+        if should_warm_start():
+            start_warm_start()
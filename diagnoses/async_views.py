@@ -0,0 +1,104 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from .filters import filter_diagnoses
+from .inference_queue import QueueFull, get_inference_queue
+from .models import Diagnosis
+from .renderers import astream_json_array
+from .serializers import DiagnosisSerializer, EncounterSerializer
+from .services import acreate_diagnoses
+from .views import DIAGNOSIS_PREFETCH_RELATED, DIAGNOSIS_SELECT_RELATED, existing_result, idempotency_key_error, pending_data
+from .write_behind import aenqueue_diagnoses, find_diagnosis, new_idempotency_key, request_hash
+
+# Variantes asíncronas de los endpoints de diagnósticos para servir muchos kioscos desde un solo
+# proceso ASGI: el bucle de eventos no se bloquea con la inferencia ni espera hilos por petición.
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json', headers=headers)
+
+
+@csrf_exempt
+async def diagnoses_list_create(request):
+    if request.method == 'GET':
+        try:
+            return list_diagnoses(request)
+        except ValidationError as error:
+            return json_response(error.detail, status=status.HTTP_400_BAD_REQUEST)
+    if request.method == 'POST':
+        return await create_diagnosis(request)
+    return HttpResponseNotAllowed(['GET', 'POST'])
+
+
+def list_diagnoses(request):
+    # El historial se transmite por bloques leídos con el ORM asíncrono
+    queryset = Diagnosis.objects.select_related(*DIAGNOSIS_SELECT_RELATED).prefetch_related(*DIAGNOSIS_PREFETCH_RELATED)
+    rows = filter_diagnoses(queryset, request.GET).order_by('pk').aiterator(chunk_size=settings.DIAGNOSIS_LIST_CHUNK_SIZE)
+    return StreamingHttpResponse(astream_json_array(represent(rows)), content_type='application/json')
+
+
+async def represent(rows):
+    serializer = DiagnosisSerializer()
+    async for diagnosis in rows:
+        yield serializer.to_representation(diagnosis)
+
+
+async def create_diagnosis(request):
+    # Misma semántica que POST /api/diagnoses/: Idempotency-Key y modo write-behind incluidos
+    try:
+        data = json.loads(request.body or b'null')
+    except ValueError as error:
+        return json_response({'detail': f'JSON parse error - {error}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    key = request.headers.get('Idempotency-Key')
+    fingerprint = ''
+    if key is not None:
+        error = idempotency_key_error(key)
+        if error is not None:
+            return json_response(error, status=status.HTTP_400_BAD_REQUEST)
+        fingerprint = request_hash(data)
+        found = await sync_to_async(find_existing)(key)
+        if found is not None:
+            return json_response(*existing_result(key, found, fingerprint))
+
+    serializer = EncounterSerializer(data=data)
+    if not serializer.is_valid():
+        return json_response(serializer.errors.get('vital_signs', serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        if settings.DIAGNOSIS_WRITE_BEHIND:
+            key = key or new_idempotency_key()
+            diagnosis, = await aenqueue_diagnoses([serializer.validated_data], [key], [fingerprint])
+            return json_response(pending_data(key, diagnosis), status=status.HTTP_202_ACCEPTED)
+        diagnosis, = await acreate_diagnoses([serializer.validated_data], [key], [fingerprint])
+    except ValidationError as error:
+        return json_response(error.detail, status=status.HTTP_400_BAD_REQUEST)
+    except QueueFull:
+        # Contrapresión: mejor rechazar ya que dejar crecer la cola y la latencia de todos
+        return json_response(
+            {'error': 'Diagnosis service is busy, retry later'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(settings.DIAGNOSIS_ASYNC_RETRY_AFTER)},
+        )
+    except IntegrityError:
+        if key is None:
+            raise
+        return json_response(*existing_result(key, await sync_to_async(find_existing)(key), fingerprint))
+    return json_response(DiagnosisSerializer(diagnosis).data, status=status.HTTP_201_CREATED)
+
+
+def find_existing(key):
+    queryset = Diagnosis.objects.select_related(*DIAGNOSIS_SELECT_RELATED).prefetch_related(*DIAGNOSIS_PREFETCH_RELATED)
+    return find_diagnosis(queryset, key)
+
+
+async def inference_queue_stats(request):
+    return json_response(get_inference_queue().stats())
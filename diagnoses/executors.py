@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from .fuzzy_engine import compile_rule_base, project_inputs
+
+EXECUTOR_KINDS = ('serial', 'thread', 'process')
+
+
+def build_executor(kind, systems, workers=None, min_rows=0, compiled=None, defuzzifier='centroid'):
+    # systems: lista de (nombre del grupo, ControlSystem, Consequent), como en compile_rule_base.
+    # Todas las estrategias tienen la interfaz de CompiledRuleBase (group_names, version, quantize, evaluate)
+    compiled = compiled or compile_rule_base(systems, defuzzifier)
+    if kind == 'serial':
+        return compiled
+    if kind not in EXECUTOR_KINDS:
+        raise ValueError(f"Unknown diagnosis executor '{kind}'; expected one of {', '.join(EXECUTOR_KINDS)}")
+    workers = min(workers or os.cpu_count() or 1, len(systems)) or 1
+    executor_class = ThreadExecutor if kind == 'thread' else ProcessExecutor
+    return executor_class(systems, workers, min_rows, compiled)
+
+
+class ShardedExecutor:
+    # Reparte los grupos en tantos fragmentos como trabajadores; cada fragmento es una base compilada
+    # independiente que evalúa sus grupos sobre todas las filas
+    def __init__(self, systems, workers, min_rows, compiled):
+        self.compiled = compiled
+        self.group_names = compiled.group_names
+        self.version = compiled.version
+        self.workers = workers
+        # Por debajo de este número de filas el reparto cuesta más de lo que ahorra
+        self.min_rows = min_rows
+        self.columns = [list(indices) for indices in np.array_split(np.arange(len(systems)), workers) if indices.size]
+        self.shards = [compile_rule_base([systems[g] for g in indices], compiled.defuzzifier) for indices in self.columns]
+        # Columnas de cada fragmento en la matriz de entradas del motor completo
+        self.positions = [shard.positions_in(compiled.variable_names) for shard in self.shards]
+
+    def quantize(self, rows):
+        return self.compiled.quantize(rows)
+
+    def evaluate(self, rows, top_k=None):
+        # La poda top-k dentro de cada fragmento es segura: un grupo fuera del top-k de su fragmento
+        # tampoco está en el top-k global
+        if len(rows) < self.min_rows or len(self.shards) < 2:
+            return self.compiled.evaluate(rows, top_k)
+        results = np.empty((len(rows), len(self.group_names)))
+        for columns, future in zip(self.columns, self.submit(rows, top_k)):
+            results[:, columns] = future.result()
+        return results
+
+
+class ThreadExecutor(ShardedExecutor):
+    # NumPy libera el GIL en las reducciones grandes; con lotes pequeños domina el GIL
+    def __init__(self, systems, workers, min_rows, compiled):
+        super().__init__(systems, workers, min_rows, compiled)
+        self.pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='fuzzy-diagnosis')
+        weakref.finalize(self, self.pool.shutdown, wait=False)
+
+    def submit(self, rows, top_k):
+        return [
+            self.pool.submit(shard.evaluate, project_inputs(rows, positions), top_k)
+            for shard, positions in zip(self.shards, self.positions)
+        ]
+
+
+class ProcessExecutor(ShardedExecutor):
+    # Los procesos se arrancan al crear el motor y reciben los fragmentos compilados una sola vez.
+    # Se usa "spawn" porque el proceso de Django puede tener hilos activos al bifurcarse
+    def __init__(self, systems, workers, min_rows, compiled):
+        super().__init__(systems, workers, min_rows, compiled)
+        self.pool = ProcessPoolExecutor(
+            max_workers=len(self.shards),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.shards,),
+        )
+        weakref.finalize(self, self.pool.shutdown, wait=False, cancel_futures=True)
+        wait([self.pool.submit(_worker_ready) for _ in self.shards])
+
+    def submit(self, rows, top_k):
+        # Cada fragmento solo recibe las variables que usan sus grupos
+        return [
+            self.pool.submit(_evaluate_shard, index, self.shard_inputs(rows, shard, positions), top_k)
+            for index, (shard, positions) in enumerate(zip(self.shards, self.positions))
+        ]
+
+    def shard_inputs(self, rows, shard, positions):
+        if isinstance(rows, np.ndarray):
+            return rows[:, positions]
+        return [{name: row[name] for name in shard.variable_names if name in row} for row in rows]
+
+
+class BatchPool:
+    # Reparte lotes de filas enteros entre procesos con la base compilada completa, para cargas masivas
+    # (import_encounters) en las que sobran filas y cada lote es independiente. Con un solo trabajador
+    # evalúa en el propio proceso. submit() devuelve un Future con la matriz (N, grupos)
+    def __init__(self, compiled, workers=None):
+        self.compiled = compiled
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=([compiled],),
+            )
+            weakref.finalize(self, self.pool.shutdown, wait=False, cancel_futures=True)
+
+    def submit(self, rows, top_k=None):
+        if self.pool is not None:
+            return self.pool.submit(_evaluate_shard, 0, rows, top_k)
+        future = Future()
+        future.set_result(self.compiled.evaluate(rows, top_k))
+        return future
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+# Estado de cada proceso trabajador
+_worker_shards = None
+
+
+def _init_worker(shards):
+    global _worker_shards
+    _worker_shards = shards
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _evaluate_shard(index, rows, top_k):
+    return _worker_shards[index].evaluate(rows, top_k)
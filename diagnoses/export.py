@@ -0,0 +1,83 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+
+from .fuzzy_inference import VITAL_SIGN_FIELDS
+from .models import DiseaseGroup, Symptom
+
+# Exportación plana del historial: una fila por diagnóstico con sus signos vitales, la intensidad de
+# cada síntoma y la probabilidad de cada grupo en columnas. Se lee con un único GROUP BY recorrido con
+# iterator() y se escribe por bloques, así que la memoria no depende del número de diagnósticos.
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# Bytes acumulados antes de entregar un bloque al servidor o al fichero
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+
+class ExportColumns:
+    # Columnas en orden: id, fecha, signos vitales, "symptom:<nombre>" y "group:<nombre>".
+    # Los síntomas no informados y los grupos fuera del ranking guardado quedan vacíos (null)
+    def __init__(self):
+        self.symptoms = list(Symptom.objects.order_by('pk').values_list('pk', 'name'))
+        self.groups = list(DiseaseGroup.objects.order_by('pk').values_list('pk', 'name'))
+        self.fields = ['id', 'created', *VITAL_SIGN_FIELDS]
+        self.fields += [f'symptom_{pk}' for pk, _ in self.symptoms] + [f'group_{pk}' for pk, _ in self.groups]
+        self.header = ['id', 'created_at', *VITAL_SIGN_FIELDS]
+        self.header += [f'symptom:{name}' for _, name in self.symptoms] + [f'group:{name}' for _, name in self.groups]
+
+    def queryset(self, queryset):
+        # Join con los signos vitales y pivote de síntomas y grupos con agregados filtrados por id
+        pivot = {
+            f'symptom_{pk}': Max('diagnosissymptom__intensity', filter=Q(diagnosissymptom__symptom_id=pk))
+            for pk, _ in self.symptoms
+        }
+        pivot.update({
+            f'group_{pk}': Max(
+                'diagnosisgroupprobability__probability_level',
+                filter=Q(diagnosisgroupprobability__disease_group_id=pk),
+            )
+            for pk, _ in self.groups
+        })
+        # Fecha y signos vitales tienen un único valor por diagnóstico: como agregados, el GROUP BY es solo
+        # por id y la base de datos entrega las filas según recorre la clave, sin ordenar antes el resultado
+        single = {'created': Max('created_at'), **{name: Max(f'vital_signs__{name}') for name in VITAL_SIGN_FIELDS}}
+        return queryset.order_by('pk').values('id').annotate(**single, **pivot)
+
+    def rows(self, queryset, chunk_size):
+        for row in self.queryset(queryset).iterator(chunk_size=chunk_size):
+            yield [row[field] for field in self.fields]
+
+
+class CSVLine:
+    # csv.writer sobre un "fichero" que devuelve la línea en vez de escribirla
+    def write(self, value):
+        return value
+
+
+def export_lines(columns, rows, export_format):
+    if export_format == 'csv':
+        writer = csv.writer(CSVLine())
+        yield writer.writerow(columns.header)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(columns.header, row))) + '\n'
+
+
+def stream_export(columns, rows, export_format, buffer_size=EXPORT_BUFFER_SIZE):
+    # Bloques de bytes de unos buffer_size: evita una escritura al socket por fila
+    buffer = []
+    size = 0
+    for line in export_lines(columns, rows, export_format):
+        buffer.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
@@ -0,0 +1,109 @@
+import re
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import DiagnosisGroupProbability
+
+# Filtros del historial de diagnósticos; cada uno se resuelve con un índice:
+#   created_after / created_before -> diagnosis_created_at_idx
+#   group (+ min_probability)      -> diag_group_probability_idx
+#   min_/max_systolic              -> vitals_systolic_idx
+#   min_/max_diastolic             -> vitals_diastolic_idx
+DIAGNOSIS_FILTERS = (
+    'created_after', 'created_before', 'group', 'min_probability',
+    'min_systolic', 'max_systolic', 'min_diastolic', 'max_diastolic',
+)
+
+# Filtro de presión arterial -> búsqueda sobre los signos vitales del diagnóstico (extremos incluidos)
+BLOOD_PRESSURE_FILTERS = {
+    'min_systolic': 'vital_signs__systolic__gte',
+    'max_systolic': 'vital_signs__systolic__lte',
+    'min_diastolic': 'vital_signs__diastolic__gte',
+    'max_diastolic': 'vital_signs__diastolic__lte',
+}
+
+
+def filter_diagnoses(queryset, params):
+    # params: QueryDict de la petición. created_after es inclusivo y created_before exclusivo
+    created_after = parse_moment(params, 'created_after')
+    if created_after is not None:
+        queryset = queryset.filter(created_at__gte=created_after)
+    created_before = parse_moment(params, 'created_before')
+    if created_before is not None:
+        queryset = queryset.filter(created_at__lt=created_before)
+
+    group = params.get('group')
+    min_probability = parse_probability(params)
+    if group or min_probability is not None:
+        # Subconsulta en vez de join: un diagnóstico con varios grupos por encima del umbral sale una vez
+        probabilities = DiagnosisGroupProbability.objects.all()
+        if group:
+            probabilities = probabilities.filter(**group_lookup(group))
+        if min_probability is not None:
+            probabilities = probabilities.filter(probability_level__gte=min_probability)
+        queryset = queryset.filter(pk__in=probabilities.values('diagnosis_id'))
+
+    for name, lookup in BLOOD_PRESSURE_FILTERS.items():
+        value = parse_integer(params, name)
+        if value is not None:
+            queryset = queryset.filter(**{lookup: value})
+    return queryset
+
+
+def parse_moment(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({name: ['Expected an ISO 8601 date or datetime.']})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_probability(params):
+    value = params.get('min_probability')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValidationError({'min_probability': ['Expected a number.']})
+
+
+def parse_integer(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: ['Expected an integer.']})
+
+
+def parse_day(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: ['Expected an ISO 8601 date.']})
+    return day
+
+
+def group_lookup(group):
+    # Grupo de enfermedades por id o por nombre. Solo dígitos ASCII: isdigit() acepta '²' o '٣', que int() rechaza
+    return {'disease_group_id': int(group)} if re.fullmatch(r'[0-9]+', group) else {'disease_group__name': group}
@@ -0,0 +1,558 @@
+import hashlib
+from itertools import combinations
+
+import numpy as np
+
+from .instrumentation import stage, timing_groups
+
+
+class CompiledRuleBase:
+    # Reglas Mamdani de todos los grupos compiladas a arreglos NumPy.
+    # Cada antecedente se lleva a forma normal disyuntiva (OR de cláusulas AND), que con
+    # min/max/1-x es exacta, para evaluar todas las reglas con dos reducciones.
+    chunk_size = 512
+    # 'centroid' reproduce el centroide remuestreado de skfuzzy; 'analytic' integra el conjunto agregado
+    # exacto a partir de las tablas de CentroidTables
+    defuzzifiers = ('centroid', 'analytic')
+    # Holgura de la poda top-k: muy por encima del error de redondeo y del redondeo a 9 decimales del ranking
+    prune_margin = 1e-6
+
+    def __init__(self, group_names, variable_names, universes, term_labels, term_mfs,
+                 clause_index, rule_weights, slot_rules, term_present,
+                 output_universe, output_labels, output_mfs, group_variables, defuzzifier='centroid'):
+        self.group_names = group_names
+        self.variable_names = variable_names
+        self.universes = universes
+        self.term_labels = term_labels
+        self.term_mfs = term_mfs
+        self.clause_index = clause_index
+        self.rule_weights = rule_weights
+        self.slot_rules = slot_rules
+        self.term_present = term_present
+        self.output_universe = output_universe
+        self.output_labels = output_labels
+        self.output_mfs = output_mfs
+        # Índices de las variables que referencia cada grupo, en el orden de variable_names
+        self.group_variables = group_variables
+
+        # Columnas de la matriz de pertenencias: una por (variable, término)
+        self.variable_columns = []
+        start = 0
+        for labels in term_labels:
+            self.variable_columns.append(range(start, start + len(labels)))
+            start += len(labels)
+        self.term_count = start
+
+        # Paso de cada universo cuando es uniforme, para cuantizar entradas a sus puntos. Los puntos se
+        # redondean porque np.arange acumula error (37.00000000000003 en vez de 37.0)
+        self.grid_steps = []
+        self.grids = []
+        for universe in universes:
+            steps = np.diff(universe)
+            uniform = steps.size and np.allclose(steps, steps[0])
+            self.grid_steps.append(float(steps[0]) if uniform else None)
+            self.grids.append(np.round(universe, 9))
+        self.centroid_tables = CentroidTables.build(self.output_universe, self.output_mfs)
+        if defuzzifier not in self.defuzzifiers:
+            raise ValueError(f"Unknown defuzzifier '{defuzzifier}'; expected one of {', '.join(self.defuzzifiers)}")
+        if defuzzifier == 'analytic' and self.centroid_tables is None and output_labels:
+            raise ValueError("The analytic defuzzifier supports at most "
+                             f"{CentroidTables.max_terms} output terms")
+        self.defuzzifier = defuzzifier
+        self.version = self._fingerprint()
+
+    def _fingerprint(self):
+        # Huella de la base de reglas compilada; cambia con cualquier regla, término o universo
+        digest = hashlib.sha1(repr((self.group_names, self.variable_names, self.term_labels, self.output_labels,
+                                    self.defuzzifier)).encode())
+        for array in [*self.universes, *self.term_mfs, self.clause_index, self.rule_weights,
+                      self.slot_rules, self.term_present, self.output_universe, self.output_mfs]:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    def positions_in(self, variable_names):
+        # Columnas de las variables de esta base en una matriz de entradas con columnas variable_names
+        return [variable_names.index(name) for name in self.variable_names]
+
+    def quantize(self, rows):
+        # Devuelve (clave canónica, fila cuantizada) por entrada: cada valor numérico se lleva al punto
+        # más cercano del universo de su variable, así entradas casi idénticas comparten resultado
+        if isinstance(rows, np.ndarray):
+            return self.quantize_matrix(rows)
+        keys, quantized = [], []
+        for row in rows:
+            key, values = [], {}
+            for v, name in enumerate(self.variable_names):
+                value = self._input_value(row, name)
+                step = self.grid_steps[v]
+                if isinstance(value, str) or step is None:
+                    key.append(value)
+                    values[name] = value
+                else:
+                    grid = self.grids[v]
+                    index = min(max(int(round((value - grid[0]) / step)), 0), grid.size - 1)
+                    key.append(index)
+                    values[name] = float(grid[index])
+            keys.append(tuple(key))
+            quantized.append(values)
+        return keys, quantized
+
+    def quantize_matrix(self, X):
+        # Igual que quantize() para una matriz de entradas; un valor rechazado (NaN) tiene clave None
+        quantized = X.copy()
+        columns = []
+        for v, step in enumerate(self.grid_steps):
+            values = X[:, v]
+            missing = np.isnan(values)
+            if step is None:
+                columns.append([None if m else value for m, value in zip(missing.tolist(), values.tolist())])
+                continue
+            grid = self.grids[v]
+            offsets = np.rint((np.where(missing, grid[0], values) - grid[0]) / step)
+            index = np.clip(offsets, 0, grid.size - 1).astype(int)
+            quantized[:, v] = np.where(missing, np.nan, grid[index])
+            columns.append([None if m else i for m, i in zip(missing.tolist(), index.tolist())])
+        keys = list(zip(*columns)) if columns else [()] * X.shape[0]
+        return keys, quantized
+
+    def _input_value(self, row, name):
+        value = row.get(name)
+        if value is None:
+            raise ValueError(f"Missing input value for '{name}'")
+        return value
+
+    def fuzzify(self, rows):
+        # rows: lista de diccionarios {variable: valor} o matriz (N, variables) en el orden de variable_names;
+        # devuelve la matriz (N, términos)
+        if isinstance(rows, np.ndarray):
+            return self.fuzzify_matrix(rows)
+        X = np.full((len(rows), len(self.variable_names)), np.nan)
+        labelled = []
+        for v, name in enumerate(self.variable_names):
+            for n, row in enumerate(rows):
+                value = self._input_value(row, name)
+                if isinstance(value, str):
+                    # Igual que skfuzzy: una etiqueta de término vale 1 en ese término y 0 en los demás
+                    labelled.append((n, v, value))
+                else:
+                    X[n, v] = value
+
+        memberships = self.fuzzify_matrix(X)
+        for n, v, label in labelled:
+            for column, term_label in zip(self.variable_columns[v], self.term_labels[v]):
+                memberships[n, column] = 1.0 if term_label == label else 0.0
+        return memberships
+
+    def fuzzify_matrix(self, X):
+        memberships = np.empty((X.shape[0], self.term_count))
+        for v, columns in enumerate(self.variable_columns):
+            for column, mf in zip(columns, self.term_mfs[v]):
+                # np.interp satura en los extremos, como clip_to_bounds de skfuzzy
+                memberships[:, column] = np.interp(X[:, v], self.universes[v], mf)
+        # Una entrada rechazada (NaN) no pertenece a ningún término, como una etiqueta desconocida en skfuzzy
+        return np.nan_to_num(memberships, copy=False, nan=0.0)
+
+    def rule_strengths(self, memberships):
+        n = memberships.shape[0]
+        extended = np.concatenate(
+            [memberships, 1.0 - memberships, np.ones((n, 1)), np.zeros((n, 1))], axis=1)
+        return extended[:, self.clause_index].min(axis=-1).max(axis=-1)
+
+    def activations(self, strengths):
+        # Acumulación por máximo de las reglas que apuntan a cada término de salida de cada grupo
+        n = strengths.shape[0]
+        padded = np.concatenate([strengths * self.rule_weights, np.zeros((n, 1))], axis=1)
+        cuts = padded[:, self.slot_rules].max(axis=-1)
+        return cuts.reshape(n, len(self.group_names), len(self.output_labels))
+
+    def defuzzify(self, cuts, present=None):
+        # cuts: niveles de activación (N, grupos, términos). Devuelve NaN donde skfuzzy no produce salida.
+        # present: términos con reglas, (1 o N, grupos, términos); por defecto el de cada grupo
+        n, groups, terms = cuts.shape
+        if not terms:
+            return np.full((n, groups), np.nan)
+        if present is None:
+            present = self.term_present[None]
+        if self.defuzzifier == 'analytic':
+            return self.analytic_centroid(cuts, present)
+        return self.resampled_centroid(cuts, present)
+
+    def analytic_centroid(self, cuts, present):
+        # Centroide exacto del conjunto agregado: sin remuestrear ni ordenar, unas pocas evaluaciones
+        # de polinomio por grupo
+        area, moment = self.centroid_tables.integrals(np.where(present, cuts, 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = self.centroid_tables.origin + moment / area
+        return np.where(area > 0, result, np.nan)
+
+    def resampled_centroid(self, cuts, present):
+        # Centroide sobre el universo de salida remuestreado igual que skfuzzy: se añaden los puntos
+        # donde cada término cruza su nivel de corte
+        n, groups, terms = cuts.shape
+        x = self.output_universe
+        mfs = self.output_mfs
+        c = cuts[..., None]
+
+        m0, m1 = mfs[:, :-1], mfs[:, 1:]
+        x0, x1 = x[:-1], x[1:]
+        zero_cut = c == 0.0
+        crossing = np.where(zero_cut, m0 > c, m0 >= c) != np.where(zero_cut, m1 > c, m1 >= c)
+        slope = np.where(m1 != m0, m1 - m0, 1.0)
+        points = x0 + (c - m0) * (x1 - x0) / slope
+        points = np.where(crossing & present[..., None], points, x0)
+
+        universe = np.broadcast_to(x, (n, groups, x.size))
+        xs = np.sort(np.concatenate([universe, points.reshape(n, groups, -1)], axis=-1), axis=-1)
+
+        mu = np.zeros_like(xs)
+        for k in range(terms):
+            clipped = np.minimum(cuts[:, :, k, None], np.interp(xs, x, mfs[k]))
+            mu = np.maximum(mu, np.where(present[:, :, k, None], clipped, 0.0))
+
+        dx = np.diff(xs, axis=-1)
+        y1, y2 = mu[..., :-1], mu[..., 1:]
+        area = (0.5 * dx * (y1 + y2)).sum(axis=-1)
+        moment = (dx / 6.0 * (xs[..., :-1] * (2.0 * y1 + y2) + xs[..., 1:] * (y1 + 2.0 * y2))).sum(axis=-1)
+        result = moment / np.fmax(area, np.finfo(float).eps)
+
+        empty = (mu.sum(axis=-1) == 0) | ~present.any(axis=-1)
+        return np.where(empty, np.nan, result)
+
+    def upper_bounds(self, cuts):
+        # Cota superior del centroide que calcula defuzzify(), sin remuestrear; inf si no hay cota
+        # y -inf para los grupos sin ningún término activado (defuzzify() devuelve NaN)
+        if self.centroid_tables is None:
+            return np.full(cuts.shape[:2], np.inf)
+        # Con el centroide analítico no hay error de interpolación: la cota es el propio valor
+        return self.centroid_tables.upper_bounds(
+            np.where(self.term_present[None], cuts, 0.0), resampled=self.defuzzifier == 'centroid')
+
+    def defuzzify_top(self, cuts, top_k):
+        # Solo se defuzzifican los grupos que pueden entrar entre los top_k; el resto queda en -inf
+        n, groups, _ = cuts.shape
+        if groups <= top_k:
+            return self.defuzzify(cuts)
+        results = np.full((n, groups), -np.inf)
+        bounds = self.upper_bounds(cuts)
+
+        # Primera ronda: los top_k grupos con mayor cota fijan un umbral (el k-ésimo valor exacto)
+        selected = np.zeros((n, groups), dtype=bool)
+        np.put_along_axis(selected, np.argsort(-bounds, axis=1)[:, :top_k], True, axis=1)
+        self._defuzzify_selected(cuts, selected, results)
+        threshold = np.sort(np.nan_to_num(results, nan=-np.inf), axis=1)[:, -top_k]
+
+        # Segunda ronda: los grupos cuya cota aún alcanza el umbral; el umbral solo puede subir
+        pending = ~selected & (bounds >= threshold[:, None] - self.prune_margin)
+        self._defuzzify_selected(cuts, pending, results)
+        return results
+
+    def defuzzify_by_group(self, cuts):
+        # Igual que defuzzify(), un grupo cada vez para medir cada uno en una petición instrumentada.
+        # Las reglas se evalúan juntas para todos los grupos y solo tienen una duración común
+        results = np.empty(cuts.shape[:2])
+        for g, name in enumerate(self.group_names):
+            with stage('defuzzify', name):
+                results[:, g] = self.defuzzify(cuts[:, g:g + 1], present=self.term_present[None, g:g + 1])[:, 0]
+        return results
+
+    def _defuzzify_selected(self, cuts, mask, results):
+        rows, groups = np.nonzero(mask)
+        if rows.size and timing_groups():
+            for g in np.unique(groups).tolist():
+                selected = groups == g
+                with stage('defuzzify', self.group_names[g]):
+                    results[rows[selected], g] = self.defuzzify(
+                        cuts[rows[selected], g][:, None, :], present=self.term_present[None, g:g + 1])[:, 0]
+        elif rows.size:
+            results[rows, groups] = self.defuzzify(
+                cuts[rows, groups][:, None, :], present=self.term_present[groups][:, None, :])[:, 0]
+
+    def evaluate_memberships(self, memberships, top_k=None):
+        results = []
+        for start in range(0, memberships.shape[0], self.chunk_size):
+            chunk = memberships[start:start + self.chunk_size]
+            with stage('rules'):
+                cuts = self.activations(self.rule_strengths(chunk))
+            with stage('defuzzify'):
+                if top_k is not None:
+                    results.append(self.defuzzify_top(cuts, top_k))
+                elif timing_groups():
+                    results.append(self.defuzzify_by_group(cuts))
+                else:
+                    results.append(self.defuzzify(cuts))
+        if not results:
+            return np.empty((0, len(self.group_names)))
+        return np.concatenate(results, axis=0)
+
+    def evaluate(self, rows, top_k=None):
+        # Probabilidad (N, grupos) para un lote de entradas en una sola pasada vectorizada.
+        # Con top_k los grupos que no pueden quedar entre los top_k primeros se devuelven como -inf
+        with stage('fuzzify'):
+            memberships = self.fuzzify(rows)
+        return self.evaluate_memberships(memberships, top_k)
+
+
+def take_rows(rows, indices):
+    # Filas seleccionadas de una lista de diccionarios o de una matriz de entradas
+    if isinstance(rows, np.ndarray):
+        return rows[indices]
+    return [rows[index] for index in indices]
+
+
+def project_inputs(rows, positions):
+    # Entradas para una base compilada con un subconjunto de las variables (positions de positions_in()).
+    # De una matriz se toman esas columnas; los diccionarios se consultan por nombre y se pasan tal cual
+    if isinstance(rows, np.ndarray):
+        return rows[:, positions]
+    return rows
+
+
+class CentroidTables:
+    # Área y momento de min(c, mf) en función del nivel de corte c para cada conjunto de términos de
+    # salida, como polinomios por tramos (grado 2 y 3) entre las alturas de los vértices. Con la identidad
+    # max(a, b, ...) = sum_S (-1)^(|S|+1) min(S) dan el área y el momento exactos del conjunto agregado.
+    max_terms = 8
+
+    def __init__(self, origin, width, members, signs, heights, coefficients, interpolation_error):
+        self.origin = origin
+        self.width = width
+        self.members = members
+        self.signs = signs
+        self.heights = heights
+        self.coefficients = coefficients
+        self.interpolation_error = interpolation_error
+
+    @classmethod
+    def build(cls, universe, mfs):
+        terms = len(mfs)
+        if not terms or terms > cls.max_terms or universe.size < 2:
+            return None
+        x = universe - universe[0]
+
+        # Universo refinado con los cruces entre términos: el mínimo de cualquier conjunto es lineal en cada tramo
+        points = [x]
+        for t, u in combinations(range(terms), 2):
+            d0, d1 = mfs[t][:-1] - mfs[u][:-1], mfs[t][1:] - mfs[u][1:]
+            cross = d0 * d1 < 0
+            points.append(x[:-1][cross] + d0[cross] * np.diff(x)[cross] / (d0 - d1)[cross])
+        refined = np.unique(np.concatenate(points))
+        curves = np.array([np.interp(refined, x, mf) for mf in mfs])
+
+        subsets = [subset for size in range(1, terms + 1) for subset in combinations(range(terms), size)]
+        members = np.zeros((len(subsets), terms), dtype=bool)
+        heights, coefficients = [], []
+        for p, subset in enumerate(subsets):
+            members[p, list(subset)] = True
+            curve = curves[list(subset)].min(axis=0)
+            levels = np.unique(np.concatenate([[0.0], curve]))
+            if levels.size < 2:
+                # Términos que no se solapan: el mínimo es cero para cualquier corte
+                levels = np.array([0.0, 1.0])
+            # Cuatro puntos por tramo determinan el polinomio cúbico; se ajusta en c - altura inferior
+            local = []
+            for low, high in zip(levels[:-1], levels[1:]):
+                samples = np.linspace(low, high, 4)
+                area, moment = _clipped_integrals(refined, curve, samples)
+                vandermonde = np.vander(samples - low, 4)
+                local.append([np.linalg.solve(vandermonde, area), np.linalg.solve(vandermonde, moment)])
+            heights.append(levels)
+            coefficients.append(np.array(local).reshape(-1, 2, 4))
+
+        # Cota del exceso de área de la interpolación lineal de defuzzify() sobre el máximo exacto, según
+        # qué términos tienen corte > 0: solo aparece en tramos del universo con dos o más de ellos positivos,
+        # y en cada uno es a lo sumo ancho^2 * (pendiente máxima - mínima) / 8
+        slopes = np.diff(mfs, axis=1) / np.diff(x)
+        positive = (mfs[:, :-1] > 0) | (mfs[:, 1:] > 0)
+        interpolation_error = np.zeros(2 ** terms)
+        for mask in range(2 ** terms):
+            active = positive & (((mask >> np.arange(terms)) & 1) == 1)[:, None]
+            spread = (np.fmax(np.where(active, slopes, 0.0).max(axis=0), 0.0)
+                      - np.fmin(np.where(active, slopes, 0.0).min(axis=0), 0.0))
+            overlapping = active.sum(axis=0) >= 2
+            interpolation_error[mask] = (np.diff(x) ** 2 * spread / 8.0)[overlapping].sum()
+
+        return cls(
+            origin=float(universe[0]),
+            width=float(x[-1]),
+            members=members,
+            signs=np.array([1.0 if len(subset) % 2 else -1.0 for subset in subsets]),
+            heights=heights,
+            coefficients=coefficients,
+            interpolation_error=interpolation_error,
+        )
+
+    def integrals(self, cuts):
+        # Área y momento (respecto al inicio del universo) del conjunto agregado, (N, grupos) cada uno
+        area = np.zeros(cuts.shape[:-1])
+        moment = np.zeros(cuts.shape[:-1])
+        for p, members in enumerate(self.members):
+            levels = self.heights[p]
+            c = np.clip(cuts[..., members].min(axis=-1), 0.0, levels[-1])
+            interval = np.clip(np.searchsorted(levels, c, side='right') - 1, 0, len(levels) - 2)
+            t = c - levels[interval]
+            coefficients = self.coefficients[p][interval]
+            values = ((coefficients[..., 0] * t[..., None] + coefficients[..., 1]) * t[..., None]
+                      + coefficients[..., 2]) * t[..., None] + coefficients[..., 3]
+            area += self.signs[p] * values[..., 0]
+            moment += self.signs[p] * values[..., 1]
+        return area, moment
+
+    def upper_bounds(self, cuts, resampled=True):
+        # El centroide remuestreado integra la interpolación lineal del máximo, que está por encima
+        # del máximo exacto en a lo sumo E de área: (M + ancho * E) / (A + E) lo acota
+        area, moment = self.integrals(cuts)
+        fired = (cuts > 0).astype(int) << np.arange(cuts.shape[-1])
+        error = self.interpolation_error[fired.sum(axis=-1)] if resampled else 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bounds = self.origin + (moment + self.width * error) / (area + error)
+        bounds = np.where(area > 1e-9, bounds, np.inf)
+        return np.where((cuts > 0).any(axis=-1), bounds, -np.inf)
+
+
+def _clipped_integrals(x, y, cuts):
+    # Área y momento exactos de min(c, y) para una curva lineal por tramos; cada tramo se parte
+    # en el punto donde cruza el nivel de corte
+    c = np.asarray(cuts, dtype=float)[..., None]
+    x0, x1, m0, m1 = x[:-1], x[1:], y[:-1], y[1:]
+    y0, y1 = np.minimum(c, m0), np.minimum(c, m1)
+    crossing = (m0 - c) * (m1 - c) < 0
+    slope = np.where(m1 != m0, m1 - m0, 1.0)
+    p = np.where(crossing, x0 + (c - m0) * (x1 - x0) / slope, x1)
+    yp = np.where(crossing, c, y1)
+    area = 0.5 * ((p - x0) * (y0 + yp) + (x1 - p) * (yp + y1))
+    moment = ((p - x0) / 6.0 * (x0 * (2.0 * y0 + yp) + p * (y0 + 2.0 * yp))
+              + (x1 - p) / 6.0 * (p * (2.0 * yp + y1) + x1 * (yp + 2.0 * y1)))
+    return area.sum(axis=-1), moment.sum(axis=-1)
+
+
+def compile_rule_base(systems, defuzzifier='centroid'):
+    # systems: lista de (nombre del grupo, ControlSystem, Consequent de salida)
+    variables = {}
+    output = None
+    group_rules = []
+
+    for group_name, system_ctrl, output_variable in systems:
+        rules = list(system_ctrl.rules)
+        if rules and output is None:
+            output = output_variable
+        group_rules.append((group_name, rules))
+        for rule in rules:
+            for term in rule.antecedent_terms:
+                variables.setdefault(term.parent.label, term.parent)
+
+    variable_names = list(variables)
+    group_variables = []
+    for group_name, rules in group_rules:
+        used = {term.parent.label for rule in rules for term in rule.antecedent_terms}
+        group_variables.append([v for v, name in enumerate(variable_names) if name in used])
+    universes = [np.asarray(variables[name].universe, dtype=float) for name in variable_names]
+    term_labels = [list(variables[name].terms) for name in variable_names]
+    term_mfs = [np.array([term.mf for term in variables[name].terms.values()], dtype=float)
+                for name in variable_names]
+
+    columns = {}
+    for name, labels in zip(variable_names, term_labels):
+        for label in labels:
+            columns[(name, label)] = len(columns)
+    term_count = len(columns)
+    one, zero = 2 * term_count, 2 * term_count + 1
+
+    if output is None:
+        output_universe = np.arange(0, 2, dtype=float)
+        output_labels = []
+        output_mfs = np.zeros((0, 2))
+    else:
+        output_universe = np.asarray(output.universe, dtype=float)
+        output_labels = list(output.terms)
+        output_mfs = np.array([term.mf for term in output.terms.values()], dtype=float)
+
+    rule_clauses = []
+    rule_weights = []
+    rule_slots = []
+    for g, (group_name, rules) in enumerate(group_rules):
+        for rule in rules:
+            # skfuzzy aplica las funciones de la regla solo al nodo raíz del antecedente
+            _check_aggregation(rule.and_func, rule.or_func)
+            clauses = [[columns[key] + (term_count if negated else 0) for key, negated in clause]
+                       for clause in _disjunctive_form(rule.antecedent, root=True)]
+            for weighted in rule.consequent:
+                term = weighted.term
+                if not _same_output(term.parent, output_universe, output_labels, output_mfs):
+                    raise ValueError(f"Group '{group_name}' uses a different output variable")
+                rule_clauses.append(clauses)
+                rule_weights.append(weighted.weight)
+                rule_slots.append(g * len(output_labels) + output_labels.index(term.label))
+
+    # Relleno: literal neutro (1) dentro de una cláusula y cláusula nula (0) dentro de una regla
+    max_clauses = max((len(clauses) for clauses in rule_clauses), default=1)
+    max_literals = max((len(clause) for clauses in rule_clauses for clause in clauses), default=1)
+    clause_index = np.full((len(rule_clauses), max_clauses, max_literals), one, dtype=np.intp)
+    for r, clauses in enumerate(rule_clauses):
+        clause_index[r, len(clauses):, 0] = zero
+        for c, clause in enumerate(clauses):
+            clause_index[r, c, :len(clause)] = clause
+
+    slot_count = len(group_rules) * len(output_labels)
+    members = [[] for _ in range(slot_count)]
+    for r, slot in enumerate(rule_slots):
+        members[slot].append(r)
+    max_members = max((len(m) for m in members), default=1) or 1
+    slot_index = np.full((slot_count, max_members), len(rule_slots), dtype=np.intp)
+    for slot, rule_ids in enumerate(members):
+        slot_index[slot, :len(rule_ids)] = rule_ids
+    term_present = np.array([bool(m) for m in members], dtype=bool).reshape(
+        len(group_rules), len(output_labels))
+
+    return CompiledRuleBase(
+        group_names=[name for name, _ in group_rules],
+        variable_names=variable_names,
+        universes=universes,
+        term_labels=term_labels,
+        term_mfs=term_mfs,
+        clause_index=clause_index,
+        rule_weights=np.asarray(rule_weights, dtype=float),
+        slot_rules=slot_index,
+        term_present=term_present,
+        output_universe=output_universe,
+        output_labels=output_labels,
+        output_mfs=output_mfs,
+        group_variables=group_variables,
+        defuzzifier=defuzzifier,
+    )
+
+
+def _check_aggregation(and_func, or_func):
+    if and_func is not np.fmin or or_func is not np.fmax:
+        raise ValueError("Only min/max (fmin/fmax) rule aggregation can be compiled")
+
+
+def _disjunctive_form(node, negate=False, root=False):
+    # Devuelve una lista de cláusulas; cada cláusula es una tupla de ((variable, término), negado)
+    from skfuzzy.control.term import Term, TermAggregate
+
+    if isinstance(node, Term):
+        return [(((node.parent.label, node.label), negate),)]
+    if not isinstance(node, TermAggregate):
+        raise ValueError(f"Unsupported antecedent: {node!r}")
+    if not root:
+        _check_aggregation(node.agg_methods.and_func, node.agg_methods.or_func)
+    if node.kind == 'not':
+        return _disjunctive_form(node.term1, not negate)
+
+    kind = node.kind
+    if negate:
+        # De Morgan: 1 - max(a, b) == min(1 - a, 1 - b)
+        kind = 'or' if kind == 'and' else 'and'
+    left = _disjunctive_form(node.term1, negate)
+    right = _disjunctive_form(node.term2, negate)
+    if kind == 'or':
+        return left + right
+    return [a + b for a in left for b in right]
+
+
+def _same_output(variable, universe, labels, mfs):
+    return (
+        np.array_equal(np.asarray(variable.universe, dtype=float), universe)
+        and list(variable.terms) == labels
+        and all(np.array_equal(term.mf, mf) for term, mf in zip(variable.terms.values(), mfs))
+    )
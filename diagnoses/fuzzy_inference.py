@@ -1,30 +1,91 @@
+import threading
+import time
+from collections import defaultdict
+
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-from .models import DiseaseGroup, GroupSymptom, Symptom, VitalSigns
+from django.conf import settings
+from .executors import build_executor
+from .fuzzy_engine import compile_rule_base
+from .inference_cache import get_result_cache
+from .input_schema import InputSchema
+from .instrumentation import stage
+from .lookup_tables import load_lookup_tables
+from .models import DiseaseGroup, FuzzyRule, GroupSymptom, Symptom, VersionStamp, VitalSigns
+from .rules import antecedent_variables, build_antecedent
+
+# skfuzzy arrastra scipy y networkx (unos 300 ms de importación): se importa al compilar el motor, no al
+# cargar el módulo, para que las señales, el admin y comandos como migrate o clear_data no lo paguen
+
+# Sello de versión de la base de reglas y de los catálogos que usa el motor
+RULE_BASE_VERSION = 'rule_base'
+
+VITAL_SIGN_FIELDS = ['systolic', 'diastolic', 'heart_rate', 'respiratory_rate', 'temperature', 'weight']
+
+
+def normalize_name(name):
+    # Nombre de la variable lingüística a partir del nombre del síntoma, por ejemplo "Dolor de cabeza"
+    return name.lower().replace(" ", "_")
+
 
 class FuzzyDiseaseGroupDiagnosis:
+    # Grupos que devuelve el diagnóstico
+    top_k = 3
+
     def __init__(self):
-        self.disease_groups = DiseaseGroup.objects.all()
+        # La versión se lee antes que las reglas: un cambio posterior siempre deja la versión adelantada
+        self.rule_base_version = VersionStamp.current(RULE_BASE_VERSION)
+        # Los códigos CIE se precargan para serializar los grupos sin volver a la base de datos
+        self.disease_groups = list(DiseaseGroup.objects.prefetch_related('cie_codes'))
         self.variables = {}
-        self.define_variables()
+        self.symptom_variables = []
+        self.symptom_ids = {}  # Id del síntoma -> nombre de su variable
+        self.systems = {}
+        self.rules = defaultdict(list)
+        with stage('load_rules'):
+            for rule in FuzzyRule.objects.order_by('disease_group_id', 'order', 'pk'):
+                self.rules[rule.disease_group_id].append(rule)
+        # Los Antecedent se comparten entre grupos y skfuzzy guarda en ellos el estado de cada simulación
+        self._lock = threading.Lock()
+        with stage('define_variables'):
+            self.define_variables()
+        with stage('compile_systems'):
+            self.compile_systems()
 
     def define_variables(self):
+        import skfuzzy as fuzz
+        from skfuzzy import control as ctrl
+
         # Definir variables lingüísticas para síntomas y signos vitales
         all_symptoms = Symptom.objects.all()
 
+        # Solo se crean antecedentes para los síntomas que usa alguna regla; el resto no influye en el resultado
+        referenced = set()
+        for rules in self.rules.values():
+            for rule in rules:
+                referenced |= antecedent_variables(rule.antecedent)
+
         for symptom in all_symptoms:
-                symptom_name = symptom.name.lower().replace(" ", "_")
+                symptom_name = normalize_name(symptom.name)
+                self.symptom_variables.append(symptom_name)
+                self.symptom_ids[symptom.pk] = symptom_name
+                if symptom_name not in referenced:
+                    continue
                 self.variables[symptom_name] = ctrl.Antecedent(np.arange(0, 4, 1), symptom_name)  # Cambiado a rango de 0 a 3
                 self.variables[symptom_name]['low'] = fuzz.trimf(self.variables[symptom_name].universe, [0, 0, 1])
                 self.variables[symptom_name]['normal'] = fuzz.trimf(self.variables[symptom_name].universe, [1, 2, 3])
                 self.variables[symptom_name]['high'] = fuzz.trimf(self.variables[symptom_name].universe, [2, 3, 3])
 
         # Definir variables para signos vitales
-        self.variables['blood_pressure'] = ctrl.Antecedent(np.arange(80, 181, 1), 'blood_pressure')
-        self.variables['blood_pressure']['low'] = fuzz.trimf(self.variables['blood_pressure'].universe, [80, 80, 120])
-        self.variables['blood_pressure']['normal'] = fuzz.trimf(self.variables['blood_pressure'].universe, [110, 120, 140])
-        self.variables['blood_pressure']['high'] = fuzz.trimf(self.variables['blood_pressure'].universe, [130, 180, 180])
+        # Presión arterial en mmHg, sistólica y diastólica por separado
+        self.variables['systolic'] = ctrl.Antecedent(np.arange(80, 181, 1), 'systolic')
+        self.variables['systolic']['low'] = fuzz.trimf(self.variables['systolic'].universe, [80, 80, 120])
+        self.variables['systolic']['normal'] = fuzz.trimf(self.variables['systolic'].universe, [110, 120, 140])
+        self.variables['systolic']['high'] = fuzz.trimf(self.variables['systolic'].universe, [130, 180, 180])
+
+        self.variables['diastolic'] = ctrl.Antecedent(np.arange(40, 131, 1), 'diastolic')
+        self.variables['diastolic']['low'] = fuzz.trimf(self.variables['diastolic'].universe, [40, 40, 70])
+        self.variables['diastolic']['normal'] = fuzz.trimf(self.variables['diastolic'].universe, [60, 75, 85])
+        self.variables['diastolic']['high'] = fuzz.trimf(self.variables['diastolic'].universe, [80, 130, 130])
 
         self.variables['heart_rate'] = ctrl.Antecedent(np.arange(60, 161, 1), 'heart_rate')
         self.variables['heart_rate']['low'] = fuzz.trimf(self.variables['heart_rate'].universe, [60, 60, 80])
@@ -47,318 +108,24 @@ class FuzzyDiseaseGroupDiagnosis:
         self.variables['weight']['high'] = fuzz.trimf(self.variables['weight'].universe, [90, 150, 150])
 
     def create_system_for_group(self, group):
+        import skfuzzy as fuzz
+        from skfuzzy import control as ctrl
+
         rules = []
         probability = ctrl.Consequent(np.arange(0, 101, 1), 'probability')
         probability['low'] = fuzz.trimf(probability.universe, [0, 0, 50])
         probability['normal'] = fuzz.trimf(probability.universe, [25, 50, 75])
         probability['high'] = fuzz.trimf(probability.universe, [50, 100, 100])
 
-        # Reglas para el grupo "Infecciones Respiratorias Agudas"
-        if group.name == "Infecciones Respiratorias Agudas":
-            # Reglas para síntomas respiratorios y fiebre alta
-            rules.append(ctrl.Rule(self.variables['congestión_nasal']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_garganta']['high'] | self.variables['dolor_de_garganta']['normal'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['estornudos']['high'] & self.variables['congestión_nasal']['high'], probability['high']))
-            
-            # Combinaciones de fiebre alta con otros síntomas respiratorios severos
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & (self.variables['tos']['high'] | self.variables['dolor_de_garganta']['high']), probability['high']))
-            rules.append(ctrl.Rule(self.variables['dificultad_para_respirar']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['respiratory_rate']['high'] & self.variables['fiebre']['high'], probability['high']))
-
-            # Nuevas combinaciones críticas
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['respiratory_rate']['high'] & self.variables['fiebre']['high'] & self.variables['congestión_nasal']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_garganta']['high'] & self.variables['tos']['high'] & self.variables['congestión_nasal']['high'], probability['high']))
-
-            # Combinación crítica de todos los síntomas principales en alto
-            rules.append(ctrl.Rule(
-                self.variables['congestión_nasal']['high'] &
-                self.variables['dolor_de_garganta']['high'] &
-                self.variables['estornudos']['high'] &
-                self.variables['fiebre']['high'] &
-                self.variables['tos']['high'],
-                probability['high']
-            ))
-
-            # Penalización para fiebre baja junto con otros síntomas de baja intensidad
-            rules.append(ctrl.Rule(self.variables['fiebre']['low'] & self.variables['congestión_nasal']['low'], probability['low']))
-
-        # Reglas para el grupo "Enfermedades Gastrointestinales"
-        elif group.name == "Enfermedades Gastrointestinales":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['náuseas']['high'] & self.variables['vómitos']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['diarrea']['high'] & self.variables['dolor_abdominal']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['náuseas']['high'] & self.variables['dolor_abdominal']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['vómitos']['high'] & self.variables['diarrea']['high'], probability['high']))
-
-            # Uso de signos vitales con síntomas clave
-            rules.append(ctrl.Rule(self.variables['diarrea']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['náuseas']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['vómitos']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_abdominal']['high'] & self.variables['blood_pressure']['low'], probability['high']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['náuseas']['normal'] & self.variables['vómitos']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['diarrea']['normal'] & self.variables['dolor_abdominal']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['náuseas']['normal'] & self.variables['diarrea']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['dolor_abdominal']['normal'] & self.variables['heart_rate']['normal'], probability['normal']))
-
-            # Penalizaciones y probabilidades bajas
-            rules.append(ctrl.Rule(self.variables['fiebre']['low'] & self.variables['náuseas']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['diarrea']['low'] & self.variables['dolor_abdominal']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['náuseas']['low'] & self.variables['vómitos']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['low'] & self.variables['diarrea']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['náuseas']['high'] &
-                self.variables['vómitos']['high'] &
-                self.variables['diarrea']['high'] &
-                self.variables['dolor_abdominal']['high'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['náuseas']['high'] &
-                self.variables['vómitos']['high'] &
-                self.variables['fiebre']['high'] &
-                self.variables['heart_rate']['high'],
-                probability['high']
-            ))
-
-            # Fiebre alta sin presencia de náuseas o vómitos (posible infección no gastrointestinal)
-            rules.append(ctrl.Rule(
-                self.variables['fiebre']['high'] & ~(self.variables['náuseas']['high'] | self.variables['vómitos']['high']),
-                probability['low']
-            ))
-
-        # Reglas para el grupo "Enfermedades Infecciosas y Parasitarias"
-        elif group.name == "Enfermedades Infecciosas y Parasitarias":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['diarrea']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['pérdida_de_apetito']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['dolor_abdominal']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['diarrea']['high'] & self.variables['fatiga']['high'], probability['high']))
-            
-            # Uso de signos vitales con síntomas
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['respiratory_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['temperature']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['diarrea']['high'] & self.variables['blood_pressure']['low'], probability['high']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['dolor_abdominal']['normal'] & self.variables['diarrea']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['normal'] & self.variables['pérdida_de_apetito']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['náuseas']['normal'] & self.variables['vómitos']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['fatiga']['normal'] & self.variables['heart_rate']['normal'], probability['normal']))
-
-            # Combinaciones leves y penalizaciones
-            rules.append(ctrl.Rule(self.variables['diarrea']['low'] & self.variables['dolor_abdominal']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['low'] & self.variables['náuseas']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['pérdida_de_apetito']['low'] & self.variables['vómitos']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['temperature']['low'] & self.variables['fiebre']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['fiebre']['high'] &
-                self.variables['diarrea']['high'] &
-                self.variables['dolor_abdominal']['high'] &
-                self.variables['fatiga']['high'] &
-                self.variables['heart_rate']['high'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['fiebre']['high'] &
-                self.variables['vómitos']['high'] &
-                self.variables['náuseas']['high'] &
-                self.variables['temperature']['high'],
-                probability['high']
-            ))
-
-        # Reglas para el grupo "Enfermedades del Sistema Nervioso"
-        elif group.name == "Enfermedades del Sistema Nervioso":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['high'] & self.variables['mareos']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['high'] & self.variables['fatiga']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['mareos']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['high'] & self.variables['blood_pressure']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['mareos']['high'] & self.variables['blood_pressure']['high'], probability['high']))
-
-            # Uso de signos vitales
-            rules.append(ctrl.Rule(self.variables['heart_rate']['high'] & self.variables['dolor_de_cabeza']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['high'] & self.variables['mareos']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['respiratory_rate']['high'] & self.variables['dolor_de_cabeza']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['temperature']['high'] & self.variables['dolor_de_cabeza']['high'], probability['high']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['normal'] & self.variables['mareos']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['normal'] & self.variables['fatiga']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['normal'] & self.variables['mareos']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['heart_rate']['normal'] & self.variables['dolor_de_cabeza']['normal'], probability['normal']))
-
-            # Penalizaciones y probabilidades bajas
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['low'] & self.variables['mareos']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['heart_rate']['low'] & self.variables['dolor_de_cabeza']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['low'] & self.variables['mareos']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['temperature']['low'] & self.variables['dolor_de_cabeza']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['dolor_de_cabeza']['high'] &
-                self.variables['mareos']['high'] &
-                self.variables['heart_rate']['high'] &
-                self.variables['blood_pressure']['high'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['dolor_de_cabeza']['high'] &
-                self.variables['fatiga']['high'] &
-                self.variables['temperature']['high'] &
-                self.variables['respiratory_rate']['high'],
-                probability['high']
-            ))
-
-
-        # Reglas para el grupo "Enfermedades del Sistema Urinario"
-        elif group.name == "Enfermedades del Sistema Urinario":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['high'] & self.variables['dolor_abdominal']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['high'] & self.variables['fatiga']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['dolor_abdominal']['high'], probability['high']))
-
-            # Uso de signos vitales con síntomas clave
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['high'] & self.variables['blood_pressure']['low'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['normal'] & self.variables['blood_pressure']['low'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['high'] & self.variables['respiratory_rate']['high'], probability['high']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['normal'] & self.variables['fiebre']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['normal'] & self.variables['dolor_abdominal']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['normal'] & self.variables['fiebre']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['normal'] & self.variables['fatiga']['normal'], probability['normal']))
-
-            # Penalizaciones y probabilidades bajas
-            rules.append(ctrl.Rule(self.variables['dolor_al_orinar']['low'] & self.variables['fiebre']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['low'] & self.variables['fiebre']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['heart_rate']['low'] & self.variables['dolor_abdominal']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['dolor_al_orinar']['high'] &
-                self.variables['fiebre']['high'] &
-                self.variables['dolor_abdominal']['high'] &
-                self.variables['blood_pressure']['low'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['dolor_al_orinar']['high'] &
-                self.variables['fiebre']['high'] &
-                self.variables['heart_rate']['high'] &
-                self.variables['respiratory_rate']['high'],
-                probability['high']
-            ))
-
-        # Reglas para el grupo "Enfermedades de la Piel y Tejido Subcutáneo"
-        elif group.name == "Enfermedades de la Piel y Tejido Subcutáneo":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['dolor_abdominal']['low'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['erupciones_cutáneas']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['fatiga']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['fiebre']['normal'], probability['normal']))
-
-            # Uso de signos vitales con síntomas clave
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['fiebre']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['erupciones_cutáneas']['high'] & self.variables['temperature']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['picazón']['high'] & self.variables['respiratory_rate']['high'], probability['normal']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['picazón']['normal'] & self.variables['erupciones_cutáneas']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['picazón']['normal'] & self.variables['fatiga']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['normal'] & self.variables['erupciones_cutáneas']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['picazón']['normal'] & self.variables['heart_rate']['normal'], probability['normal']))
-
-            # Penalizaciones y probabilidades bajas
-            rules.append(ctrl.Rule(self.variables['picazón']['low'] & self.variables['erupciones_cutáneas']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['picazón']['low'] & self.variables['fatiga']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['heart_rate']['low'] & self.variables['picazón']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['fiebre']['low'] & self.variables['erupciones_cutáneas']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['picazón']['high'] &
-                self.variables['erupciones_cutáneas']['high'] &
-                self.variables['fiebre']['high'] &
-                self.variables['heart_rate']['high'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['picazón']['high'] &
-                self.variables['fatiga']['high'] &
-                self.variables['temperature']['high'] &
-                self.variables['erupciones_cutáneas']['high'],
-                probability['high']
-            ))
-
-
-        # Reglas para el grupo "Enfermedades del Sistema Circulatorio"
-        elif group.name == "Enfermedades del Sistema Circulatorio":
-            # Combinaciones altas de síntomas clave
-            rules.append(ctrl.Rule(self.variables['mareos']['high'] & self.variables['fatiga']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['high'] & self.variables['mareos']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fatiga']['high'] & self.variables['dolor_de_cabeza']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['high'] & self.variables['fatiga']['high'], probability['high']))
-
-            # Uso de signos vitales con síntomas clave
-            rules.append(ctrl.Rule(self.variables['mareos']['high'] & self.variables['blood_pressure']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['fatiga']['high'] & self.variables['heart_rate']['high'], probability['high']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['high'] & self.variables['heart_rate']['high'], probability['high']))
-
-            # Combinaciones moderadas
-            rules.append(ctrl.Rule(self.variables['mareos']['normal'] & self.variables['dolor_de_cabeza']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['fatiga']['normal'] & self.variables['blood_pressure']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['mareos']['normal'] & self.variables['heart_rate']['normal'], probability['normal']))
-            rules.append(ctrl.Rule(self.variables['dolor_de_cabeza']['normal'] & self.variables['heart_rate']['normal'], probability['normal']))
-
-            # Penalizaciones y probabilidades bajas
-            rules.append(ctrl.Rule(self.variables['mareos']['low'] & self.variables['fatiga']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['blood_pressure']['low'] & self.variables['dolor_de_cabeza']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['heart_rate']['low'] & self.variables['mareos']['low'], probability['low']))
-            rules.append(ctrl.Rule(self.variables['fatiga']['low'] & self.variables['heart_rate']['low'], probability['low']))
-
-            # Casos críticos: múltiples síntomas altos simultáneamente
-            rules.append(ctrl.Rule(
-                self.variables['mareos']['high'] &
-                self.variables['fatiga']['high'] &
-                self.variables['blood_pressure']['high'] &
-                self.variables['heart_rate']['high'],
-                probability['high']
-            ))
-
-            rules.append(ctrl.Rule(
-                self.variables['dolor_de_cabeza']['high'] &
-                self.variables['mareos']['high'] &
-                self.variables['blood_pressure']['high'] &
-                self.variables['heart_rate']['high'],
-                probability['high']
-            ))
-
-            # Consideración para niveles intermedios
-            rules.append(ctrl.Rule(
-                self.variables['blood_pressure']['normal'] & 
-                self.variables['fatiga']['normal'] & 
-                self.variables['mareos']['normal'],
-                probability['normal']
-            ))
-
+        # Reglas del grupo guardadas en FuzzyRule, en su orden
+        for rule in self.rules.get(group.pk, []):
+            missing = antecedent_variables(rule.antecedent) - self.variables.keys()
+            if missing:
+                raise ValueError(f"Rule {rule.pk} of group '{group.name}' uses unknown variables: {', '.join(sorted(missing))}")
+            consequent = probability[rule.consequent]
+            if rule.weight != 1:
+                consequent = consequent % float(rule.weight)
+            rules.append(ctrl.Rule(build_antecedent(rule.antecedent, self.variables), consequent))
 
         # Crear el sistema de control para el grupo
         system_ctrl = ctrl.ControlSystem(rules)
@@ -366,33 +133,190 @@ class FuzzyDiseaseGroupDiagnosis:
         system.output_variable = probability
         return system
 
-    def diagnose(self, inputs):
-        results = []
-
+    def compile_systems(self):
+        # Construir una sola vez el ControlSystem de cada grupo y su versión vectorizada en NumPy
         for group in self.disease_groups:
-            system = self.create_system_for_group(group)
+            with stage('create_system', group.name):
+                system = self.create_system_for_group(group)
+            self.systems[group.name] = (system.ctrl, system.output_variable)
+        systems = [(group.name, *self.systems[group.name]) for group in self.disease_groups]
+        with stage('compile_rule_base'):
+            self.compiled = compile_rule_base(systems, getattr(settings, 'DIAGNOSIS_DEFUZZIFIER', 'centroid'))
+        # Proyección de entradas por grupo: las variables que referencian sus reglas
+        self.group_inputs = {
+            name: tuple(self.compiled.variable_names[v] for v in variables)
+            for name, variables in zip(self.compiled.group_names, self.compiled.group_variables)
+        }
+        self.symptom_inputs = [name for name in self.compiled.variable_names if name not in VITAL_SIGN_FIELDS]
+        self.schema = InputSchema(self.compiled.variable_names, self.compiled.grids, self.symptom_ids, VITAL_SIGN_FIELDS)
+        # Modo LUT opcional: tablas precalculadas con "manage.py build_fuzzy_luts"
+        self.evaluator = load_lookup_tables(self, getattr(settings, 'DIAGNOSIS_LUT_DIR', None))
+        if self.evaluator is None:
+            # Estrategia de ejecución: serie, hilos o procesos con los grupos repartidos entre trabajadores
+            self.evaluator = build_executor(
+                getattr(settings, 'DIAGNOSIS_EXECUTOR', 'serial'),
+                systems,
+                workers=getattr(settings, 'DIAGNOSIS_EXECUTOR_WORKERS', None),
+                min_rows=getattr(settings, 'DIAGNOSIS_EXECUTOR_MIN_ROWS', 0),
+                compiled=self.compiled,
+            )
+
+    def new_simulation(self, group):
+        # cache=False limpia el estado intermedio tras cada compute() y evita que crezca con cada entrada distinta
+        from skfuzzy import control as ctrl
+
+        system_ctrl, output_variable = self.systems[group.name]
+        system = ctrl.ControlSystemSimulation(system_ctrl, cache=False)
+        system.output_variable = output_variable
+        return system
 
-            # Asignar entradas
-            for key, value in inputs.items():
-                normalized_key = key.lower().replace(" ", "_")
-                if normalized_key in self.variables:
+    def normalize_inputs(self, inputs):
+        return {normalize_name(key): value for key, value in inputs.items()}
+
+    def build_inputs(self, vital_signs, symptom_intensities):
+        # Solo los síntomas que usa alguna regla, con intensidad 0 si no vienen en la solicitud
+        inputs = {name: symptom_intensities.get(name, 0) for name in self.symptom_inputs}
+        for field in VITAL_SIGN_FIELDS:
+            inputs[field] = vital_signs[field]
+        return inputs
+
+    def encode(self, encounters):
+        # Matriz de entradas para diagnose_batch() y entradas rechazadas por encuentro (ver InputSchema)
+        return self.schema.encode(encounters)
+
+    def evaluate(self, inputs_list, top_k=None):
+        # Matriz (N, grupos) de probabilidades; la caché de resultados memoiza las entradas que están en la malla.
+        # Con top_k los grupos que no pueden entrar en el ranking no se defuzzifican y quedan en -inf.
+        # inputs_list: diccionarios {variable: valor} o la matriz que devuelve encode()
+        if isinstance(inputs_list, np.ndarray):
+            rows = inputs_list
+        else:
+            rows = [self.normalize_inputs(inputs) for inputs in inputs_list]
+        cache = get_result_cache()
+        if cache is None:
+            return self.evaluator.evaluate(rows, top_k)
+        return cache.evaluate(self.evaluator, rows, top_k)
+
+    def ranking_top_k(self):
+        return self.top_k if getattr(settings, 'DIAGNOSIS_TOP_K_PRUNING', False) else None
+
+    def group_probabilities(self, inputs):
+        # Evaluar todos los grupos en una sola pasada del motor vectorizado
+        return self._by_group(self.evaluate([inputs])[0])
+
+    def _by_group(self, probabilities):
+        return {
+            name: (float(probability) if np.isfinite(probability) else None)
+            for name, probability in zip(self.compiled.group_names, probabilities)
+        }
+
+    def reference_probabilities(self, inputs):
+        # Evaluación original con ControlSystemSimulation de skfuzzy, usada como referencia de paridad
+        return {group.name: self.reference_group_probability(group, inputs) for group in self.disease_groups}
+
+    def inputs_by_group(self, inputs):
+        # Entradas que consume cada grupo, para explicar qué datos intervinieron en su probabilidad
+        inputs = self.normalize_inputs(inputs)
+        return {
+            name: {variable: inputs[variable] for variable in variables if variable in inputs}
+            for name, variables in self.group_inputs.items()
+        }
+
+    def reference_group_probability(self, group, inputs):
+        inputs = self.normalize_inputs(inputs)
+        with self._lock:
+            system = self.new_simulation(group)
+
+            # Asignar solo las entradas que usan las reglas del grupo
+            for name in self.group_inputs[group.name]:
+                if name in inputs:
                     try:
-                        system.input[normalized_key] = value
+                        system.input[name] = inputs[name]
                     except ValueError:
                         continue
 
             # Calcular probabilidad y obtener el resultado de salida
-            system.compute()
-            probability = system.output.get(system.output_variable.label)
-            if probability is not None:
-                results.append({
-                    'group': group.name,
-                    'probability': probability
-                })
+            with stage('compute', group.name):
+                system.compute()
+            return system.output.get(system.output_variable.label)
 
-        # Ordenar los resultados por probabilidad de diagnóstico en orden descendente
-        results = sorted(results, key=lambda x: x['probability'], reverse=True)
+    def rank(self, probabilities):
+        results = [
+            {'group': name, 'probability': probability}
+            for name, probability in probabilities.items()
+            if probability is not None
+        ]
+
+        # Ordenar los resultados por probabilidad de diagnóstico en orden descendente; se redondea la clave
+        # para que los empates no dependan del último bit de la suma del centroide
+        results = sorted(results, key=lambda x: round(x['probability'], 9), reverse=True)
 
         # Devolver solo los 3 grupos de enfermedades con mayor probabilidad
-        return results[:3]
+        return results[:self.top_k]
 
+    def diagnose(self, inputs):
+        return self.diagnose_batch([inputs])[0]
+
+    def diagnose_batch(self, inputs_list):
+        # Las entradas se apilan como una matriz N x variables y se evalúan juntas
+        return self.rank_batch(self.evaluate(inputs_list, self.ranking_top_k()))
+
+    def rank_batch(self, probabilities):
+        # Ranking de cada fila de una matriz (N, grupos) como la que devuelve evaluate()
+        return [self.rank(self._by_group(row)) for row in probabilities]
+
+    def diagnose_reference(self, inputs):
+        return self.rank(self.reference_probabilities(inputs))
+
+
+# Motor compilado compartido por todas las peticiones del proceso
+_engine = None
+_engine_generation = 0
+_engine_lock = threading.Lock()
+_engine_checked_at = 0.0
+
+
+def get_diagnosis_engine():
+    engine = _engine
+    if engine is not None and not _rule_base_changed(engine):
+        return engine
+
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+        generation = _engine_generation
+
+    # Compilar fuera del candado; si hubo una invalidación mientras tanto no se publica
+    with stage('engine_build'):
+        engine = FuzzyDiseaseGroupDiagnosis()
+    _publish_engine(engine, generation)
+    return engine
+
+
+def _rule_base_changed(engine):
+    # Otros procesos cambian reglas y catálogos; se consulta el sello como mucho una vez por intervalo
+    global _engine_checked_at
+    interval = getattr(settings, 'DIAGNOSIS_RULE_VERSION_CHECK_INTERVAL', None)
+    now = time.monotonic()
+    if interval is None or now - _engine_checked_at < interval:
+        return False
+    _engine_checked_at = now
+    if VersionStamp.current(RULE_BASE_VERSION) == engine.rule_base_version:
+        return False
+    invalidate_diagnosis_engine()
+    return True
+
+
+def _publish_engine(engine, generation):
+    global _engine, _engine_checked_at
+    with _engine_lock:
+        if generation == _engine_generation and _engine is None:
+            _engine = engine
+            _engine_checked_at = time.monotonic()
+
+
+def invalidate_diagnosis_engine():
+    global _engine, _engine_generation
+    with _engine_lock:
+        _engine = None
+        _engine_generation += 1
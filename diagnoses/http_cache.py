@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import VersionStamp
+
+# Caché HTTP de los datos de referencia y de los diagnósticos, que no cambian una vez creados.
+# Los validadores (ETag y Last-Modified) salen del sello "catalogue" (síntomas, grupos y enfermedades)
+# y del id del diagnóstico, así que un 304 o una respuesta ya renderizada no consultan la base de datos.
+# Los borrados quitan la respuesta de la caché (signals.forget_deleted_diagnosis), que por eso debe ser
+# compartida entre procesos.
+
+CATALOGUE_VERSION = 'catalogue'
+
+_catalogue_lock = threading.Lock()
+_catalogue = None  # (versión, fecha del último cambio) del sello
+_catalogue_generation = 0
+_catalogue_checked_at = 0.0
+
+
+def catalogue_stamp():
+    # Otros procesos cambian el catálogo; se relee el sello como mucho una vez por intervalo
+    global _catalogue, _catalogue_checked_at
+    interval = getattr(settings, 'DIAGNOSIS_CATALOGUE_VERSION_CHECK_INTERVAL', None)
+    now = time.monotonic()
+    with _catalogue_lock:
+        if _catalogue is not None and (interval is None or now - _catalogue_checked_at < interval):
+            return _catalogue
+        generation = _catalogue_generation
+
+    stamp = VersionStamp.stamp(CATALOGUE_VERSION)
+    with _catalogue_lock:
+        # Si se invalidó mientras se leía, el valor leído puede ser anterior al cambio
+        if generation == _catalogue_generation:
+            _catalogue, _catalogue_checked_at = stamp, now
+    return stamp
+
+
+def invalidate_catalogue_stamp():
+    global _catalogue, _catalogue_generation
+    with _catalogue_lock:
+        _catalogue = None
+        _catalogue_generation += 1
+
+
+def get_response_cache():
+    alias = getattr(settings, 'DIAGNOSIS_RESPONSE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def diagnosis_response_key(pk, version):
+    return f'diagnosis-response:{version}:{pk}'
+
+
+def forget_diagnosis_response(pk):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.delete(diagnosis_response_key(pk, catalogue_stamp()[0]))
+
+
+def make_etag(*parts):
+    # ETag fuerte: la misma versión produce exactamente los mismos bytes
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def conditional_response(request, etag, last_modified, respond):
+    # 304 (o 412 con If-Match) si el cliente ya tiene esta representación; si no, la de respond()
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+    if response.status_code in (200, 304):
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        # Requiere el token: solo la caché del cliente, que revalida en cada uso
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,129 @@
+import csv
+import hashlib
+import json
+import os
+
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .filters import parse_moment
+from .fuzzy_inference import VITAL_SIGN_FIELDS
+from .models import Diagnosis
+from .serializers import EncounterSerializer
+
+# Carga masiva de encuentros históricos (python manage.py import_encounters). Admite:
+#   - NDJSON con el formato de la API: {"vital_signs": {...}, "symptoms": [{"symptom_id", "intensity"}], "created_at"}
+#   - NDJSON o CSV planos como los de export_diagnoses: signos vitales (o blood_pressure), "symptom:<nombre o id>"
+#     con la intensidad y created_at. Las columnas id y "group:..." se ignoran: el ranking se recalcula
+# Cada registro lleva la clave de idempotencia "import:<sha1 de su contenido>": repetir una importación, o
+# importar otra vez un fichero al que se han añadido registros, solo guarda los que faltan. Dos registros
+# idénticos (incluidos id y created_at) se consideran el mismo encuentro y se guardan una vez.
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# Bytes del principio del fichero que entran en su huella, junto con el tamaño. La huella solo identifica
+# el punto de control; las claves de los diagnósticos no dependen de ella
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def file_fingerprint(path):
+    digest = hashlib.sha1(str(os.path.getsize(path)).encode())
+    with open(path, 'rb') as handle:
+        digest.update(handle.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()[:16]
+
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(handle, import_format):
+    # (número de registro desde 1, diccionario) sin cargar el fichero; las líneas en blanco no cuentan
+    if import_format == 'csv':
+        yield from enumerate(csv.DictReader(handle), start=1)
+        return
+    number = 0
+    for line in handle:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            record = ValueError(f"Invalid JSON: {error}")
+        yield number, record
+
+
+class EncounterParser:
+    # Convierte cada registro en un encuentro validado por EncounterSerializer, o lanza ValidationError
+    def __init__(self, symptoms):
+        self.symptoms = symptoms  # Síntomas por id
+        # Una sola instancia para todos los registros, como el hijo de un ListSerializer: construir los campos
+        # del serializador en cada fila costaría más que la inferencia
+        self.serializer = EncounterSerializer()
+        self.symptom_columns = {}
+        for pk, symptom in symptoms.items():
+            self.symptom_columns[f'symptom:{pk}'] = pk
+            self.symptom_columns[f'symptom:{symptom.name}'] = pk
+
+    def parse(self, record):
+        if isinstance(record, Exception):
+            raise ValidationError({'record': [str(record)]})
+        if not isinstance(record, dict):
+            raise ValidationError({'record': ['Expected an object.']})
+        payload = record if 'vital_signs' in record else self.nested(record)
+
+        encounter = self.serializer.run_validation(payload)
+        unknown = sorted({item['symptom_id'] for item in encounter['symptoms']} - self.symptoms.keys())
+        if unknown:
+            raise ValidationError({'symptoms': [f"Unknown symptom id {symptom_id}" for symptom_id in unknown]})
+        created_at = parse_moment({'created_at': str(record.get('created_at') or '')}, 'created_at') or timezone.now()
+        return encounter, created_at
+
+    def nested(self, record):
+        # Fila plana -> formato de la API; las celdas vacías son datos ausentes
+        values = {key: value for key, value in record.items() if value not in ('', None)}
+        vital_signs = {name: values[name] for name in (*VITAL_SIGN_FIELDS, 'blood_pressure') if name in values}
+        symptoms = []
+        unknown = []
+        for key, value in values.items():
+            if not isinstance(key, str) or not key.startswith('symptom:'):
+                continue
+            if key not in self.symptom_columns:
+                unknown.append(f"Unknown symptom column '{key}'")
+                continue
+            symptoms.append({'symptom_id': self.symptom_columns[key], 'intensity': value})
+        if unknown:
+            raise ValidationError({'symptoms': unknown})
+        return {'vital_signs': vital_signs, 'symptoms': symptoms}
+
+
+def import_key(record):
+    # Columnas en cualquier orden; csv.DictReader guarda las celdas sobrantes bajo la clave None
+    if isinstance(record, dict):
+        canonical = json.dumps(sorted(((str(name), value) for name, value in record.items()), key=lambda item: item[0]),
+                               ensure_ascii=False, default=str)
+    else:
+        canonical = repr(record)
+    return f'import:{hashlib.sha1(canonical.encode()).hexdigest()}'
+
+
+def existing_keys(keys):
+    return set(Diagnosis.objects.filter(idempotency_key__in=keys).values_list('idempotency_key', flat=True))
+
+
+def load_checkpoint(path, fingerprint):
+    # Registros ya confirmados en una ejecución anterior sobre el mismo fichero; 0 si no hay o es de otro
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as handle:
+        checkpoint = json.load(handle)
+    return checkpoint['records'] if checkpoint.get('fingerprint') == fingerprint else 0
+
+
+def save_checkpoint(path, fingerprint, records, totals):
+    # Se escribe tras cada transacción; un corte entre ambas solo hace repetir un lote que las claves descartan
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as handle:
+        json.dump({'fingerprint': fingerprint, 'records': records, **totals}, handle)
+    os.replace(temporary, path)
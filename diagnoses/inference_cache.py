@@ -0,0 +1,103 @@
+import hashlib
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .fuzzy_engine import take_rows
+
+# Distancia máxima a un punto de la malla para considerar una entrada ya cuantizada (la malla se redondea a 9 decimales)
+GRID_TOLERANCE = 1e-9
+
+
+class InferenceResultCache:
+    # Resultados por grupo memoizados en el framework de caché de Django, indexados por la
+    # entrada cuantizada y la huella de la base de reglas. Solo se guardan entradas que ya están en la malla
+    def __init__(self, alias):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, version, canonical):
+        digest = hashlib.sha1(repr(canonical).encode()).hexdigest()
+        return f'fuzzy-diagnosis:{version}:{digest}'
+
+    def evaluate(self, compiled, rows, top_k=None):
+        # Se evalúan siempre las entradas sin cuantizar, así el resultado es el del motor sin caché. Solo se
+        # memoizan las que ya están en la malla de cada variable; las demás (p. ej. 37.35 °C) no se guardan.
+        # Los resultados podados (grupos fuera del top-k en -inf) se guardan aparte de los completos
+        version = compiled.version if top_k is None else f'{compiled.version}:top{top_k}'
+        keys, quantized = compiled.quantize(rows)
+        on_grid = self.on_grid(rows, quantized)
+        cache_keys = [self.make_key(version, key) if flag else None for key, flag in zip(keys, on_grid)]
+        cached = self.cache.get_many({cache_key for cache_key in cache_keys if cache_key is not None})
+
+        # Evaluar una sola vez cada entrada de la malla que no estaba en caché, y cada entrada fuera de ella
+        pending = {}
+        off_grid = []
+        for index, cache_key in enumerate(cache_keys):
+            if cache_key is None:
+                off_grid.append(index)
+            elif cache_key not in cached and cache_key not in pending:
+                pending[cache_key] = index
+        results = {}
+        if pending or off_grid:
+            computed = compiled.evaluate(take_rows(rows, [*pending.values(), *off_grid]), top_k).tolist()
+            fresh = dict(zip(pending, computed))
+            if fresh:
+                self.cache.set_many(fresh)
+            cached.update(fresh)
+            results = dict(zip(off_grid, computed[len(pending):]))
+
+        with self._lock:
+            self.misses += len(pending) + len(off_grid)
+            self.hits += len(cache_keys) - len(pending) - len(off_grid)
+        return np.array(
+            [results[index] if cache_key is None else cached[cache_key] for index, cache_key in enumerate(cache_keys)],
+            dtype=float,
+        ).reshape(len(cache_keys), len(compiled.group_names))
+
+    def on_grid(self, rows, quantized):
+        # True por fila si cuantizarla no cambia ningún valor (los valores rechazados, NaN, cuentan como iguales)
+        if isinstance(rows, np.ndarray):
+            return np.isclose(rows, quantized, rtol=0, atol=GRID_TOLERANCE, equal_nan=True).all(axis=1).tolist()
+        return [
+            all(
+                value == row[name] if isinstance(value, str) or isinstance(row[name], str)
+                else abs(value - row[name]) <= GRID_TOLERANCE
+                for name, value in values.items()
+            )
+            for row, values in zip(rows, quantized)
+        ]
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'cache': self.alias,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+
+_result_caches = {}
+_result_caches_lock = threading.Lock()
+
+
+def get_result_cache():
+    # None cuando DIAGNOSIS_RESULT_CACHE está desactivado
+    alias = getattr(settings, 'DIAGNOSIS_RESULT_CACHE', None)
+    if not alias:
+        return None
+    with _result_caches_lock:
+        if alias not in _result_caches:
+            _result_caches[alias] = InferenceResultCache(alias)
+        return _result_caches[alias]
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InferenceQueue:
+    # Ejecuta la inferencia (CPU) fuera del bucle de eventos en un número fijo de hilos. Las peticiones
+    # en curso más las que esperan no pasan de DIAGNOSIS_ASYNC_MAX_PENDING; el resto se rechaza de
+    # inmediato en vez de acumular latencia.
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='diagnosis-inference')
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'DIAGNOSIS_ASYNC_MAX_PENDING', 64)
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self.pending} inference requests already pending")
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'rejected': self.rejected,
+            }
+
+
+_inference_queue = None
+_inference_queue_lock = threading.Lock()
+
+
+def get_inference_queue():
+    global _inference_queue
+    with _inference_queue_lock:
+        if _inference_queue is None:
+            _inference_queue = InferenceQueue(getattr(settings, 'DIAGNOSIS_ASYNC_WORKERS', 4))
+        return _inference_queue
@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+
+# Esquema de entradas compilado con el motor: cada encuentro se convierte una sola vez en un vector de
+# ancho fijo con las columnas de CompiledRuleBase.variable_names, que el motor consume directamente.
+
+
+class InputSchema:
+    def __init__(self, variable_names, grids, symptom_variables, vital_fields):
+        # symptom_variables: {id del síntoma: nombre de su variable}. Solo tienen columna los síntomas y
+        # signos vitales que usa alguna regla; el resto no influye en el resultado
+        columns = {name: index for index, name in enumerate(variable_names)}
+        self.variable_names = variable_names
+        self.width = len(variable_names)
+        self.symptom_columns = {
+            symptom_id: columns[name] for symptom_id, name in symptom_variables.items() if name in columns
+        }
+        self.vital_columns = [(field, columns[field]) for field in vital_fields if field in columns]
+        # Los valores se recortan a los extremos del universo de cada variable
+        self.lower = [float(grid[0]) for grid in grids]
+        self.upper = [float(grid[-1]) for grid in grids]
+
+    def encode(self, encounters):
+        # encounters: datos validados por EncounterSerializer. Devuelve la matriz (N, variables) y, por
+        # encuentro, la lista de entradas rechazadas o recortadas. Los síntomas no informados valen 0
+        X = np.zeros((len(encounters), self.width))
+        rejected = []
+        for row, encounter in zip(X, encounters):
+            report = []
+            for field, column in self.vital_columns:
+                row[column] = self.value(column, encounter['vital_signs'][field], report)
+            for item in encounter['symptoms']:
+                column = self.symptom_columns.get(item['symptom_id'])
+                if column is not None:
+                    row[column] = self.value(column, item['intensity'], report)
+            rejected.append(report)
+        return X, rejected
+
+    def value(self, column, value, report):
+        number = as_number(value)
+        name = self.variable_names[column]
+        if number is None:
+            # Sin valor la variable no pertenece a ningún término y sus reglas no se disparan
+            report.append({'input': name, 'value': value, 'reason': 'not a number'})
+            return np.nan
+        lower, upper = self.lower[column], self.upper[column]
+        if lower <= number <= upper:
+            return number
+        clipped = min(max(number, lower), upper)
+        report.append({'input': name, 'value': value, 'reason': f'outside {lower:g}..{upper:g}, clipped to {clipped:g}'})
+        return clipped
+
+
+def as_number(value):
+    # Número finito a partir de un entero, real o texto numérico; None si no lo es ("120/80", "alta"...)
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
@@ -0,0 +1,236 @@
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Instrumentación opcional (DIAGNOSIS_INSTRUMENTATION): duración por etapa de cada petición en la
+# cabecera Server-Timing y métricas acumuladas en formato Prometheus en /metrics.
+# Fuera de una petición instrumentada stage() no mide nada.
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_request_timings = contextvars.ContextVar('diagnosis_request_timings', default=None)
+
+
+def instrumentation_enabled():
+    return getattr(settings, 'DIAGNOSIS_INSTRUMENTATION', False)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # Etapa -> segundos acumulados, en orden de aparición
+        self.groups = {}  # (etapa, grupo) -> segundos
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.profile_path = None
+
+    def add(self, name, seconds, group=None):
+        if group is None:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        else:
+            self.groups[name, group] = self.groups.get((name, group), 0.0) + seconds
+
+    def server_timing(self, total):
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.stages.items()]
+        # Una entrada por etapa y grupo, con el nombre del grupo en desc (puede llevar espacios y tildes)
+        entries += [
+            f'{name};dur={seconds * 1000:.2f};desc="{group}"' for (name, group), seconds in self.groups.items()]
+        entries.append(f'db;dur={self.query_seconds * 1000:.2f};desc="{self.queries} queries"')
+        if self.profile_path:
+            entries.append(f'profile;desc="{os.path.basename(self.profile_path)}"')
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def stage(name, group=None):
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started, group)
+
+
+def timing_groups():
+    # True dentro de una petición instrumentada: el motor separa entonces el trabajo por grupo para medirlo
+    return _request_timings.get() is not None
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _request_timings.set(timings)
+
+
+def end_request(token):
+    _request_timings.reset(token)
+
+
+def count_queries(execute, sql, params, many, context):
+    timings = _request_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.query_seconds += time.perf_counter() - started
+
+
+def install_query_counter():
+    # Cada conexión (una por hilo) cuenta las consultas de la petición activa en su contexto
+    connection_created.connect(_add_query_counter, dispatch_uid='diagnosis_query_counter')
+    for connection in connections.all(initialized_only=True):
+        _add_query_counter(connection=connection)
+
+
+def _add_query_counter(sender=None, connection=None, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def start_profile():
+    # Perfil de cProfile para una fracción DIAGNOSIS_PROFILE_SAMPLE_RATE de las peticiones
+    rate = getattr(settings, 'DIAGNOSIS_PROFILE_SAMPLE_RATE', 0)
+    if not rate or random.random() >= rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Ya hay otro perfil activo en el proceso (peticiones concurrentes)
+        return None
+    return profiler
+
+
+def save_profile(profiler, timings, view_name):
+    profiler.disable()
+    directory = settings.DIAGNOSIS_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view_name.replace(':', '_')}-{uuid.uuid4().hex[:8]}.prof"
+    timings.profile_path = os.path.join(directory, name)
+    profiler.dump_stats(timings.profile_path)
+
+
+class Histogram:
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # Valores de las etiquetas -> [conteo por cubeta..., suma, total]
+
+    def observe(self, value, *label_values):
+        series = self.series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            labels = format_labels(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, *label_values):
+        self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{format_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+
+def format_labels(names, values):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class Gauge:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series = {}
+
+    def set(self, value, *label_values):
+        self.series[label_values] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{format_labels(self.labels, label_values)}}} {value:.6f}')
+        return lines
+
+
+class Metrics:
+    # Métricas del proceso; con varios trabajadores cada uno expone las suyas
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.warm_start_seconds = Gauge(
+            'diagnosis_warm_start_seconds', 'Duration of each phase of the warm start at process boot.', ('phase',))
+        self.requests = Counter('diagnosis_requests_total', 'Instrumented requests.', ('view', 'method', 'status'))
+        self.request_seconds = Histogram(
+            'diagnosis_request_seconds', 'Request duration until the response is built.', ('view',), DURATION_BUCKETS)
+        self.request_queries = Histogram(
+            'diagnosis_request_queries', 'Database queries per request.', ('view',), QUERY_BUCKETS)
+        self.stage_seconds = Histogram(
+            'diagnosis_stage_seconds', 'Time spent per request in each diagnosis stage.', ('stage',), DURATION_BUCKETS)
+        self.group_seconds = Histogram(
+            'diagnosis_group_seconds', 'Time spent per request in each disease group.', ('stage', 'group'), DURATION_BUCKETS)
+
+    def record(self, view_name, method, status, total, timings):
+        with self._lock:
+            self.requests.inc(view_name, method, status)
+            self.request_seconds.observe(total, view_name)
+            self.request_queries.observe(timings.queries, view_name)
+            for name, seconds in timings.stages.items():
+                self.stage_seconds.observe(seconds, name)
+            for (name, group), seconds in timings.groups.items():
+                self.group_seconds.observe(seconds, name, group)
+
+    def record_warm_start(self, timings):
+        with self._lock:
+            for phase, seconds in timings.items():
+                self.warm_start_seconds.set(seconds, phase)
+
+    def render(self):
+        with self._lock:
+            metrics = (
+                self.warm_start_seconds, self.requests, self.request_seconds, self.request_queries, self.stage_seconds,
+                self.group_seconds,
+            )
+            return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from .fuzzy_engine import compile_rule_base, project_inputs, take_rows
+from .instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def compile_group(engine, group_name):
+    # Base de reglas de un solo grupo: sus variables son solo las que referencian sus reglas
+    return compile_rule_base([(group_name, *engine.systems[group_name])], engine.compiled.defuzzifier)
+
+
+def grid_shape(compiled):
+    return tuple(universe.size for universe in compiled.universes)
+
+
+def build_group_table(compiled, chunk_size=65536):
+    # Evalúa el grupo en cada punto de la malla de sus antecedentes. Solo se defuzzifican los
+    # niveles de activación distintos, que son muchos menos que los puntos de la malla.
+    if any(step is None for step in compiled.grid_steps):
+        raise ValueError("Lookup tables need uniform universes")
+    shape = grid_shape(compiled)
+    # Pertenencias de cada término en los puntos de la malla usados por quantize()
+    memberships_by_axis = [
+        np.stack([np.interp(grid, universe, mf) for mf in mfs], axis=1)
+        for grid, universe, mfs in zip(compiled.grids, compiled.universes, compiled.term_mfs)
+    ]
+
+    size = int(np.prod(shape, dtype=np.int64))
+    cuts = np.empty((size, len(compiled.output_labels)))
+    for start in range(0, size, chunk_size):
+        flat = np.arange(start, min(start + chunk_size, size))
+        indices = np.unravel_index(flat, shape)
+        memberships = np.concatenate(
+            [table[index] for table, index in zip(memberships_by_axis, indices)], axis=1)
+        cuts[start:start + flat.size] = compiled.activations(compiled.rule_strengths(memberships))[:, 0, :]
+
+    unique_cuts, inverse = np.unique(cuts, axis=0, return_inverse=True)
+    values = compiled.defuzzify(unique_cuts[:, None, :])[:, 0]
+    return values[inverse.reshape(-1)].reshape(shape)
+
+
+def build_lookup_tables(engine, directory, max_cells, stdout=None):
+    # Escribe las tablas y devuelve el manifiesto sin guardarlo: el anterior se borra porque describe
+    # ficheros que se van a sobrescribir, y el nuevo se guarda con write_manifest() tras comprobarlas
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = {'groups': {}}
+    for index, group in enumerate(engine.disease_groups):
+        compiled = compile_group(engine, group.name)
+        cells = int(np.prod(grid_shape(compiled), dtype=np.int64))
+        if not compiled.variable_names:
+            continue
+        if cells > max_cells:
+            if stdout:
+                stdout.write(f"  skip {group.name}: {cells} cells over the limit of {max_cells}")
+            continue
+
+        filename = f'group_{index}.npy'
+        np.save(os.path.join(directory, filename), build_group_table(compiled))
+        manifest['groups'][group.name] = {
+            'file': filename,
+            'axes': compiled.variable_names,
+            'version': compiled.version,
+        }
+        if stdout:
+            stdout.write(f"  built {group.name}: {cells} cells over {', '.join(compiled.variable_names)}")
+    return manifest
+
+
+def write_manifest(directory, manifest):
+    # Con el manifiesto en el directorio el motor pasa a usar las tablas
+    with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as handle:
+        json.dump(manifest, handle, ensure_ascii=False, indent=2)
+
+
+def check_group_table(engine, group, table, compiled, samples, rng):
+    # Compara puntos aleatorios de la tabla con create_system_for_group evaluado por skfuzzy
+    worst, mismatches = 0.0, 0
+    for _ in range(samples):
+        index = tuple(int(rng.integers(0, size)) for size in table.shape)
+        inputs = {name: float(grid[i]) for name, grid, i in zip(compiled.variable_names, compiled.grids, index)}
+        expected = engine.reference_group_probability(group, inputs)
+        value = float(table[index])
+        if expected is None or np.isnan(value):
+            mismatches += (expected is None) != bool(np.isnan(value))
+        else:
+            worst = max(worst, abs(value - expected))
+    return worst, mismatches
+
+
+def load_lookup_tables(engine, directory):
+    # Devuelve un LookupTableEvaluator si hay tablas vigentes en el directorio, o None
+    if not directory:
+        return None
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as handle:
+        manifest = json.load(handle)
+
+    tables = {}
+    for group_name, entry in manifest.get('groups', {}).items():
+        if group_name not in engine.systems:
+            continue
+        compiled = compile_group(engine, group_name)
+        if compiled.version != entry['version']:
+            logger.warning("Ignoring stale lookup table for %s; rebuild with build_fuzzy_luts", group_name)
+            continue
+        table = np.load(os.path.join(directory, entry['file']), mmap_mode='r')
+        tables[group_name] = (compiled, table)
+    if not tables:
+        return None
+    return LookupTableEvaluator(engine, tables)
+
+
+class LookupTableEvaluator:
+    # Misma interfaz que CompiledRuleBase. Los grupos con tabla se resuelven indexando un arreglo
+    # memory-mapped; el resto se evalúa con una base compilada solo con esos grupos.
+    def __init__(self, engine, tables):
+        self.compiled = engine.compiled
+        self.group_names = self.compiled.group_names
+        self.version = self.compiled.version
+        self.tables = [
+            (self.group_names.index(name), compiled, table,
+             [self.compiled.variable_names.index(axis) for axis in compiled.variable_names])
+            for name, (compiled, table) in tables.items()
+        ]
+        remaining = [name for name in self.group_names if name not in tables]
+        self.remaining = [self.group_names.index(name) for name in remaining]
+        self.fallback = compile_rule_base(
+            [(name, *engine.systems[name]) for name in remaining], self.compiled.defuzzifier) if remaining else None
+        self.fallback_positions = self.fallback.positions_in(self.compiled.variable_names) if self.fallback else None
+
+    def quantize(self, rows):
+        return self.compiled.quantize(rows)
+
+    def evaluate(self, rows, top_k=None):
+        # rows: diccionarios o matriz con las columnas del motor completo.
+        # Las entradas se cuantizan a la malla de cada variable antes de indexar. Los grupos con tabla
+        # se resuelven siempre; la poda top-k solo se aplica a los que se evalúan con el motor compilado
+        keys, rows = self.compiled.quantize(rows)
+        results = np.empty((len(rows), len(self.group_names)))
+        if self.fallback is not None:
+            results[:, self.remaining] = self.fallback.evaluate(project_inputs(rows, self.fallback_positions), top_k)
+
+        for g, compiled, table, positions in self.tables:
+            with stage('lookup', self.group_names[g]):
+                on_grid = [all(isinstance(key[p], int) for p in positions) for key in keys]
+                indexed = [n for n, flag in enumerate(on_grid) if flag]
+                others = [n for n, flag in enumerate(on_grid) if not flag]
+                if indexed:
+                    index = tuple(np.array([keys[n][p] for n in indexed]) for p in positions)
+                    results[indexed, g] = table[index]
+                if others:
+                    # Entradas sin posición en la malla (etiquetas de texto o valores rechazados)
+                    results[others, g] = compiled.evaluate(project_inputs(take_rows(rows, others), positions))[:, 0]
+        return results
@@ -0,0 +1,77 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from diagnoses.executors import EXECUTOR_KINDS, build_executor
+from diagnoses.fuzzy_engine import compile_rule_base
+from diagnoses.fuzzy_inference import FuzzyDiseaseGroupDiagnosis
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the fuzzy engine executors and defuzzifiers across batch sizes and group counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--executors', default=','.join(EXECUTOR_KINDS), help="Comma-separated executor kinds")
+        parser.add_argument('--batch-sizes', type=int_list, default=[1, 10, 100, 1000], help="Comma-separated rows per call")
+        parser.add_argument('--group-copies', type=int_list, default=[1, 4], help="Replicate the rule base to simulate more groups")
+        parser.add_argument('--defuzzifiers', default='centroid', help="Comma-separated defuzzifiers (centroid, analytic)")
+        parser.add_argument('--workers', type=int, help="Workers for the parallel executors (default: CPU count)")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        engine = FuzzyDiseaseGroupDiagnosis()
+        base_systems = [(group.name, *engine.systems[group.name]) for group in engine.disease_groups]
+        kinds = options['executors'].split(',')
+        defuzzifiers = options['defuzzifiers'].split(',')
+        rng = np.random.default_rng(0)
+
+        for copies in options['group_copies']:
+            systems = [(f"{name} #{copy}", *system) for copy in range(copies) for name, *system in base_systems]
+            rows = {size: [self.random_row(engine.compiled, rng) for _ in range(size)]
+                    for size in options['batch_sizes']}
+            self.stdout.write(f"\n{len(systems)} groups")
+            self.stdout.write(f"{'executor':>20} " + ''.join(f"{size:>12}" for size in options['batch_sizes']))
+
+            timings = {}
+            for defuzzifier in defuzzifiers:
+                compiled = compile_rule_base(systems, defuzzifier)
+                for kind in kinds:
+                    executor = build_executor(kind, systems, workers=options['workers'], compiled=compiled)
+                    label = f"{kind}/{defuzzifier}"
+                    timings[label] = [self.time_evaluate(executor, rows[size], options['repeat'])
+                                      for size in options['batch_sizes']]
+                    if hasattr(executor, 'pool'):
+                        executor.pool.shutdown()
+                    self.stdout.write(f"{label:>20} " + ''.join(f"{value * 1000:>10.2f}ms" for value in timings[label]))
+
+            # Primer tamaño de lote en que cada combinación supera a la ejecución en serie con el centroide remuestreado
+            reference = timings.get('serial/centroid')
+            if reference:
+                for label, values in timings.items():
+                    if label == 'serial/centroid':
+                        continue
+                    faster = [size for size, value, serial in zip(options['batch_sizes'], values, reference) if value < serial]
+                    crossover = f"from {faster[0]} rows" if faster else "not within the measured batch sizes"
+                    self.stdout.write(f"  {label} beats serial/centroid {crossover}")
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked the fuzzy engine'))
+
+    def time_evaluate(self, executor, rows, repeat):
+        executor.evaluate(rows)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            executor.evaluate(rows)
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
+
+    def random_row(self, compiled, rng):
+        return {
+            name: float(rng.uniform(universe[0], universe[-1]))
+            for name, universe in zip(compiled.variable_names, compiled.universes)
+        }
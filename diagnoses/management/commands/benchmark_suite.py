@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import platform
+import statistics
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from diagnoses.fuzzy_inference import FuzzyDiseaseGroupDiagnosis, invalidate_diagnosis_engine, normalize_name
+from diagnoses.models import Symptom
+
+FIXTURES = ['diseases.json', 'diseases_with_groups.json', 'symptoms.json', 'groupsymptom.json']
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+# Parámetros que deben coincidir con los de la línea base para comparar
+COMPARABLE_META = (
+    'database', 'executor', 'defuzzifier', 'top_k_pruning', 'result_cache', 'samples', 'requests', 'batch_size', 'seed',
+)
+
+# Huellas que deben coincidir para comparar siquiera con la línea base: la base de reglas compilada
+# (variables, universos y reglas) y la malla de pacientes sintéticos
+FINGERPRINT_META = ('engine', 'workload')
+
+# Malla de signos vitales de la que se muestrean los pacientes sintéticos
+VITAL_GRID = {
+    'systolic': [90, 110, 120, 135, 150, 170],
+    'diastolic': [60, 70, 80, 85, 95, 105],
+    'heart_rate': list(range(50, 171, 10)),
+    'respiratory_rate': list(range(8, 33, 4)),
+    'temperature': [round(35.5 + 0.5 * step, 1) for step in range(12)],
+    'weight': list(range(40, 131, 15)),
+}
+
+
+def synthetic_encounters(symptom_ids, count, rng, max_symptoms=6):
+    # Encuentros reproducibles: signos vitales de la malla y hasta max_symptoms síntomas con intensidad 1-3
+    encounters = []
+    for _ in range(count):
+        chosen = rng.choice(symptom_ids, size=int(rng.integers(0, max_symptoms + 1)), replace=False)
+        encounters.append({
+            'vital_signs': {name: values[int(rng.integers(len(values)))] for name, values in VITAL_GRID.items()},
+            'symptoms': [{'symptom_id': int(symptom_id), 'intensity': int(rng.integers(1, 4))} for symptom_id in chosen],
+        })
+    return encounters
+
+
+class Command(BaseCommand):
+    help = "Benchmark engine construction, inference and the diagnoses API on a database seeded from the fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200, help="Synthetic patients for the inference stages")
+        parser.add_argument('--requests', type=int, default=100, help="POSTs for the API create stage")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5, help="Repetitions of the engine construction and batch stages")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+        parser.add_argument('--save-baseline', action='store_true', help="Write the results to --baseline")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p50 slowdown over the baseline (0.2 = 20%%)")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--with-result-cache', action='store_true', help="Keep the inference result cache enabled")
+        parser.add_argument('--use-current-database', action='store_true',
+                            help="Run against the configured database instead of a throwaway one seeded from the fixtures")
+
+    def handle(self, *args, **options):
+        overrides = {} if options['with_result_cache'] else {'DIAGNOSIS_RESULT_CACHE': None}
+        try:
+            # Permite el host "testserver" del cliente de pruebas; ya está activo dentro de los tests
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False
+        old_name = None
+        try:
+            if not options['use_current_database']:
+                # Base de datos desechable con las migraciones y los fixtures, como en los tests
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                call_command('loaddata', *FIXTURES, verbosity=0)
+            with override_settings(**overrides):
+                invalidate_diagnosis_engine()
+                results = self.run_stages(options)
+        finally:
+            invalidate_diagnosis_engine()
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            if own_environment:
+                teardown_test_environment()
+
+        report = {'meta': self.meta(options), 'stages': results}
+        baseline = self.load_baseline(options['baseline']) if not options['save_baseline'] else None
+        if baseline:
+            # Con otro motor u otra carga las latencias no son comparables: se informa sin comparar
+            stale = [key for key in FINGERPRINT_META if baseline['meta'].get(key) != report['meta'][key]]
+            if stale:
+                message = (f"The baseline {options['baseline']} was recorded with a different {' and '.join(stale)}; "
+                           "record a new one with --save-baseline")
+                if options['fail_on_regression']:
+                    raise CommandError(message)
+                self.stdout.write(self.style.WARNING(message))
+                baseline = None
+        if baseline:
+            # Solo es comparable con la misma carga y configuración del motor
+            differences = [
+                f"{key}={baseline['meta'].get(key)!r}" for key in COMPARABLE_META
+                if baseline['meta'].get(key) != report['meta'][key]
+            ]
+            if differences:
+                self.stdout.write(self.style.WARNING(f"The baseline was recorded with {', '.join(differences)}"))
+        regressions = self.print_report(results, baseline, options['tolerance'])
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2)
+                handle.write('\n')
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"Regressions over the baseline: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked the diagnosis pipeline'))
+
+    def run_stages(self, options):
+        rng = np.random.default_rng(options['seed'])
+        symptoms = {symptom.pk: normalize_name(symptom.name) for symptom in Symptom.objects.all()}
+        encounters = synthetic_encounters(sorted(symptoms), max(options['samples'], options['requests']), rng)
+
+        results = {}
+        results['engine_build'] = self.measure([FuzzyDiseaseGroupDiagnosis] * options['repeat'])
+        engine = FuzzyDiseaseGroupDiagnosis()
+        self.engine_version = engine.compiled.version
+        results['create_system_for_group'] = self.measure([
+            lambda group=group: engine.create_system_for_group(group)
+            for _ in range(options['repeat']) for group in engine.disease_groups
+        ])
+
+        rows = [
+            engine.build_inputs(encounter['vital_signs'], {
+                symptoms[item['symptom_id']]: item['intensity'] for item in encounter['symptoms']
+            })
+            for encounter in encounters[:options['samples']]
+        ]
+        engine.diagnose(rows[0])
+        results['diagnose'] = self.measure([lambda row=row: engine.diagnose(row) for row in rows])
+        batch = rows[:options['batch_size']]
+        results['diagnose_batch'] = self.measure([lambda: engine.diagnose_batch(batch)] * options['repeat'], batch=len(batch))
+
+        client = Client(HTTP_AUTHORIZATION='xyz123')
+        client.post('/api/diagnoses/', encounters[0], content_type='application/json')
+        results['api_create'] = self.measure([
+            lambda encounter=encounter: self.expect_status(client.post('/api/diagnoses/', encounter, content_type='application/json'), 201)
+            for encounter in encounters[:options['requests']]
+        ])
+        results['api_list_page'] = self.measure([
+            lambda: self.expect_status(client.get('/api/diagnoses/', {'page_size': 50}), 200)
+        ] * options['repeat'] * 4)
+        return results
+
+    def expect_status(self, response, expected):
+        if response.status_code != expected:
+            raise CommandError(f"{response.request['PATH_INFO']} answered {response.status_code}")
+
+    def measure(self, calls, batch=1):
+        # Cada llamada es una operación; la latencia se mide por operación y las filas por segundo con batch
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for call in calls:
+                operation_started = time.perf_counter()
+                call()
+                latencies.append(time.perf_counter() - operation_started)
+            elapsed = time.perf_counter() - started
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+            p50, p95, p99 = (percentiles[q - 1] * 1000 for q in (50, 95, 99))
+        else:
+            p50 = p95 = p99 = latencies[0] * 1000
+        return {
+            'operations': len(calls),
+            'p50_ms': round(p50, 3),
+            'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3),
+            'rows_per_second': round(len(calls) * batch / elapsed, 1),
+            'queries_per_operation': round(len(queries) / len(calls), 2),
+        }
+
+    def meta(self, options):
+        return {
+            'created_at': timezone.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'database': connection.vendor,
+            'executor': getattr(settings, 'DIAGNOSIS_EXECUTOR', 'serial'),
+            'defuzzifier': getattr(settings, 'DIAGNOSIS_DEFUZZIFIER', 'centroid'),
+            'top_k_pruning': getattr(settings, 'DIAGNOSIS_TOP_K_PRUNING', False),
+            'result_cache': options['with_result_cache'],
+            'samples': options['samples'],
+            'requests': options['requests'],
+            'batch_size': options['batch_size'],
+            'seed': options['seed'],
+            'engine': self.engine_version,
+            'workload': hashlib.sha1(json.dumps(VITAL_GRID, sort_keys=True).encode()).hexdigest()[:16],
+        }
+
+    def load_baseline(self, path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def print_report(self, results, baseline, tolerance):
+        # Devuelve las etapas más lentas que la línea base (p50) o con más consultas
+        stages = (baseline or {}).get('stages', {})
+        regressions = []
+        self.stdout.write(
+            f"{'stage':>24} {'ops':>6} {'p50':>10} {'p95':>10} {'p99':>10} {'rows/s':>10} {'queries':>8} {'vs baseline':>12}")
+        for name, result in results.items():
+            line = (f"{name:>24} {result['operations']:>6} {result['p50_ms']:>8.2f}ms {result['p95_ms']:>8.2f}ms "
+                    f"{result['p99_ms']:>8.2f}ms {result['rows_per_second']:>10.1f} {result['queries_per_operation']:>8.2f}")
+            reference = stages.get(name)
+            if reference:
+                change = result['p50_ms'] / reference['p50_ms'] - 1 if reference['p50_ms'] else 0.0
+                line += f" {change:>+11.0%}"
+                if change > tolerance or result['queries_per_operation'] > reference['queries_per_operation']:
+                    regressions.append(name)
+                    line += "  REGRESSION"
+            self.stdout.write(line)
+        return regressions
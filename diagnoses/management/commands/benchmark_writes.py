@@ -0,0 +1,159 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from django.test import Client
+from django.utils import timezone
+from diagnoses.analytics import rebuild_daily_rollups
+from diagnoses.models import PendingDiagnosis, Symptom, VitalSigns
+
+FIXTURES = ['diseases.json', 'diseases_with_groups.json', 'symptoms.json', 'groupsymptom.json']
+
+# SQLite tal como venía configurado antes de los perfiles: diario DELETE, sincronización FULL,
+# transacciones diferidas, 5 s de espera y una conexión por petición
+SQLITE_DEFAULTS = {'OPTIONS': {'init_command': 'PRAGMA journal_mode=DELETE;PRAGMA synchronous=FULL'}, 'CONN_MAX_AGE': 0}
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = "Benchmark parallel diagnosis POSTs with the configured database profile, on a throwaway database by default"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int_list, default=[1, 4, 16], help="Comma-separated numbers of concurrent clients")
+        parser.add_argument('--requests', type=int, default=50, help="POSTs sent by each client")
+        parser.add_argument('--compare-sqlite-defaults', action='store_true',
+                            help="Also run with SQLite's default journal, locking and connection settings")
+        parser.add_argument('--host', default='localhost', help="Host header of the requests (must be in ALLOWED_HOSTS)")
+        parser.add_argument('--use-current-database', action='store_true',
+                            help="Write to the configured database instead of a throwaway one seeded from the fixtures")
+        parser.add_argument('--keep', action='store_true',
+                            help="With --use-current-database, keep the diagnoses created by the benchmark")
+
+    def handle(self, *args, **options):
+        if options['use_current_database']:
+            self.benchmark(options)
+            return
+        # Base de datos desechable con las migraciones y los fixtures, como benchmark_suite. En SQLite va a un
+        # fichero temporal: la base en memoria de los tests no usa el diario ni los bloqueos que se miden
+        old_name = connection.settings_dict['NAME']
+        old_test = connection.settings_dict.get('TEST', {})
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST'] = {
+                    **connection.settings_dict.get('TEST', {}), 'NAME': os.path.join(directory, 'benchmark.sqlite3')}
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command('loaddata', *FIXTURES, verbosity=0)
+                self.benchmark(options)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                connection.settings_dict['TEST'] = old_test
+
+    def benchmark(self, options):
+        database = connections.settings['default']
+        configured = {'OPTIONS': dict(database.get('OPTIONS', {})), 'CONN_MAX_AGE': database.get('CONN_MAX_AGE', 0)}
+        profiles = [(settings.DB_PROFILE, configured)]
+        if options['compare_sqlite_defaults']:
+            if connection.vendor != 'sqlite':
+                raise CommandError("--compare-sqlite-defaults needs the sqlite profile")
+            profiles.insert(0, ('sqlite-defaults', SQLITE_DEFAULTS))
+
+        symptom_ids = list(Symptom.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        # Cada POST lleva una Idempotency-Key con este prefijo: en la base de datos real solo se borra lo que
+        # creó el benchmark, también lo que siga en la cola write-behind o ya haya guardado drain_diagnosis_queue
+        self.key_prefix = f'benchmark-writes:{uuid.uuid4().hex[:12]}:'
+        started_on = timezone.localdate()
+        mode = 'write-behind' if settings.DIAGNOSIS_WRITE_BEHIND else 'direct'
+        self.stdout.write(f"{connection.vendor} database, {mode} writes, {options['requests']} POSTs per client")
+        self.stdout.write(f"{'profile':>16} {'clients':>8} {'ok':>6} {'errors':>7} {'req/s':>9} {'p50':>10} {'p95':>10} {'p99':>10}")
+
+        # Compilar el motor antes de medir
+        self.post(Client(HTTP_AUTHORIZATION='xyz123', HTTP_HOST=options['host']), self.payload(symptom_ids, 0), 'warm-up')
+
+        try:
+            for label, profile in profiles:
+                self.configure(database, profile)
+                for clients in options['clients']:
+                    row = self.run(clients, options['requests'], symptom_ids, options['host'], label)
+                    self.stdout.write(f"{label:>16} {clients:>8} " + row)
+        finally:
+            self.configure(database, configured)
+            if options['use_current_database'] and not options['keep']:
+                # Borrar los signos vitales elimina en cascada los diagnósticos creados
+                VitalSigns.objects.filter(diagnosis__idempotency_key__startswith=self.key_prefix).delete()
+                PendingDiagnosis.objects.filter(idempotency_key__startswith=self.key_prefix).delete()
+                rebuild_daily_rollups(started_on, timezone.localdate())
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked concurrent diagnosis writes'))
+
+    def configure(self, database, profile):
+        # Las conexiones nuevas de cada hilo leen este mismo diccionario de ajustes
+        connections.close_all()
+        database['OPTIONS'] = dict(profile['OPTIONS'])
+        database['CONN_MAX_AGE'] = profile['CONN_MAX_AGE']
+
+    def run(self, clients, requests, symptom_ids, host, label):
+        barrier = threading.Barrier(clients)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(
+                lambda index: self.client(index, barrier, requests, symptom_ids, host, f'{label}:{clients}'),
+                range(clients)))
+        elapsed = time.perf_counter() - started
+
+        latencies = [value for values, _ in results for value in values]
+        errors = sum(count for _, count in results)
+        if len(latencies) > 1:
+            p50, p95, p99 = (statistics.quantiles(latencies, n=100)[q - 1] * 1000 for q in (50, 95, 99))
+        else:
+            p50 = p95 = p99 = float('nan')
+        return (f"{len(latencies):>6} {errors:>7} {len(latencies) / elapsed:>9.1f} "
+                f"{p50:>8.1f}ms {p95:>8.1f}ms {p99:>8.1f}ms")
+
+    def client(self, index, barrier, requests, symptom_ids, host, run):
+        client = Client(HTTP_AUTHORIZATION='xyz123', HTTP_HOST=host)
+        latencies, errors = [], 0
+        barrier.wait()
+        for n in range(requests):
+            started = time.perf_counter()
+            try:
+                number = index * requests + n
+                response = self.post(client, self.payload(symptom_ids, number), f'{run}:{number}')
+                ok = response.status_code in (201, 202)
+            except DatabaseError:
+                # Por ejemplo "database is locked" cuando se agota la espera de SQLite
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        connection.close()
+        return latencies, errors
+
+    def post(self, client, payload, key):
+        return client.post('/api/diagnoses/', payload, content_type='application/json',
+                           headers={'Idempotency-Key': self.key_prefix + key})
+
+    def payload(self, symptom_ids, n):
+        return {
+            'vital_signs': {
+                'blood_pressure': '120/80',
+                'heart_rate': 60 + n % 100,
+                'respiratory_rate': 18,
+                'temperature': 37.5,
+                'weight': 70,
+            },
+            'symptoms': [{'symptom_id': symptom_id, 'intensity': 1 + n % 3} for symptom_id in symptom_ids],
+        }
@@ -0,0 +1,50 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from diagnoses.fuzzy_inference import FuzzyDiseaseGroupDiagnosis, invalidate_diagnosis_engine
+from diagnoses.lookup_tables import build_lookup_tables, check_group_table, compile_group, write_manifest
+
+class Command(BaseCommand):
+    help = "Build (or rebuild) the precomputed lookup tables used by the fuzzy engine's LUT mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', help="Defaults to settings.DIAGNOSIS_LUT_DIR")
+        parser.add_argument('--max-cells', type=int, help="Defaults to settings.DIAGNOSIS_LUT_MAX_CELLS")
+        parser.add_argument('--check', type=int, default=100, help="Random grid points per group compared against skfuzzy (0 to skip)")
+        parser.add_argument('--tolerance', type=float, default=1e-9, help="Largest parity error accepted by --check")
+
+    def handle(self, *args, **options):
+        directory = options['output_dir'] or settings.DIAGNOSIS_LUT_DIR
+        max_cells = options['max_cells'] or settings.DIAGNOSIS_LUT_MAX_CELLS
+        engine = FuzzyDiseaseGroupDiagnosis()
+
+        started = time.perf_counter()
+        manifest = build_lookup_tables(engine, directory, max_cells, stdout=self.stdout)
+        self.stdout.write(f"Built {len(manifest['groups'])} tables in {time.perf_counter() - started:.1f}s into {directory}")
+
+        # Verificar la paridad de cada tabla contra el sistema de skfuzzy del grupo; sin paridad no se escribe
+        # el manifiesto y el motor sigue evaluando todos los grupos con la base compilada
+        if options['check']:
+            rng = np.random.default_rng(0)
+            groups = {group.name: group for group in engine.disease_groups}
+            failed = []
+            for name, entry in manifest['groups'].items():
+                table = np.load(os.path.join(directory, entry['file']), mmap_mode='r')
+                worst, mismatches = check_group_table(
+                    engine, groups[name], table, compile_group(engine, name), options['check'], rng)
+                passed = worst < options['tolerance'] and not mismatches
+                style = self.style.SUCCESS if passed else self.style.ERROR
+                self.stdout.write(style(f"  parity {name}: max error {worst:.2e}, empty-output mismatches {mismatches}"))
+                if not passed:
+                    failed.append(name)
+            if failed:
+                invalidate_diagnosis_engine()
+                raise CommandError(f"Lookup tables failed the parity check for {', '.join(failed)}; manifest not written")
+
+        write_manifest(directory, manifest)
+        # El motor de este proceso se recompila; otros procesos cargan las tablas al reiniciar
+        invalidate_diagnosis_engine()
+        self.stdout.write(self.style.SUCCESS('Successfully built fuzzy lookup tables'))
@@ -14,4 +14,7 @@ class Command(BaseCommand):
         Diagnosis.objects.all().delete()
         DiagnosisSymptom.objects.all().delete()
         DiagnosisGroupProbability.objects.all().delete()
+        # Las reglas difusas se borran en cascada con los grupos
+        self.stdout.write("Reload the catalogue and the rule base with: python manage.py loaddata diseases.json "
+                          "diseases_with_groups.json symptoms.json groupsymptom.json fuzzy_rules.json")
         self.stdout.write(self.style.SUCCESS('Successfully deleted all records from diagnoses tables'))
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from diagnoses.models import PendingDiagnosis
+from diagnoses.write_behind import drain_pending_diagnoses
+
+
+class Command(BaseCommand):
+    help = "Store the diagnoses queued in write-behind mode, in batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DIAGNOSIS_WRITE_BEHIND_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep draining the queue as a background worker")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the queue is empty (with --loop)")
+
+    def handle(self, *args, **options):
+        drained_total = failed_total = 0
+        while True:
+            drained, failed = drain_pending_diagnoses(options['batch_size'])
+            drained_total += drained
+            failed_total += failed
+            if drained or failed:
+                self.stdout.write(f"Drained {drained} queued diagnoses ({failed} failed)")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        stuck = PendingDiagnosis.objects.exclude(last_error='').count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(f"{stuck} queued diagnoses could not be stored; see last_error"))
+        self.stdout.write(self.style.SUCCESS(f'Successfully drained {drained_total} diagnoses'))
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from diagnoses.export import EXPORT_FORMATS, ExportColumns, stream_export
+from diagnoses.filters import DIAGNOSIS_FILTERS, filter_diagnoses
+from diagnoses.models import Diagnosis
+from rest_framework.exceptions import ValidationError
+
+
+class Command(BaseCommand):
+    help = "Stream the diagnosis history as flat NDJSON or CSV rows (vitals, symptom intensities, group probabilities)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--output', help="File to write (default: standard output)")
+        parser.add_argument('--created-after', help="ISO date or datetime, inclusive")
+        parser.add_argument('--created-before', help="ISO date or datetime, exclusive; reuse it as the next --created-after")
+        parser.add_argument('--group', help="Only diagnoses ranking this disease group (id or name)")
+        parser.add_argument('--min-probability', help="With --group, minimum probability of that group")
+        parser.add_argument('--min-systolic', help="Systolic pressure range in mmHg, inclusive")
+        parser.add_argument('--max-systolic')
+        parser.add_argument('--min-diastolic', help="Diastolic pressure range in mmHg, inclusive")
+        parser.add_argument('--max-diastolic')
+        parser.add_argument('--chunk-size', type=int, default=settings.DIAGNOSIS_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        # Mismos filtros que GET /api/diagnoses/export/
+        params = {name: options[name] for name in DIAGNOSIS_FILTERS}
+        try:
+            queryset = filter_diagnoses(Diagnosis.objects.all(), params)
+        except ValidationError as error:
+            raise CommandError(error.detail)
+
+        columns = ExportColumns()
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        chunks = stream_export(columns, counted(columns.rows(queryset, options['chunk_size'])), options['format'])
+        if options['output']:
+            with open(options['output'], 'wb') as handle:
+                for chunk in chunks:
+                    handle.write(chunk)
+            self.stdout.write(self.style.SUCCESS(f"Successfully exported {exported} diagnoses to {options['output']}"))
+        else:
+            # Con la salida estándar ocupada por los datos, el resumen va a la de errores
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            self.stdout.flush()
+            self.stderr.write(self.style.SUCCESS(f"Successfully exported {exported} diagnoses"))
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from collections import deque
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from diagnoses.executors import BatchPool
+from diagnoses.fuzzy_inference import get_diagnosis_engine
+from diagnoses.importer import (
+    IMPORT_FORMATS, EncounterParser, existing_keys, file_fingerprint, guess_format, import_key, load_checkpoint,
+    read_records, save_checkpoint,
+)
+from diagnoses.models import Symptom
+from diagnoses.services import build_diagnoses, save_diagnoses
+from rest_framework.exceptions import ValidationError
+
+
+class Command(BaseCommand):
+    help = "Import historical encounters from a CSV or NDJSON file, scoring them with the fuzzy engine in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, read as a stream")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="Default: guessed from the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Encounters per inference batch and per transaction")
+        parser.add_argument('--workers', type=int, help="Inference processes (default: CPU count; 1 runs in this process)")
+        parser.add_argument('--checkpoint', help="Progress file used to resume (default: <path>.checkpoint)")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and read the file from the start")
+        parser.add_argument('--rejects', help="Append the rejected records and their errors to this NDJSON file")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f"File '{path}' does not exist")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        import_format = options['format'] or guess_format(path)
+        self.fingerprint = file_fingerprint(path)
+        self.checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        start = 0 if options['restart'] else load_checkpoint(self.checkpoint, self.fingerprint)
+        if start:
+            self.stdout.write(f"Resuming after record {start}")
+
+        self.engine = get_diagnosis_engine()
+        self.symptoms = Symptom.objects.in_bulk()
+        self.groups = {group.name: group for group in self.engine.disease_groups}
+        self.parser = EncounterParser(self.symptoms)
+        self.totals = {'imported': 0, 'rejected': 0, 'skipped': 0}
+        self.started = time.perf_counter()
+        self.rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+        pool = BatchPool(self.engine.compiled, options['workers'])
+        # Mientras los trabajadores infieren unos lotes, este proceso valida los siguientes y guarda los terminados.
+        # Los lotes se guardan en el orden del fichero para que el punto de control sea un número de registro
+        in_flight = deque()
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as handle:
+                records = ((number, record) for number, record in read_records(handle, import_format) if number > start)
+                while chunk := list(islice(records, options['batch_size'])):
+                    in_flight.append(self.prepare(chunk, pool))
+                    if len(in_flight) > pool.workers:
+                        self.store(in_flight.popleft())
+                while in_flight:
+                    self.store(in_flight.popleft())
+        finally:
+            pool.shutdown()
+            if self.rejects is not None:
+                self.rejects.close()
+
+        # Terminada la importación, volver a lanzarla solo comprobaría las claves
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {self.totals['imported']} encounters "
+            f"({self.totals['rejected']} rejected, {self.totals['skipped']} already imported)"
+        ))
+
+    def prepare(self, chunk, pool):
+        batch = {'last_record': chunk[-1][0], 'encounters': [], 'created_at': [], 'keys': [], 'rejects': [], 'future': None}
+        # Los registros ya guardados (por una ejecución anterior o por otra importación) se descartan por clave
+        keys = {number: import_key(record) for number, record in chunk}
+        stored = existing_keys(list(set(keys.values())))
+        batch['skipped'] = 0
+        for number, record in chunk:
+            if keys[number] in stored:
+                batch['skipped'] += 1
+                continue
+            stored.add(keys[number])
+            try:
+                encounter, created_at = self.parser.parse(record)
+            except ValidationError as error:
+                batch['rejects'].append({'record': number, 'errors': error.detail})
+                continue
+            batch['encounters'].append(encounter)
+            batch['created_at'].append(created_at)
+            batch['keys'].append(keys[number])
+        if batch['encounters']:
+            inputs, _ = self.engine.encode(batch['encounters'])
+            batch['future'] = pool.submit(inputs, self.engine.ranking_top_k())
+        return batch
+
+    def store(self, batch):
+        if batch['future'] is not None:
+            batch['rankings'] = self.engine.rank_batch(batch['future'].result())
+            while batch['encounters']:
+                try:
+                    # Una transacción por lote con una inserción masiva por tabla
+                    save_diagnoses(self.build(batch))
+                    break
+                except IntegrityError:
+                    # Otro lote en curso u otra importación guardó algunas de estas claves después de comprobarlas:
+                    # se descartan y se reintenta con objetos nuevos, porque los del intento fallido ya tienen pk
+                    stored = existing_keys(batch['keys'])
+                    if not stored:
+                        raise
+                    self.drop(batch, stored)
+        if self.rejects is not None:
+            for reject in batch['rejects']:
+                self.rejects.write(json.dumps(reject, ensure_ascii=False) + '\n')
+            self.rejects.flush()
+
+        self.totals['imported'] += len(batch['encounters'])
+        self.totals['rejected'] += len(batch['rejects'])
+        self.totals['skipped'] += batch['skipped']
+        save_checkpoint(self.checkpoint, self.fingerprint, batch['last_record'], self.totals)
+        elapsed = time.perf_counter() - self.started
+        processed = sum(self.totals.values())
+        self.stdout.write(
+            f"Record {batch['last_record']}: {self.totals['imported']} imported, {self.totals['rejected']} rejected, "
+            f"{self.totals['skipped']} already imported ({processed / elapsed:.0f} records/s)"
+        )
+
+    def build(self, batch):
+        diagnoses = build_diagnoses(
+            batch['encounters'], self.symptoms, batch['rankings'], self.groups, idempotency_keys=batch['keys'])
+        for diagnosis, created_at in zip(diagnoses, batch['created_at']):
+            diagnosis.created_at = created_at
+        return diagnoses
+
+    def drop(self, batch, stored):
+        kept = [index for index, key in enumerate(batch['keys']) if key not in stored]
+        for name in ('encounters', 'created_at', 'keys', 'rankings'):
+            batch[name] = [batch[name][index] for index in kept]
+        batch['skipped'] += len(stored)
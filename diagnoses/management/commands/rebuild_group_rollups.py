@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from diagnoses.analytics import rebuild_daily_rollups
+
+
+def iso_date(value):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError(f"Invalid date '{value}'; expected YYYY-MM-DD")
+    return day
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily disease group rollups from the stored diagnoses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=iso_date, help="First day to rebuild (default: the whole history)")
+        parser.add_argument('--date-to', type=iso_date, help="Last day to rebuild, inclusive")
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_rollups(options['date_from'], options['date_to'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {rows} daily group rollups'))
@@ -0,0 +1,16 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from diagnoses.warm_start import warm_start
+
+
+class Command(BaseCommand):
+    help = "Run the warm start of a server process and report how long each phase takes"
+
+    def handle(self, *args, **options):
+        # Al cargar Django no debería haberse importado skfuzzy todavía
+        preloaded = [name for name in ('skfuzzy', 'scipy', 'networkx') if name in sys.modules]
+        self.stdout.write(f"Loaded before the warm start: {', '.join(preloaded) or 'none of skfuzzy, scipy, networkx'}")
+        for phase, seconds in warm_start().items():
+            self.stdout.write(f"{phase:>10} {seconds * 1000:>10.1f}ms")
+        self.stdout.write(self.style.SUCCESS('Successfully warmed up the diagnosis engine'))
@@ -1,12 +1,82 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
 from django.http import JsonResponse
 
+from .instrumentation import (
+    end_request, install_query_counter, instrumentation_enabled, metrics, save_profile, start_profile, start_request,
+)
+
 class TokenAuthMiddleware:
+    # Admite cadenas síncronas y asíncronas para que bajo ASGI no se cambie de hilo en cada petición
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.TOKEN = "xyz123"  # Token esperado en el header 'Authorization'
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or auth_header != self.TOKEN:
-            return JsonResponse({'error': 'Unauthorized'}, status=401)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_authorized(request):
+            return self.unauthorized()
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self.is_authorized(request):
+            return self.unauthorized()
+        return await self.get_response(request)
+
+    def is_authorized(self, request):
+        auth_header = request.headers.get('Authorization')
+        return bool(auth_header) and auth_header == self.TOKEN
+
+    def unauthorized(self):
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+
+class InstrumentationMiddleware:
+    # Mide cada petición cuando DIAGNOSIS_INSTRUMENTATION está activo; si no, Django la quita de la cadena
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not instrumentation_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_query_counter()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = start_request()
+        profiler = start_profile()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, profiler)
+
+    async def __acall__(self, request):
+        timings, token = start_request()
+        profiler = start_profile()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, profiler)
+
+    def finish(self, request, response, timings, profiler):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unmatched'
+        if profiler is not None:
+            save_profile(profiler, timings, view_name)
+        total = time.perf_counter() - timings.started
+        metrics.record(view_name, request.method, response.status_code, total, timings)
+        response['Server-Timing'] = timings.server_timing(total)
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionStamp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FuzzyRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('antecedent', models.JSONField()),
+                ('consequent', models.CharField(choices=[('low', 'Low'), ('normal', 'Normal'), ('high', 'High')], max_length=10)),
+                ('weight', models.FloatField(default=1.0)),
+                ('disease_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fuzzy_rules', to='diagnoses.diseasegroup')),
+            ],
+            options={
+                'ordering': ['disease_group', 'order', 'pk'],
+            },
+        ),
+    ]
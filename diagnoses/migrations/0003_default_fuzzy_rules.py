@@ -0,0 +1,210 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:01
+
+from django.core.management.color import no_style
+from django.db import migrations
+
+
+# Reglas que antes estaban escritas en create_system_for_group, en el mismo orden
+def term(variable, label):
+    return {'variable': variable, 'term': label}
+
+
+def all_of(*conditions):
+    return {'and': list(conditions)}
+
+
+def any_of(*conditions):
+    return {'or': list(conditions)}
+
+
+def negate(condition):
+    return {'not': condition}
+
+
+DEFAULT_RULES = [
+    ('Infecciones Respiratorias Agudas', [
+        (all_of(term('congestión_nasal', 'high'), term('fiebre', 'high')), 'high'),
+        (any_of(term('dolor_de_garganta', 'high'), term('dolor_de_garganta', 'normal')), 'high'),
+        (all_of(term('estornudos', 'high'), term('congestión_nasal', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), any_of(term('tos', 'high'), term('dolor_de_garganta', 'high'))), 'high'),
+        (all_of(term('dificultad_para_respirar', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('respiratory_rate', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('respiratory_rate', 'high'), term('fiebre', 'high'), term('congestión_nasal', 'high')), 'high'),
+        (all_of(term('dolor_de_garganta', 'high'), term('tos', 'high'), term('congestión_nasal', 'high')), 'high'),
+        (all_of(term('congestión_nasal', 'high'), term('dolor_de_garganta', 'high'), term('estornudos', 'high'), term('fiebre', 'high'), term('tos', 'high')), 'high'),
+        (all_of(term('fiebre', 'low'), term('congestión_nasal', 'low')), 'low'),
+    ]),
+    ('Enfermedades Gastrointestinales', [
+        (all_of(term('náuseas', 'high'), term('vómitos', 'high')), 'high'),
+        (all_of(term('diarrea', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('náuseas', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('vómitos', 'high'), term('diarrea', 'high')), 'high'),
+        (all_of(term('diarrea', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('náuseas', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('vómitos', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('dolor_abdominal', 'high'), term('blood_pressure', 'low')), 'high'),
+        (all_of(term('náuseas', 'normal'), term('vómitos', 'normal')), 'normal'),
+        (all_of(term('diarrea', 'normal'), term('dolor_abdominal', 'normal')), 'normal'),
+        (all_of(term('náuseas', 'normal'), term('diarrea', 'normal')), 'normal'),
+        (all_of(term('dolor_abdominal', 'normal'), term('heart_rate', 'normal')), 'normal'),
+        (all_of(term('fiebre', 'low'), term('náuseas', 'low')), 'low'),
+        (all_of(term('diarrea', 'low'), term('dolor_abdominal', 'low')), 'low'),
+        (all_of(term('náuseas', 'low'), term('vómitos', 'low')), 'low'),
+        (all_of(term('blood_pressure', 'low'), term('diarrea', 'low')), 'low'),
+        (all_of(term('náuseas', 'high'), term('vómitos', 'high'), term('diarrea', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('náuseas', 'high'), term('vómitos', 'high'), term('fiebre', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), negate(any_of(term('náuseas', 'high'), term('vómitos', 'high')))), 'low'),
+    ]),
+    ('Enfermedades Infecciosas y Parasitarias', [
+        (all_of(term('fiebre', 'high'), term('diarrea', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('pérdida_de_apetito', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('diarrea', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('respiratory_rate', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('temperature', 'high')), 'high'),
+        (all_of(term('diarrea', 'high'), term('blood_pressure', 'low')), 'high'),
+        (all_of(term('dolor_abdominal', 'normal'), term('diarrea', 'normal')), 'normal'),
+        (all_of(term('fiebre', 'normal'), term('pérdida_de_apetito', 'normal')), 'normal'),
+        (all_of(term('náuseas', 'normal'), term('vómitos', 'normal')), 'normal'),
+        (all_of(term('fatiga', 'normal'), term('heart_rate', 'normal')), 'normal'),
+        (all_of(term('diarrea', 'low'), term('dolor_abdominal', 'low')), 'low'),
+        (all_of(term('fiebre', 'low'), term('náuseas', 'low')), 'low'),
+        (all_of(term('pérdida_de_apetito', 'low'), term('vómitos', 'low')), 'low'),
+        (all_of(term('temperature', 'low'), term('fiebre', 'low')), 'low'),
+        (all_of(term('fiebre', 'high'), term('diarrea', 'high'), term('dolor_abdominal', 'high'), term('fatiga', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('vómitos', 'high'), term('náuseas', 'high'), term('temperature', 'high')), 'high'),
+    ]),
+    ('Enfermedades del Sistema Nervioso', [
+        (all_of(term('dolor_de_cabeza', 'high'), term('mareos', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('mareos', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('blood_pressure', 'high')), 'high'),
+        (all_of(term('mareos', 'high'), term('blood_pressure', 'high')), 'high'),
+        (all_of(term('heart_rate', 'high'), term('dolor_de_cabeza', 'high')), 'high'),
+        (all_of(term('blood_pressure', 'high'), term('mareos', 'high')), 'high'),
+        (all_of(term('respiratory_rate', 'high'), term('dolor_de_cabeza', 'high')), 'high'),
+        (all_of(term('temperature', 'high'), term('dolor_de_cabeza', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'normal'), term('mareos', 'normal')), 'normal'),
+        (all_of(term('dolor_de_cabeza', 'normal'), term('fatiga', 'normal')), 'normal'),
+        (all_of(term('blood_pressure', 'normal'), term('mareos', 'normal')), 'normal'),
+        (all_of(term('heart_rate', 'normal'), term('dolor_de_cabeza', 'normal')), 'normal'),
+        (all_of(term('dolor_de_cabeza', 'low'), term('mareos', 'low')), 'low'),
+        (all_of(term('heart_rate', 'low'), term('dolor_de_cabeza', 'low')), 'low'),
+        (all_of(term('blood_pressure', 'low'), term('mareos', 'low')), 'low'),
+        (all_of(term('temperature', 'low'), term('dolor_de_cabeza', 'low')), 'low'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('mareos', 'high'), term('heart_rate', 'high'), term('blood_pressure', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('fatiga', 'high'), term('temperature', 'high'), term('respiratory_rate', 'high')), 'high'),
+    ]),
+    ('Enfermedades del Sistema Urinario', [
+        (all_of(term('dolor_al_orinar', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('dolor_al_orinar', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('dolor_al_orinar', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('fiebre', 'high'), term('dolor_abdominal', 'high')), 'high'),
+        (all_of(term('dolor_al_orinar', 'high'), term('blood_pressure', 'low')), 'high'),
+        (all_of(term('dolor_al_orinar', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('fiebre', 'normal'), term('blood_pressure', 'low')), 'normal'),
+        (all_of(term('fiebre', 'high'), term('respiratory_rate', 'high')), 'high'),
+        (all_of(term('dolor_al_orinar', 'normal'), term('fiebre', 'normal')), 'normal'),
+        (all_of(term('dolor_al_orinar', 'normal'), term('dolor_abdominal', 'normal')), 'normal'),
+        (all_of(term('blood_pressure', 'normal'), term('fiebre', 'normal')), 'normal'),
+        (all_of(term('dolor_al_orinar', 'normal'), term('fatiga', 'normal')), 'normal'),
+        (all_of(term('dolor_al_orinar', 'low'), term('fiebre', 'low')), 'low'),
+        (all_of(term('blood_pressure', 'low'), term('fiebre', 'low')), 'low'),
+        (all_of(term('heart_rate', 'low'), term('dolor_abdominal', 'low')), 'low'),
+        (term('fiebre', 'low'), 'low'),
+        (all_of(term('dolor_al_orinar', 'high'), term('fiebre', 'high'), term('dolor_abdominal', 'high'), term('blood_pressure', 'low')), 'high'),
+        (all_of(term('dolor_al_orinar', 'high'), term('fiebre', 'high'), term('heart_rate', 'high'), term('respiratory_rate', 'high')), 'high'),
+    ]),
+    ('Enfermedades de la Piel y Tejido Subcutáneo', [
+        (all_of(term('picazón', 'high'), term('dolor_abdominal', 'low')), 'high'),
+        (all_of(term('picazón', 'high'), term('erupciones_cutáneas', 'high')), 'high'),
+        (all_of(term('picazón', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('picazón', 'high'), term('fiebre', 'normal')), 'normal'),
+        (all_of(term('picazón', 'high'), term('fiebre', 'high')), 'high'),
+        (all_of(term('picazón', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('erupciones_cutáneas', 'high'), term('temperature', 'high')), 'high'),
+        (all_of(term('picazón', 'high'), term('respiratory_rate', 'high')), 'normal'),
+        (all_of(term('picazón', 'normal'), term('erupciones_cutáneas', 'normal')), 'normal'),
+        (all_of(term('picazón', 'normal'), term('fatiga', 'normal')), 'normal'),
+        (all_of(term('fiebre', 'normal'), term('erupciones_cutáneas', 'normal')), 'normal'),
+        (all_of(term('picazón', 'normal'), term('heart_rate', 'normal')), 'normal'),
+        (all_of(term('picazón', 'low'), term('erupciones_cutáneas', 'low')), 'low'),
+        (all_of(term('picazón', 'low'), term('fatiga', 'low')), 'low'),
+        (all_of(term('heart_rate', 'low'), term('picazón', 'low')), 'low'),
+        (all_of(term('fiebre', 'low'), term('erupciones_cutáneas', 'low')), 'low'),
+        (all_of(term('picazón', 'high'), term('erupciones_cutáneas', 'high'), term('fiebre', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('picazón', 'high'), term('fatiga', 'high'), term('temperature', 'high'), term('erupciones_cutáneas', 'high')), 'high'),
+    ]),
+    ('Enfermedades del Sistema Circulatorio', [
+        (all_of(term('mareos', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('mareos', 'high')), 'high'),
+        (all_of(term('fatiga', 'high'), term('dolor_de_cabeza', 'high')), 'high'),
+        (all_of(term('blood_pressure', 'high'), term('fatiga', 'high')), 'high'),
+        (all_of(term('mareos', 'high'), term('blood_pressure', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('fatiga', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('blood_pressure', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('mareos', 'normal'), term('dolor_de_cabeza', 'normal')), 'normal'),
+        (all_of(term('fatiga', 'normal'), term('blood_pressure', 'normal')), 'normal'),
+        (all_of(term('mareos', 'normal'), term('heart_rate', 'normal')), 'normal'),
+        (all_of(term('dolor_de_cabeza', 'normal'), term('heart_rate', 'normal')), 'normal'),
+        (all_of(term('mareos', 'low'), term('fatiga', 'low')), 'low'),
+        (all_of(term('blood_pressure', 'low'), term('dolor_de_cabeza', 'low')), 'low'),
+        (all_of(term('heart_rate', 'low'), term('mareos', 'low')), 'low'),
+        (all_of(term('fatiga', 'low'), term('heart_rate', 'low')), 'low'),
+        (all_of(term('mareos', 'high'), term('fatiga', 'high'), term('blood_pressure', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('dolor_de_cabeza', 'high'), term('mareos', 'high'), term('blood_pressure', 'high'), term('heart_rate', 'high')), 'high'),
+        (all_of(term('blood_pressure', 'normal'), term('fatiga', 'normal'), term('mareos', 'normal')), 'normal'),
+    ]),
+]
+
+
+def load_default_rules(apps, schema_editor):
+    DiseaseGroup = apps.get_model('diagnoses', 'DiseaseGroup')
+    FuzzyRule = apps.get_model('diagnoses', 'FuzzyRule')
+    VersionStamp = apps.get_model('diagnoses', 'VersionStamp')
+
+    # Los grupos se buscan por nombre. Si la base aún no los tiene se crean con el pk que les dan los fixtures
+    # (el orden de diseasegroup.json), para que los fixtures cargados después los completen. Un pk ocupado por
+    # otro grupo detiene la migración: las reglas acabarían en ese grupo sin ningún aviso
+    created = False
+    for pk, (group_name, rules) in enumerate(DEFAULT_RULES, start=1):
+        group = DiseaseGroup.objects.filter(name=group_name).first()
+        if group is None:
+            other = DiseaseGroup.objects.filter(pk=pk).first()
+            if other is not None:
+                raise RuntimeError(
+                    f"Disease group {pk} is '{other.name}', expected '{group_name}'; "
+                    f"create '{group_name}' before migrating so its default rules can be attached to it"
+                )
+            group = DiseaseGroup.objects.create(pk=pk, name=group_name)
+            created = True
+        FuzzyRule.objects.bulk_create([
+            FuzzyRule(disease_group=group, order=order, antecedent=antecedent, consequent=consequent)
+            for order, (antecedent, consequent) in enumerate(rules)
+        ])
+    if created:
+        # Los pk explícitos no avanzan la secuencia en PostgreSQL; loaddata hace lo mismo al terminar
+        with schema_editor.connection.cursor() as cursor:
+            for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [DiseaseGroup]):
+                cursor.execute(sql)
+    stamp, _ = VersionStamp.objects.get_or_create(name='rule_base')
+    stamp.version += 1
+    stamp.save()
+
+
+def remove_default_rules(apps, schema_editor):
+    apps.get_model('diagnoses', 'FuzzyRule').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0002_fuzzyrule_versionstamp'),
+    ]
+
+    operations = [
+        migrations.RunPython(load_default_rules, remove_default_rules),
+    ]
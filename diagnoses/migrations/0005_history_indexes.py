@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_unique_group_names(apps, schema_editor):
+    # Falla con un mensaje claro en vez de un error de integridad si hay grupos repetidos
+    DiseaseGroup = apps.get_model('diagnoses', 'DiseaseGroup')
+    duplicated = list(
+        DiseaseGroup.objects.values('name').annotate(count=Count('pk')).filter(count__gt=1).values_list('name', flat=True)
+    )
+    if duplicated:
+        raise RuntimeError(f"Merge the duplicated disease groups before migrating: {', '.join(duplicated)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0004_diagnosis_write_behind'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_unique_group_names, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='diseasegroup',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['created_at'], name='diagnosis_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosisgroupprobability',
+            index=models.Index(fields=['disease_group', 'probability_level', 'diagnosis'], name='diag_group_probability_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='symptom',
+            index=models.Index(fields=['name'], name='symptom_name_idx'),
+        ),
+    ]
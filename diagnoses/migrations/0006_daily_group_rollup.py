@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    # Totales de los diagnósticos ya guardados, con el mismo criterio que analytics.rebuild_daily_rollups
+    DiagnosisGroupProbability = apps.get_model('diagnoses', 'DiagnosisGroupProbability')
+    DailyGroupRollup = apps.get_model('diagnoses', 'DailyGroupRollup')
+    totals = {}
+    previous = None
+    rows = DiagnosisGroupProbability.objects.order_by('diagnosis_id', '-probability_level', 'pk').values_list(
+        'diagnosis_id', 'diagnosis__created_at', 'disease_group_id', 'probability_level',
+    ).iterator(chunk_size=2000)
+    for diagnosis_id, created_at, group_id, probability in rows:
+        entry = totals.setdefault((timezone.localdate(created_at), group_id), [0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += int(diagnosis_id != previous)
+        entry[2] += probability
+        previous = diagnosis_id
+    DailyGroupRollup.objects.bulk_create([
+        DailyGroupRollup(date=day, disease_group_id=group_id, diagnoses=count, top_diagnoses=top, probability_sum=total)
+        for (day, group_id), (count, top, total) in totals.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0005_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyGroupRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('diagnoses', models.PositiveIntegerField(default=0)),
+                ('top_diagnoses', models.PositiveIntegerField(default=0)),
+                ('probability_sum', models.FloatField(default=0)),
+                ('disease_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='diagnoses.diseasegroup')),
+            ],
+            options={
+                'ordering': ['date', 'disease_group'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'disease_group'), name='daily_group_rollup_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
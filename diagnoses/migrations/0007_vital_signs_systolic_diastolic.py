@@ -0,0 +1,59 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:53
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def rename_variable(node, old, new):
+    # Copia del árbol del antecedente con la variable old renombrada a new
+    if 'variable' in node:
+        return {**node, 'variable': new} if node['variable'] == old else node
+    (kind, children), = node.items()
+    if kind == 'not':
+        return {kind: rename_variable(children, old, new)}
+    return {kind: [rename_variable(child, old, new) for child in children]}
+
+
+def rename_rule_variable(apps, old, new):
+    # Las reglas sobre la presión arterial pasan a la presión sistólica, que es lo que medía su universo (80-180)
+    FuzzyRule = apps.get_model('diagnoses', 'FuzzyRule')
+    VersionStamp = apps.get_model('diagnoses', 'VersionStamp')
+    changed = []
+    for rule in FuzzyRule.objects.all():
+        antecedent = rename_variable(rule.antecedent, old, new)
+        if antecedent != rule.antecedent:
+            rule.antecedent = antecedent
+            changed.append(rule)
+    FuzzyRule.objects.bulk_update(changed, ['antecedent'])
+    # Los procesos en marcha recompilan el motor al ver el sello adelantado
+    if changed and not VersionStamp.objects.filter(name='rule_base').update(version=F('version') + 1):
+        VersionStamp.objects.create(name='rule_base', version=1)
+
+
+def rules_to_systolic(apps, schema_editor):
+    rename_rule_variable(apps, 'blood_pressure', 'systolic')
+
+
+def rules_to_blood_pressure(apps, schema_editor):
+    rename_rule_variable(apps, 'systolic', 'blood_pressure')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0006_daily_group_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vitalsigns',
+            name='diastolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vitalsigns',
+            name='systolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(rules_to_systolic, rules_to_blood_pressure),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:55
+
+import re
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK_SIZE = 2000
+
+# Igual que models.BLOOD_PRESSURE_PATTERN en el momento de escribir la migración
+BLOOD_PRESSURE_PATTERN = re.compile(r'^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$')
+
+
+def backfill_systolic_diastolic(apps, schema_editor):
+    # Por bloques de clave primaria, cada uno en su transacción, para no bloquear la tabla ni cargarla entera.
+    # Las filas cuyo texto no tiene la forma "120/80" quedan con sistólica y diastólica nulas
+    VitalSigns = apps.get_model('diagnoses', 'VitalSigns')
+    last_pk = 0
+    while True:
+        chunk = list(
+            VitalSigns.objects.filter(pk__gt=last_pk, systolic__isnull=True)
+            .order_by('pk').only('pk', 'blood_pressure')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        parsed = []
+        for vitals in chunk:
+            match = BLOOD_PRESSURE_PATTERN.match(vitals.blood_pressure or '')
+            if match:
+                vitals.systolic, vitals.diastolic = int(match[1]), int(match[2])
+                parsed.append(vitals)
+        with transaction.atomic():
+            VitalSigns.objects.bulk_update(parsed, ['systolic', 'diastolic'])
+
+
+class Migration(migrations.Migration):
+    # Sin transacción global: el relleno confirma bloque a bloque y se puede reanudar si se interrumpe.
+    # Los índices se crean después, sobre la tabla ya rellena
+    atomic = False
+
+    dependencies = [
+        ('diagnoses', '0007_vital_signs_systolic_diastolic'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_systolic_diastolic, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='vitalsigns',
+            index=models.Index(fields=['systolic'], name='vitals_systolic_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vitalsigns',
+            index=models.Index(fields=['diastolic'], name='vitals_diastolic_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnoses', '0008_backfill_systolic_diastolic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosis',
+            name='request_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='pendingdiagnosis',
+            name='request_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
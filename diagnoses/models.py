@@ -1,21 +1,48 @@
+import re
+
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+
+from .rules import describe_antecedent, validate_antecedent
+
+# Presión arterial escrita como "sistólica/diastólica", por ejemplo '120/80'
+BLOOD_PRESSURE_PATTERN = re.compile(r'^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$')
+
+
+def parse_blood_pressure(value):
+    # (sistólica, diastólica) en mmHg, o None si el texto no tiene ese formato
+    match = BLOOD_PRESSURE_PATTERN.match(value or '')
+    return (int(match[1]), int(match[2])) if match else None
 
 # Modelo de síntomas generales
 class Symptom(models.Model):
     name = models.CharField(max_length=100)  # Nombre del síntoma, por ejemplo, "Dolor de cabeza"
     description = models.TextField(null=True, blank=True)  # Descripción opcional del síntoma
 
+    class Meta:
+        indexes = [models.Index(fields=['name'], name='symptom_name_idx')]
+
     def __str__(self):
         return self.name
 
 # Modelo de signos vitales objetivos
 class VitalSigns(models.Model):
     blood_pressure = models.CharField(max_length=20)  # Presión arterial, por ejemplo, '120/80'
+    systolic = models.PositiveSmallIntegerField(null=True, blank=True)  # Presión sistólica en mmHg
+    diastolic = models.PositiveSmallIntegerField(null=True, blank=True)  # Presión diastólica en mmHg
     heart_rate = models.IntegerField()  # Frecuencia cardíaca en bpm
     respiratory_rate = models.IntegerField()  # Frecuencia respiratoria en respiraciones por minuto
     temperature = models.FloatField()  # Temperatura en grados Celsius
     weight = models.FloatField()  # Peso en kilogramos
 
+    class Meta:
+        # Búsquedas del historial por rango de presión arterial
+        indexes = [
+            models.Index(fields=['systolic'], name='vitals_systolic_idx'),
+            models.Index(fields=['diastolic'], name='vitals_diastolic_idx'),
+        ]
+
     def __str__(self):
         return f"BP: {self.blood_pressure}, HR: {self.heart_rate}"
 
@@ -29,7 +56,7 @@ class Disease(models.Model):
 
 # Modelo de grupo de enfermedades (Ej: IRA, Enfermedades Gastrointestinales)
 class DiseaseGroup(models.Model):
-    name = models.CharField(max_length=100)  # Nombre del grupo de enfermedades, como "IRA"
+    name = models.CharField(max_length=100, unique=True)  # Nombre del grupo de enfermedades, como "IRA"
     cie_codes = models.ManyToManyField(Disease)  # Enlace a varias enfermedades con sus códigos CIE-10
 
     def __str__(self):
@@ -49,7 +76,13 @@ class Diagnosis(models.Model):
     symptoms = models.ManyToManyField(Symptom, through='DiagnosisSymptom')  # Relación con síntomas y su intensidad
     vital_signs = models.OneToOneField(VitalSigns, on_delete=models.CASCADE)  # Relación uno-a-uno con los signos vitales
     groups = models.ManyToManyField(DiseaseGroup, through='DiagnosisGroupProbability')  # Grupos de enfermedades con probabilidades
-    created_at = models.DateTimeField(auto_now_add=True)  # Fecha del diagnóstico
+    created_at = models.DateTimeField(default=timezone.now, editable=False)  # Fecha del diagnóstico (la de la petición en modo write-behind)
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)  # Clave del cliente para no duplicar reintentos
+    request_hash = models.CharField(max_length=64, blank=True, editable=False)  # SHA-256 del cuerpo enviado con esa clave; otro cuerpo con la misma clave se rechaza
+
+    class Meta:
+        # Listados por rango de fechas y paginación por -created_at
+        indexes = [models.Index(fields=['created_at'], name='diagnosis_created_at_idx')]
 
     def __str__(self):
         return f"Diagnosis on {self.created_at}"
@@ -69,5 +102,97 @@ class DiagnosisGroupProbability(models.Model):
     disease_group = models.ForeignKey(DiseaseGroup, on_delete=models.CASCADE)
     probability_level = models.FloatField()  # Nivel de probabilidad específico para este diagnóstico y grupo
 
+    class Meta:
+        # "Diagnósticos donde el grupo X superó Y": rango sobre la probabilidad dentro del grupo,
+        # con el diagnóstico incluido para no leer la tabla
+        indexes = [
+            models.Index(fields=['disease_group', 'probability_level', 'diagnosis'], name='diag_group_probability_idx'),
+        ]
+
     def __str__(self):
         return f"{self.disease_group.name} - Probability: {self.probability_level}"
+
+# Totales diarios por grupo de enfermedades, mantenidos al insertar diagnósticos (analytics.record_diagnoses)
+# y reconstruibles con "python manage.py rebuild_group_rollups"
+class DailyGroupRollup(models.Model):
+    date = models.DateField()  # Día del diagnóstico en la zona horaria del proyecto
+    disease_group = models.ForeignKey(DiseaseGroup, on_delete=models.CASCADE)
+    diagnoses = models.PositiveIntegerField(default=0)  # Diagnósticos en los que el grupo aparece en el ranking
+    top_diagnoses = models.PositiveIntegerField(default=0)  # Diagnósticos en los que el grupo quedó primero
+    probability_sum = models.FloatField(default=0)  # Suma de probabilidades, para la media
+
+    class Meta:
+        ordering = ['date', 'disease_group']
+        constraints = [models.UniqueConstraint(fields=['date', 'disease_group'], name='daily_group_rollup_unique')]
+
+    @property
+    def mean_probability(self):
+        return self.probability_sum / self.diagnoses if self.diagnoses else None
+
+    def __str__(self):
+        return f"{self.date} {self.disease_group.name}: {self.diagnoses}"
+
+# Regla difusa de un grupo de enfermedades. El antecedente es un árbol JSON:
+# {"variable": "fiebre", "term": "high"}, {"and": [...]}, {"or": [...]} o {"not": {...}}
+class FuzzyRule(models.Model):
+    TERM_CHOICES = [('low', 'Low'), ('normal', 'Normal'), ('high', 'High')]
+
+    disease_group = models.ForeignKey(DiseaseGroup, on_delete=models.CASCADE, related_name='fuzzy_rules')  # Grupo al que aplica la regla
+    order = models.PositiveIntegerField(default=0)  # Posición de la regla dentro del grupo
+    antecedent = models.JSONField()  # Árbol de la condición sobre síntomas y signos vitales
+    consequent = models.CharField(max_length=10, choices=TERM_CHOICES)  # Término de probabilidad que activa
+    weight = models.FloatField(default=1.0)  # Peso de la regla sobre el término de salida (0-1)
+
+    class Meta:
+        ordering = ['disease_group', 'order', 'pk']
+
+    def clean(self):
+        try:
+            validate_antecedent(self.antecedent)
+        except ValueError as error:
+            raise ValidationError({'antecedent': str(error)})
+        if not 0 <= self.weight <= 1:
+            raise ValidationError({'weight': 'Weight must be between 0 and 1.'})
+
+    def __str__(self):
+        return f"{self.disease_group.name}: IF {describe_antecedent(self.antecedent)} THEN {self.consequent}"
+
+# Versión de un catálogo; se incrementa con cada cambio para invalidar cachés sin comparar contenidos
+class VersionStamp(models.Model):
+    name = models.CharField(max_length=50, unique=True)  # Catálogo versionado, por ejemplo "rule_base"
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def stamp(cls, name):
+        # Versión y fecha del último cambio; (0, None) si el catálogo aún no se ha versionado
+        return cls.objects.filter(name=name).values_list('version', 'updated_at').first() or (0, None)
+
+    @classmethod
+    def bump(cls, name):
+        updated = cls.objects.filter(name=name).update(version=models.F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(name=name, defaults={'version': 1})
+
+# Diagnóstico ya calculado y devuelto al cliente, pendiente de persistir (modo write-behind).
+# Lo vacía "python manage.py drain_diagnosis_queue" en transacciones por lotes.
+class PendingDiagnosis(models.Model):
+    idempotency_key = models.CharField(max_length=64, unique=True)  # Misma clave que tendrá el Diagnosis guardado
+    request_hash = models.CharField(max_length=64, blank=True)  # Huella del cuerpo de la petición, como Diagnosis.request_hash
+    payload = models.JSONField()  # Encuentro validado, ranking e informe de entradas: {"encounter": {...}, "groups": [[id, probabilidad], ...], "rejected_inputs": [...]}
+    created_at = models.DateTimeField(default=timezone.now)  # Fecha de la petición
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)  # Motivo por el que no se pudo persistir; se excluye de los siguientes vaciados
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"Pending diagnosis {self.idempotency_key}"
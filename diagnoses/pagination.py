@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DiagnosisCursorPagination(CursorPagination):
+    # Paginación opcional: solo se activa si llega ?page_size= o ?cursor=
+    ordering = '-created_at'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        params = request.query_params
+        if self.page_size_query_param not in params and self.cursor_query_param not in params:
+            return None
+        return super().get_page_size(request)
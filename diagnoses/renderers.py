@@ -0,0 +1,89 @@
+import csv
+import io
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+# Bytes que se leen del iterador síncrono en cada salto de hilo al servir por ASGI
+ASGI_BLOCK_SIZE = 64 * 1024
+
+
+def stream_json_array(items, renderer=None):
+    # Genera un arreglo JSON elemento por elemento para no materializar toda la respuesta
+    renderer = renderer or JSONRenderer()
+    yield b'['
+    first = True
+    for item in items:
+        if not first:
+            yield b','
+        yield renderer.render(item)
+        first = False
+    yield b']'
+
+
+async def astream_json_array(items, renderer=None):
+    # Igual que stream_json_array pero sobre un iterador asíncrono, para respuestas servidas por ASGI
+    renderer = renderer or JSONRenderer()
+    yield b'['
+    first = True
+    async for item in items:
+        if not first:
+            yield b','
+        yield renderer.render(item)
+        first = False
+    yield b']'
+
+
+def streaming_response(request, chunks, **kwargs):
+    # Bajo ASGI Django consume los iteradores síncronos con sync_to_async(list) y arma la respuesta entera
+    # en memoria antes de enviarla; allí se entrega un iterador asíncrono que lee por bloques
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = aiterate_blocks(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
+
+
+async def aiterate_blocks(chunks, block_size=ASGI_BLOCK_SIZE):
+    # Cada bloque se lee en el hilo de las vistas síncronas (thread_sensitive), el de la conexión
+    # que abrió la consulta, y solo se salta de hilo una vez por bloque, no por elemento
+    chunks = iter(chunks)
+    read_block = sync_to_async(next_block, thread_sensitive=True)
+    while block := await read_block(chunks, block_size):
+        yield block
+
+
+def next_block(chunks, block_size):
+    block = []
+    size = 0
+    for chunk in chunks:
+        block.append(chunk)
+        size += len(chunk)
+        if size >= block_size:
+            break
+    return b''.join(block)
+
+
+class NDJSONRenderer(BaseRenderer):
+    # Formato de /api/diagnoses/export/; las filas se transmiten aparte y render() solo recibe errores
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Errores de validación como filas "campo,mensaje"
+        lines = io.StringIO()
+        writer = csv.writer(lines)
+        for field, messages in (data or {}).items():
+            for message in messages if isinstance(messages, list) else [messages]:
+                writer.writerow([field, message])
+        return lines.getvalue().encode()
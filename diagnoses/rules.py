@@ -0,0 +1,63 @@
+import operator
+from functools import reduce
+
+# Términos lingüísticos de todas las variables de entrada y de la probabilidad de salida
+TERM_LABELS = ['low', 'normal', 'high']
+OPERATORS = {'and': operator.and_, 'or': operator.or_}
+
+
+def validate_antecedent(node, variables=None):
+    # Comprueba la forma del árbol; con variables, también que cada hoja exista
+    if not isinstance(node, dict) or not node:
+        raise ValueError(f"Invalid antecedent node: {node!r}")
+    if 'variable' in node:
+        if set(node) != {'variable', 'term'}:
+            raise ValueError(f"A term node needs exactly 'variable' and 'term': {node!r}")
+        if node['term'] not in TERM_LABELS:
+            raise ValueError(f"Unknown term '{node['term']}'")
+        if variables is not None and node['variable'] not in variables:
+            raise ValueError(f"Unknown variable '{node['variable']}'")
+        return
+    if len(node) != 1:
+        raise ValueError(f"An operator node needs a single key: {node!r}")
+    (kind, children), = node.items()
+    if kind == 'not':
+        validate_antecedent(children, variables)
+    elif kind in OPERATORS:
+        if not isinstance(children, list) or len(children) < 2:
+            raise ValueError(f"'{kind}' needs a list of at least two conditions")
+        for child in children:
+            validate_antecedent(child, variables)
+    else:
+        raise ValueError(f"Unknown operator '{kind}'")
+
+
+def build_antecedent(node, variables):
+    # Árbol JSON -> expresión de skfuzzy. Las listas se encadenan por la izquierda (a & b & c),
+    # igual que escritas a mano, para que la regla compilada sea idéntica
+    if 'variable' in node:
+        return variables[node['variable']][node['term']]
+    (kind, children), = node.items()
+    if kind == 'not':
+        return ~build_antecedent(children, variables)
+    return reduce(OPERATORS[kind], [build_antecedent(child, variables) for child in children])
+
+
+def antecedent_variables(node):
+    if 'variable' in node:
+        return {node['variable']}
+    (kind, children), = node.items()
+    if kind == 'not':
+        return antecedent_variables(children)
+    return set().union(*(antecedent_variables(child) for child in children))
+
+
+def describe_antecedent(node, nested=False):
+    # Representación legible, por ejemplo "fiebre[high] & (tos[high] | dolor_de_garganta[high])"
+    if 'variable' in node:
+        return f"{node['variable']}[{node['term']}]"
+    (kind, children), = node.items()
+    if kind == 'not':
+        return f"~{describe_antecedent(children, nested=True)}"
+    text = f" {'&' if kind == 'and' else '|'} ".join(describe_antecedent(child, nested=True) for child in children)
+    return f"({text})" if nested else text
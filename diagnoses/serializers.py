@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Symptom, VitalSigns, Disease, DiseaseGroup, GroupSymptom, Diagnosis, DiagnosisSymptom, DiagnosisGroupProbability
+from .models import Symptom, VitalSigns, Disease, DiseaseGroup, GroupSymptom, Diagnosis, DiagnosisSymptom, DiagnosisGroupProbability, DailyGroupRollup, parse_blood_pressure
 
 class SymptomSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,9 +7,26 @@ class SymptomSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class VitalSignsSerializer(serializers.ModelSerializer):
+    # La presión arterial llega como texto ("120/80"), como systolic y diastolic, o de ambas formas si coinciden
     class Meta:
         model = VitalSigns
         fields = '__all__'
+        extra_kwargs = {'blood_pressure': {'required': False}}
+
+    def validate(self, attrs):
+        systolic, diastolic = attrs.get('systolic'), attrs.get('diastolic')
+        if attrs.get('blood_pressure'):
+            parsed = parse_blood_pressure(attrs['blood_pressure'])
+            if parsed is None:
+                raise serializers.ValidationError({'blood_pressure': ['Expected systolic/diastolic, for example "120/80".']})
+            if (systolic is not None and systolic != parsed[0]) or (diastolic is not None and diastolic != parsed[1]):
+                raise serializers.ValidationError({'blood_pressure': ['Does not match systolic and diastolic.']})
+            attrs['systolic'], attrs['diastolic'] = parsed
+        elif systolic is None or diastolic is None:
+            raise serializers.ValidationError({'blood_pressure': ['Provide blood_pressure or both systolic and diastolic.']})
+        else:
+            attrs['blood_pressure'] = f'{systolic}/{diastolic}'
+        return attrs
 
 class DiseaseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -50,3 +67,31 @@ class DiagnosisSerializer(serializers.ModelSerializer):
     class Meta:
         model = Diagnosis
         fields = ['id', 'symptoms', 'vital_signs', 'groups', 'created_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Solo los diagnósticos recién calculados traen las entradas rechazadas o recortadas por el motor
+        if hasattr(instance, 'rejected_inputs'):
+            data['rejected_inputs'] = instance.rejected_inputs
+        return data
+
+class EncounterSymptomSerializer(serializers.Serializer):
+    symptom_id = serializers.IntegerField()
+    intensity = serializers.IntegerField()
+
+class EncounterSerializer(serializers.Serializer):
+    vital_signs = VitalSignsSerializer()
+    symptoms = EncounterSymptomSerializer(many=True)
+
+class PendingDiagnosisSerializer(DiagnosisSerializer):
+    # Diagnóstico aún sin guardar (modo write-behind): las relaciones se leen de la caché de prefetch
+    symptoms = DiagnosisSymptomSerializer(many=True, source='_prefetched_objects_cache.diagnosissymptom_set', read_only=True)
+    groups = DiagnosisGroupProbabilitySerializer(many=True, source='_prefetched_objects_cache.diagnosisgroupprobability_set', read_only=True)
+
+class DailyGroupRollupSerializer(serializers.ModelSerializer):
+    disease_group = serializers.CharField(source='disease_group.name')
+    mean_probability = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DailyGroupRollup
+        fields = ['date', 'disease_group_id', 'disease_group', 'diagnoses', 'top_diagnoses', 'mean_probability']
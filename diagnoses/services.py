@@ -0,0 +1,107 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .analytics import record_diagnoses
+from .fuzzy_inference import get_diagnosis_engine
+from .inference_queue import get_inference_queue
+from .instrumentation import stage
+from .models import Diagnosis, DiagnosisGroupProbability, DiagnosisSymptom, Symptom, VitalSigns
+
+
+def create_diagnoses(encounters, idempotency_keys=None, request_hashes=None):
+    # encounters: datos validados por EncounterSerializer; devuelve los diagnósticos creados en el mismo orden
+    with stage('engine'):
+        engine = get_diagnosis_engine()
+
+    # Una sola consulta para todos los síntomas del lote
+    with stage('symptoms'):
+        symptoms = Symptom.objects.in_bulk(encounter_symptom_ids(encounters))
+    with stage('inputs'):
+        inputs, rejected = encounter_inputs(engine, encounters, symptoms)
+    with stage('inference'):
+        rankings = engine.diagnose_batch(inputs)
+    with stage('store'):
+        return store_diagnoses(engine, encounters, symptoms, rankings, idempotency_keys, rejected, request_hashes)
+
+
+async def acreate_diagnoses(encounters, idempotency_keys=None, request_hashes=None):
+    # Variante asíncrona: lecturas con el ORM asíncrono, inferencia en la cola acotada de inferencia
+    # y escritura en una transacción síncrona. Lanza QueueFull si la cola está llena.
+    with stage('engine'):
+        engine = await sync_to_async(get_diagnosis_engine)()
+    with stage('symptoms'):
+        symptoms = await Symptom.objects.ain_bulk(encounter_symptom_ids(encounters))
+    with stage('inputs'):
+        inputs, rejected = encounter_inputs(engine, encounters, symptoms)
+    with stage('inference'):
+        rankings = await get_inference_queue().run(engine.diagnose_batch, inputs)
+    with stage('store'):
+        return await sync_to_async(store_diagnoses)(
+            engine, encounters, symptoms, rankings, idempotency_keys, rejected, request_hashes)
+
+
+def encounter_symptom_ids(encounters):
+    return {item['symptom_id'] for encounter in encounters for item in encounter['symptoms']}
+
+
+def encounter_inputs(engine, encounters, symptoms):
+    # Matriz de entradas del motor (columnas por id de síntoma, sin normalizar nombres) y entradas rechazadas
+    unknown = sorted(encounter_symptom_ids(encounters) - symptoms.keys())
+    if unknown:
+        raise ValidationError({'symptoms': [f"Unknown symptom id {symptom_id}" for symptom_id in unknown]})
+    return engine.encode(encounters)
+
+
+def build_diagnoses(encounters, symptoms, rankings, groups, created_at=None, idempotency_keys=None, rejected=None,
+                    request_hashes=None):
+    # Objetos sin guardar con las relaciones en la caché de prefetch, para que DiagnosisSerializer no consulte.
+    # groups: grupos de enfermedad indexados por el valor de 'group' de cada resultado del ranking.
+    # rejected: entradas que el motor rechazó o recortó en cada encuentro; se devuelven pero no se guardan
+    created_at = created_at or timezone.now()
+    idempotency_keys = idempotency_keys or [None] * len(encounters)
+    request_hashes = request_hashes or [''] * len(encounters)
+    diagnoses = []
+    for index, (encounter, ranking, key, request_hash) in enumerate(zip(encounters, rankings, idempotency_keys, request_hashes)):
+        diagnosis = Diagnosis(vital_signs=VitalSigns(**encounter['vital_signs']), created_at=created_at, idempotency_key=key,
+                              request_hash=request_hash)
+        if rejected is not None:
+            diagnosis.rejected_inputs = rejected[index]
+        diagnosis._prefetched_objects_cache = {
+            'diagnosissymptom_set': [
+                DiagnosisSymptom(diagnosis=diagnosis, symptom=symptoms[item['symptom_id']], intensity=item['intensity'])
+                for item in encounter['symptoms']
+            ],
+            'diagnosisgroupprobability_set': [
+                DiagnosisGroupProbability(
+                    diagnosis=diagnosis,
+                    disease_group=groups[result['group']],
+                    probability_level=result['probability'],
+                )
+                for result in ranking
+            ],
+        }
+        diagnoses.append(diagnosis)
+    return diagnoses
+
+
+def save_diagnoses(diagnoses):
+    # Una inserción masiva por tabla y los totales diarios, en una sola transacción
+    with transaction.atomic():
+        VitalSigns.objects.bulk_create([diagnosis.vital_signs for diagnosis in diagnoses])
+        Diagnosis.objects.bulk_create(diagnoses)
+        DiagnosisSymptom.objects.bulk_create([
+            item for diagnosis in diagnoses for item in diagnosis._prefetched_objects_cache['diagnosissymptom_set']
+        ])
+        DiagnosisGroupProbability.objects.bulk_create([
+            item for diagnosis in diagnoses for item in diagnosis._prefetched_objects_cache['diagnosisgroupprobability_set']
+        ])
+        record_diagnoses(diagnoses)
+    return diagnoses
+
+
+def store_diagnoses(engine, encounters, symptoms, rankings, idempotency_keys=None, rejected=None, request_hashes=None):
+    groups = {group.name: group for group in engine.disease_groups}
+    return save_diagnoses(build_diagnoses(encounters, symptoms, rankings, groups, idempotency_keys=idempotency_keys,
+                                          rejected=rejected, request_hashes=request_hashes))
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .fuzzy_inference import RULE_BASE_VERSION, invalidate_diagnosis_engine
+from .http_cache import CATALOGUE_VERSION, forget_diagnosis_response, invalidate_catalogue_stamp
+from .models import Diagnosis, Disease, DiseaseGroup, FuzzyRule, GroupSymptom, Symptom, VersionStamp
+
+
+@receiver(post_save, sender=Symptom)
+@receiver(post_delete, sender=Symptom)
+@receiver(post_save, sender=DiseaseGroup)
+@receiver(post_delete, sender=DiseaseGroup)
+@receiver(post_save, sender=GroupSymptom)
+@receiver(post_delete, sender=GroupSymptom)
+@receiver(post_save, sender=Disease)
+@receiver(post_delete, sender=Disease)
+@receiver(post_save, sender=FuzzyRule)
+@receiver(post_delete, sender=FuzzyRule)
+@receiver(m2m_changed, sender=DiseaseGroup.cie_codes.through)
+def invalidate_compiled_engine(sender, **kwargs):
+    # El sello avisa a los demás procesos; se escribe en la misma transacción que el cambio
+    VersionStamp.bump(RULE_BASE_VERSION)
+    # Invalidar ya y de nuevo al confirmar, por si otro hilo recompiló con datos aún sin commit
+    invalidate_diagnosis_engine()
+    transaction.on_commit(invalidate_diagnosis_engine)
+
+
+@receiver(post_save, sender=Symptom)
+@receiver(post_delete, sender=Symptom)
+@receiver(post_save, sender=DiseaseGroup)
+@receiver(post_delete, sender=DiseaseGroup)
+@receiver(post_save, sender=GroupSymptom)
+@receiver(post_delete, sender=GroupSymptom)
+@receiver(post_save, sender=Disease)
+@receiver(post_delete, sender=Disease)
+@receiver(m2m_changed, sender=DiseaseGroup.cie_codes.through)
+def invalidate_catalogue(sender, **kwargs):
+    # Cambia el ETag de /api/symptoms/ y de cada diagnóstico, que muestra nombres y códigos CIE
+    VersionStamp.bump(CATALOGUE_VERSION)
+    invalidate_catalogue_stamp()
+    transaction.on_commit(invalidate_catalogue_stamp)
+
+
+@receiver(post_delete, sender=Diagnosis)
+def forget_deleted_diagnosis(sender, instance, **kwargs):
+    # Un diagnóstico borrado no debe seguir sirviéndose desde la caché de respuestas, compartida por todos los
+    # procesos. Otra vez al confirmar: hasta entonces otra petición aún puede leerlo y volver a guardarlo
+    forget_diagnosis_response(instance.pk)
+    transaction.on_commit(lambda: forget_diagnosis_response(instance.pk))
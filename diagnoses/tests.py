@@ -1,3 +1,1285 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count, F
+from django.core.cache import caches
+from django.http import QueryDict
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .fuzzy_inference import (
+    RULE_BASE_VERSION, FuzzyDiseaseGroupDiagnosis, get_diagnosis_engine, invalidate_diagnosis_engine, normalize_name,
+)
+from .executors import ProcessExecutor, ThreadExecutor, build_executor
+from .filters import filter_diagnoses
+from .importer import file_fingerprint, import_key, read_records, save_checkpoint
+from .http_cache import CATALOGUE_VERSION, diagnosis_response_key, get_response_cache, invalidate_catalogue_stamp
+from .inference_cache import get_result_cache
+from .inference_queue import get_inference_queue
+from .instrumentation import end_request, metrics, start_request
+from .lookup_tables import LookupTableEvaluator
+from .models import (
+    DailyGroupRollup, Diagnosis, DiagnosisGroupProbability, DiagnosisSymptom, DiseaseGroup, FuzzyRule, PendingDiagnosis, Symptom, VersionStamp,
+    VitalSigns,
+)
+from .rules import validate_antecedent
+from .serializers import EncounterSerializer
+from .views import existing_result
+from .warm_start import should_warm_start, warm_start
+
+FIXTURES = ['diseases.json', 'diseases_with_groups.json', 'symptoms.json', 'groupsymptom.json']
+
+
+def sample_inputs(engine, **overrides):
+    inputs = {
+        'systolic': 120,
+        'diastolic': 80,
+        'heart_rate': 95,
+        'respiratory_rate': 22,
+        'temperature': 38.4,
+        'weight': 70,
+    }
+    for name in engine.variables:
+        inputs.setdefault(name, 0)
+    inputs.update(overrides)
+    return inputs
+
+
+class DiagnosisEngineCacheTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        invalidate_diagnosis_engine()
+
+    def test_engine_is_compiled_once_per_process(self):
+        engine = get_diagnosis_engine()
+        self.assertIs(get_diagnosis_engine(), engine)
+        self.assertEqual(len(engine.systems), 7)
+
+    def test_catalogue_changes_invalidate_engine(self):
+        engine = get_diagnosis_engine()
+        Symptom.objects.create(name='Tos seca')
+        fresh = get_diagnosis_engine()
+        self.assertIsNot(fresh, engine)
+        self.assertIn('tos_seca', fresh.symptom_variables)
+
+    def test_cached_engine_matches_fresh_engine(self):
+        engine = get_diagnosis_engine()
+        inputs = sample_inputs(engine, fiebre=3, tos=2, congestión_nasal=3)
+        first = engine.diagnose(inputs)
+        self.assertEqual(engine.diagnose(inputs), first)
+        self.assertEqual(FuzzyDiseaseGroupDiagnosis().diagnose(inputs), first)
+
+
+def random_inputs(engine, rng):
+    inputs = {name: int(rng.integers(0, 4)) for name in engine.variables}
+    inputs.update({
+        'systolic': float(rng.uniform(60, 200)),
+        'diastolic': float(rng.uniform(30, 140)),
+        'heart_rate': float(rng.uniform(50, 170)),
+        'respiratory_rate': int(rng.integers(5, 35)),
+        'temperature': round(float(rng.uniform(34, 42)), 1),
+        'weight': float(rng.uniform(20, 160)),
+    })
+    return inputs
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class VectorizedEngineParityTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.engine = FuzzyDiseaseGroupDiagnosis()
+
+    def assertMatchesReference(self, inputs):
+        expected = self.engine.reference_probabilities(inputs)
+        actual = self.engine.group_probabilities(inputs)
+        self.assertEqual(actual.keys(), expected.keys())
+        for group, probability in expected.items():
+            if probability is None:
+                self.assertIsNone(actual[group], group)
+            else:
+                self.assertAlmostEqual(actual[group], probability, places=9, msg=group)
+        self.assertEqual(
+            [result['group'] for result in self.engine.diagnose(inputs)],
+            [result['group'] for result in self.engine.diagnose_reference(inputs)],
+        )
+
+    def test_randomized_inputs_match_skfuzzy(self):
+        rng = np.random.default_rng(2024)
+        for _ in range(25):
+            self.assertMatchesReference(random_inputs(self.engine, rng))
+
+    def test_unknown_label_string_matches_skfuzzy(self):
+        self.assertMatchesReference(sample_inputs(self.engine, systolic='120/80', fiebre=3, náuseas=2, diarrea=3))
+
+    def test_groups_without_output_match_skfuzzy(self):
+        # Con intensidad 1 ningún término de síntoma tiene pertenencia y no se dispara ninguna regla
+        inputs = sample_inputs(self.engine, **{name: 1 for name in self.engine.variables})
+        inputs['temperature'] = 36.8
+        self.assertIn(None, self.engine.reference_probabilities(inputs).values())
+        self.assertMatchesReference(inputs)
+
+    def test_batch_evaluation_matches_single_rows(self):
+        rng = np.random.default_rng(7)
+        rows = [self.engine.normalize_inputs(random_inputs(self.engine, rng)) for _ in range(5)]
+        batch = self.engine.compiled.evaluate(rows)
+        for row, probabilities in zip(rows, batch):
+            np.testing.assert_allclose(probabilities, self.engine.compiled.evaluate([row])[0])
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class TopKPruningTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.engine = FuzzyDiseaseGroupDiagnosis()
+
+    def test_upper_bounds_cover_the_centroid(self):
+        compiled = self.engine.compiled
+        rng = np.random.default_rng(5)
+        cuts = rng.uniform(0, 1, (5000, len(compiled.group_names), len(compiled.output_labels)))
+        cuts = np.where(rng.uniform(0, 1, cuts.shape) < 0.4, 0.0, cuts) * compiled.term_present[None]
+        exact = compiled.defuzzify(cuts)
+        bounds = compiled.upper_bounds(cuts)
+        self.assertTrue(np.all(np.isnan(exact) | (bounds >= exact - 1e-9)))
+        self.assertTrue(np.all(np.isneginf(bounds) == np.isnan(exact)))
+
+    def test_pruned_rankings_match_full_evaluation(self):
+        rng = np.random.default_rng(2025)
+        inputs_list = [random_inputs(self.engine, rng) for _ in range(300)]
+        # Perfiles con pocos síntomas, que producen empates entre grupos
+        inputs_list += [sample_inputs(self.engine, **{name: 3}) for name in self.engine.symptom_inputs]
+        with override_settings(DIAGNOSIS_TOP_K_PRUNING=False):
+            expected = self.engine.diagnose_batch(inputs_list)
+        self.assertEqual(self.engine.diagnose_batch(inputs_list), expected)
+
+        pruned = self.engine.evaluate(inputs_list, top_k=3)
+        self.assertGreater(np.isneginf(pruned).sum(), 0)
+        computed = np.isfinite(pruned)
+        np.testing.assert_array_equal(pruned[computed], self.engine.evaluate(inputs_list)[computed])
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class AnalyticDefuzzifierTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.engine = FuzzyDiseaseGroupDiagnosis()
+        with override_settings(DIAGNOSIS_DEFUZZIFIER='analytic'):
+            self.analytic = FuzzyDiseaseGroupDiagnosis()
+
+    def test_analytic_centroid_matches_resampled_centroid(self):
+        self.assertEqual(self.analytic.compiled.defuzzifier, 'analytic')
+        self.assertNotEqual(self.analytic.compiled.version, self.engine.compiled.version)
+        rng = np.random.default_rng(17)
+        inputs_list = [random_inputs(self.engine, rng) for _ in range(200)]
+        expected = self.engine.evaluate(inputs_list)
+        actual = self.analytic.evaluate(inputs_list)
+        np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+        # La diferencia es solo el error de interpolar el máximo en el universo remuestreado
+        np.testing.assert_allclose(actual, expected, atol=0.05)
+
+    def test_analytic_pruning_is_exact(self):
+        rng = np.random.default_rng(4)
+        inputs_list = [random_inputs(self.engine, rng) for _ in range(200)]
+        with override_settings(DIAGNOSIS_TOP_K_PRUNING=False):
+            expected = self.analytic.diagnose_batch(inputs_list)
+        self.assertEqual(self.analytic.diagnose_batch(inputs_list), expected)
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class ExecutorTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.engine = FuzzyDiseaseGroupDiagnosis()
+        self.systems = [(group.name, *self.engine.systems[group.name]) for group in self.engine.disease_groups]
+        rng = np.random.default_rng(3)
+        self.rows = [self.engine.normalize_inputs(random_inputs(self.engine, rng)) for _ in range(20)]
+
+    def test_parallel_executors_match_serial(self):
+        expected = self.engine.compiled.evaluate(self.rows)
+        for kind, executor_class in [('thread', ThreadExecutor), ('process', ProcessExecutor)]:
+            executor = build_executor(kind, self.systems, workers=3, compiled=self.engine.compiled)
+            self.assertIsInstance(executor, executor_class)
+            self.assertEqual(len(executor.shards), 3)
+            np.testing.assert_array_equal(executor.evaluate(self.rows), expected)
+            np.testing.assert_array_equal(executor.evaluate(input_matrix(self.engine, self.rows)), expected)
+            executor.pool.shutdown()
+
+    @override_settings(DIAGNOSIS_EXECUTOR='thread', DIAGNOSIS_EXECUTOR_WORKERS=2, DIAGNOSIS_EXECUTOR_MIN_ROWS=10)
+    def test_executor_is_selected_from_settings(self):
+        engine = FuzzyDiseaseGroupDiagnosis()
+        self.assertIsInstance(engine.evaluator, ThreadExecutor)
+        self.assertEqual(engine.diagnose_batch(self.rows), self.engine.diagnose_batch(self.rows))
+        self.assertEqual(engine.diagnose(self.rows[0]), self.engine.diagnose(self.rows[0]))
+
+
+def input_matrix(engine, rows):
+    return np.array([[row[name] for name in engine.compiled.variable_names] for row in rows], dtype=float)
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class InputSchemaTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.engine = FuzzyDiseaseGroupDiagnosis()
+
+    def test_encoded_encounters_match_named_inputs(self):
+        encounters = [
+            validated_encounter(encounter()),
+            validated_encounter(encounter(heart_rate=150, temperature=36.5)),
+            validated_encounter(encounter(blood_pressure='165/100')),
+        ]
+        symptoms = Symptom.objects.in_bulk()
+        named = [
+            self.engine.build_inputs(item['vital_signs'], {
+                normalize_name(symptoms[entry['symptom_id']].name): entry['intensity'] for entry in item['symptoms']
+            })
+            for item in encounters
+        ]
+        X, _ = self.engine.encode(encounters)
+        np.testing.assert_allclose(self.engine.evaluate(X), self.engine.evaluate(named))
+        self.assertEqual(self.engine.diagnose_batch(X), self.engine.diagnose_batch(named))
+
+    def test_rejected_and_clipped_inputs_are_reported(self):
+        payload = validated_encounter(encounter(heart_rate=30))
+        payload['vital_signs']['systolic'] = 'alta'
+        payload['symptoms'][0]['intensity'] = 7
+        X, (rejected,) = self.engine.encode([payload])
+        columns = self.engine.compiled.variable_names
+        self.assertTrue(np.isnan(X[0, columns.index('systolic')]))
+        self.assertEqual(X[0, columns.index('heart_rate')], 60)
+        self.assertEqual([(entry['input'], entry['value']) for entry in rejected], [
+            ('systolic', 'alta'), ('heart_rate', 30), ('fiebre', 7),
+        ])
+        self.assertEqual(rejected[0]['reason'], 'not a number')
+        self.assertEqual(rejected[1]['reason'], 'outside 60..160, clipped to 60')
+
+
+def validated_encounter(payload):
+    serializer = EncounterSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def encounter(**vital_signs):
+    return {
+        'vital_signs': {
+            'blood_pressure': '120/80',
+            'heart_rate': 95,
+            'respiratory_rate': 22,
+            'temperature': 38.4,
+            'weight': 70,
+            **vital_signs,
+        },
+        'symptoms': [{'symptom_id': 4, 'intensity': 3}, {'symptom_id': 6, 'intensity': 2}],
+    }
+
+
+class DiagnosesApiTestCase(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        invalidate_diagnosis_engine()
+        # Los ids y el sello del catálogo se repiten entre tests al deshacer cada transacción
+        invalidate_catalogue_stamp()
+        get_response_cache().clear()
+        self.client = APIClient(HTTP_AUTHORIZATION='xyz123')
+
+
+class BatchDiagnosesApiTests(DiagnosesApiTestCase):
+    def test_batch_creates_every_encounter(self):
+        encounters = [encounter(), encounter(heart_rate=150), encounter(temperature=36.5)]
+        response = self.client.post('/api/diagnoses/batch/', {'encounters': encounters}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Diagnosis.objects.count(), 3)
+        self.assertEqual(DiagnosisSymptom.objects.count(), 6)
+        self.assertEqual(DiagnosisGroupProbability.objects.count(), 9)
+
+        single = self.client.post('/api/diagnoses/', encounters[1], format='json')
+        self.assertEqual(
+            [group['probability_level'] for group in single.data['groups']],
+            [group['probability_level'] for group in response.data[1]['groups']],
+        )
+
+    def test_batch_is_rejected_atomically(self):
+        encounters = [encounter(), {**encounter(), 'symptoms': [{'symptom_id': 999, 'intensity': 2}]}]
+        response = self.client.post('/api/diagnoses/batch/', encounters, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Diagnosis.objects.exists())
+
+
+class CreateDiagnosisQueryBudgetTests(DiagnosesApiTestCase):
+    def test_create_runs_in_constant_queries(self):
+        get_diagnosis_engine()
+        payload = encounter()
+        payload['symptoms'] += [{'symptom_id': symptom_id, 'intensity': 1} for symptom_id in range(7, 15)]
+
+        # in_bulk de síntomas, savepoint y liberación, una inserción por tabla y tres para los totales diarios
+        with self.assertNumQueries(10):
+            response = self.client.post('/api/diagnoses/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        # El informe de entradas rechazadas solo acompaña a la respuesta de creación
+        stored = self.client.get(f"/api/diagnosis/{response.data['id']}/")
+        self.assertEqual(stored.json(), {key: value for key, value in response.data.items() if key != 'rejected_inputs'})
+        self.assertEqual(len(response.data['symptoms']), 10)
+        self.assertEqual(len(response.data['groups']), 3)
+        self.assertEqual(response.data['rejected_inputs'], [])
+
+    def test_invalid_vital_signs_keep_serializer_errors(self):
+        payload = encounter()
+        del payload['vital_signs']['heart_rate']
+        response = self.client.post('/api/diagnoses/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('heart_rate', response.data)
+
+
+class ListDiagnosesApiTests(DiagnosesApiTestCase):
+    def create_diagnoses(self, count):
+        encounters = [encounter(heart_rate=70 + index) for index in range(count)]
+        self.client.post('/api/diagnoses/batch/', encounters, format='json')
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/diagnoses/')
+            body = json.loads(b''.join(response.streaming_content))
+        return body, len(queries)
+
+    def test_streamed_listing_runs_in_constant_queries(self):
+        self.create_diagnoses(2)
+        body, small = self.list_queries()
+        self.assertEqual(len(body), 2)
+
+        self.create_diagnoses(5)
+        body, large = self.list_queries()
+        self.assertEqual(len(body), 7)
+        self.assertEqual(small, large)
+        self.assertEqual(body[0]['groups'][0]['disease_group']['cie_codes'][0]['cie_code'], 'J00')
+
+    def test_cursor_pagination_is_opt_in(self):
+        self.create_diagnoses(5)
+        first = self.client.get('/api/diagnoses/', {'page_size': 2})
+        self.assertEqual(len(first.data['results']), 2)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 2)
+        seen = {item['id'] for item in first.data['results'] + second.data['results']}
+        self.assertEqual(len(seen), 4)
+
+
+class DiagnosesExportTests(DiagnosesApiTestCase):
+    def create_diagnoses(self, count):
+        encounters = [encounter(heart_rate=70 + index) for index in range(count)]
+        return self.client.post('/api/diagnoses/batch/', encounters, format='json').data
+
+    def export(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/diagnoses/export/', params)
+            body = b''.join(response.streaming_content).decode()
+        return response, body, len(queries)
+
+    def test_ndjson_rows_are_flat_and_pivoted(self):
+        created = self.create_diagnoses(2)
+        response, body, _ = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [item['id'] for item in created])
+        self.assertEqual(rows[0]['systolic'], 120)
+        self.assertEqual(rows[1]['heart_rate'], 71)
+        self.assertEqual(rows[0]['symptom:Fiebre'], 3)
+        self.assertIsNone(rows[0][f'symptom:{Symptom.objects.get(pk=1).name}'])
+        top = created[0]['groups'][0]
+        self.assertAlmostEqual(rows[0][f"group:{top['disease_group']['name']}"], top['probability_level'])
+
+    def test_csv_export_runs_in_constant_queries(self):
+        self.create_diagnoses(2)
+        _, small_body, small = self.export(format='csv')
+        self.create_diagnoses(5)
+        response, body, large = self.export(format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(small, large)
+        header, *lines = body.splitlines()
+        self.assertEqual(header.split(',')[:4], ['id', 'created_at', 'systolic', 'diastolic'])
+        self.assertEqual(len(lines), 7)
+
+    def test_time_windows_split_the_export(self):
+        self.create_diagnoses(3)
+        boundary = timezone.now()
+        Diagnosis.objects.filter(pk=Diagnosis.objects.latest('pk').pk).update(created_at=boundary + timedelta(hours=1))
+        moment = boundary.isoformat()
+        _, before, _ = self.export(created_before=moment)
+        _, after, _ = self.export(created_after=moment)
+        self.assertEqual((len(before.splitlines()), len(after.splitlines())), (2, 1))
+        self.assertEqual(self.client.get('/api/diagnoses/export/', {'created_after': 'yesterday'}).status_code, 400)
+
+    def test_command_writes_the_same_rows(self):
+        self.create_diagnoses(2)
+        _, body, _ = self.export(format='csv')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'diagnoses.csv')
+            call_command('export_diagnoses', format='csv', output=path, stdout=io.StringIO())
+            with open(path, encoding='utf-8', newline='') as handle:
+                self.assertEqual(handle.read(), body)
+        with self.assertRaises(CommandError):
+            call_command('export_diagnoses', created_before='not a date', stdout=io.StringIO())
+
+    def test_command_accepts_blood_pressure_filters(self):
+        self.client.post('/api/diagnoses/batch/', [encounter(), encounter(blood_pressure='150/95')], format='json')
+        output = io.StringIO()
+        call_command('export_diagnoses', min_systolic='140', max_diastolic='100', stdout=output, stderr=io.StringIO())
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([(row['systolic'], row['diastolic']) for row in rows], [(150, 95)])
+
+    async def test_streams_asynchronously_under_asgi(self):
+        await sync_to_async(self.create_diagnoses)(3)
+        export = await self.async_stream('/api/diagnoses/export/', {'format': 'csv'})
+        self.assertEqual(len(export.splitlines()), 4)
+        listing = await self.async_stream('/api/diagnoses/')
+        self.assertEqual(len(json.loads(listing)), 3)
+
+    async def async_stream(self, path, params=None):
+        response = await AsyncClient().get(path, params, headers={'Authorization': 'xyz123'})
+        self.assertEqual(response.status_code, 200)
+        # Un iterador síncrono se serviría con sync_to_async(list), entero en memoria
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+
+class ImportEncountersTests(DiagnosesApiTestCase):
+    def write(self, directory, name, lines):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write('\n'.join(lines) + '\n')
+        return path
+
+    def import_file(self, path, **options):
+        output = io.StringIO()
+        call_command('import_encounters', path, workers=1, stdout=output, **options)
+        return output.getvalue()
+
+    def test_ndjson_import_scores_like_the_api_and_reports_rejects(self):
+        valid = {**encounter(heart_rate=120), 'created_at': '2023-05-04T10:00:00Z'}
+        invalid = encounter()
+        del invalid['vital_signs']['heart_rate']
+        unknown = encounter()
+        unknown['symptoms'].append({'symptom_id': 999, 'intensity': 1})
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'encounters.ndjson', [json.dumps(valid), '', json.dumps(invalid), json.dumps(unknown), '{oops'])
+            rejects = os.path.join(directory, 'rejects.ndjson')
+            output = self.import_file(path, rejects=rejects)
+            self.assertIn('Successfully imported 1 encounters (3 rejected, 0 already imported)', output)
+            with open(rejects, encoding='utf-8') as handle:
+                self.assertEqual([json.loads(line)['record'] for line in handle], [2, 3, 4])
+            self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+        diagnosis = Diagnosis.objects.get()
+        self.assertEqual(diagnosis.created_at.isoformat(), '2023-05-04T10:00:00+00:00')
+        self.assertEqual(DailyGroupRollup.objects.filter(date='2023-05-04').count(), 3)
+        expected = self.client.post('/api/diagnoses/', encounter(heart_rate=120), format='json').data['groups']
+        stored = self.client.get(f'/api/diagnosis/{diagnosis.pk}/').json()['groups']
+        self.assertEqual(stored, expected)
+
+    def test_exported_csv_imports_back_and_resumes_without_duplicates(self):
+        self.client.post('/api/diagnoses/batch/', [encounter(heart_rate=70 + index) for index in range(5)], format='json')
+        csv_body = b''.join(self.client.get('/api/diagnoses/export/', {'format': 'csv'}).streaming_content).decode()
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'history.csv', csv_body.splitlines())
+            self.assertIn('Successfully imported 5 encounters', self.import_file(path, batch_size=2))
+            self.assertEqual(Diagnosis.objects.count(), 10)
+
+            # Ejecución cortada tras confirmar los dos primeros registros: se reanuda desde el punto de control
+            with open(path, encoding='utf-8', newline='') as handle:
+                keys = [import_key(record) for _, record in read_records(handle, 'csv')]
+            Diagnosis.objects.filter(idempotency_key__in=keys[2:]).delete()
+            save_checkpoint(f'{path}.checkpoint', file_fingerprint(path), 2, {})
+            output = self.import_file(path, batch_size=2)
+            self.assertIn('Resuming after record 2', output)
+            self.assertIn('Successfully imported 3 encounters (0 rejected, 0 already imported)', output)
+
+            # Sin punto de control se vuelve a leer todo, pero las claves evitan duplicar
+            output = self.import_file(path, batch_size=2, restart=True)
+            self.assertIn('Successfully imported 0 encounters (0 rejected, 5 already imported)', output)
+        self.assertEqual(Diagnosis.objects.count(), 10)
+        imported = Diagnosis.objects.filter(idempotency_key__startswith='import:').order_by('pk').first()
+        self.assertEqual(imported.vital_signs.heart_rate, 70)
+        self.assertEqual(imported.diagnosissymptom_set.count(), 2)
+
+    def test_grown_files_and_overlapping_batches_do_not_duplicate(self):
+        records = [json.dumps({**encounter(heart_rate=70 + index), 'created_at': f'2023-05-0{index + 1}T10:00:00Z'})
+                   for index in range(5)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'encounters.ndjson', records[:3])
+            self.assertIn('Successfully imported 3 encounters', self.import_file(path))
+
+            # El fichero ha crecido: cambia su huella, pero las claves dependen solo de cada registro
+            path = self.write(directory, 'encounters.ndjson', records)
+            self.assertIn('Successfully imported 2 encounters (0 rejected, 3 already imported)', self.import_file(path))
+            self.assertEqual(Diagnosis.objects.count(), 5)
+
+            # Con dos trabajadores hay tres lotes en curso: el registro repetido del tercero ya no estaba guardado al
+            # comprobarlo, y su inserción choca con la del primero como la de una importación concurrente
+            path = self.write(directory, 'repeated.ndjson', [json.dumps(encounter(heart_rate=150)), records[0],
+                                                             json.dumps(encounter(heart_rate=150))])
+            output = io.StringIO()
+            call_command('import_encounters', path, workers=2, batch_size=1, stdout=output)
+            self.assertIn('Successfully imported 1 encounters (0 rejected, 2 already imported)', output.getvalue())
+        self.assertEqual(Diagnosis.objects.count(), 6)
+
+    def test_process_pool_matches_serial_inference(self):
+        encounters = [encounter(heart_rate=60 + 10 * index, temperature=36 + 0.5 * index) for index in range(6)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'encounters.ndjson', [json.dumps(item) for item in encounters])
+            call_command('import_encounters', path, workers=2, batch_size=2, stdout=io.StringIO())
+        engine = get_diagnosis_engine()
+        imported = [
+            [(item.disease_group.name, item.probability_level) for item in diagnosis.diagnosisgroupprobability_set.order_by('-probability_level')]
+            for diagnosis in Diagnosis.objects.order_by('pk').prefetch_related('diagnosisgroupprobability_set__disease_group')
+        ]
+        inputs, _ = engine.encode([validated_encounter(item) for item in encounters])
+        expected = [[(result['group'], result['probability']) for result in ranking] for ranking in engine.diagnose_batch(inputs)]
+        self.assertEqual(len(imported), 6)
+        for row, reference in zip(imported, expected):
+            self.assertEqual([name for name, _ in row], [name for name, _ in reference])
+            np.testing.assert_allclose([value for _, value in row], [value for _, value in reference])
+
+
+class BloodPressureFormatTests(DiagnosesApiTestCase):
+    def vital_signs(self, **vital_signs):
+        payload = encounter(**vital_signs)
+        if 'blood_pressure' in vital_signs and vital_signs['blood_pressure'] is None:
+            del payload['vital_signs']['blood_pressure']
+        return self.client.post('/api/diagnoses/', payload, format='json')
+
+    def test_text_and_numeric_formats_are_equivalent(self):
+        text = self.vital_signs(blood_pressure='135/85')
+        numeric = self.vital_signs(blood_pressure=None, systolic=135, diastolic=85)
+        both = self.vital_signs(blood_pressure='135/85', systolic=135)
+        for response in (text, numeric, both):
+            self.assertEqual(response.status_code, 201)
+            vital_signs = response.data['vital_signs']
+            self.assertEqual((vital_signs['blood_pressure'], vital_signs['systolic'], vital_signs['diastolic']), ('135/85', 135, 85))
+            self.assertEqual(response.data['groups'], text.data['groups'])
+
+    def test_systolic_pressure_reaches_the_rules(self):
+        # Las reglas de presión arterial usan la sistólica desde la migración 0007
+        self.assertFalse(FuzzyRule.objects.filter(antecedent__icontains='blood_pressure').exists())
+        engine = get_diagnosis_engine()
+        self.assertIn('systolic', engine.compiled.variable_names)
+        low = engine.group_probabilities(sample_inputs(engine, systolic=85, dolor_al_orinar=3, mareos=3))
+        normal = engine.group_probabilities(sample_inputs(engine, systolic=120, dolor_al_orinar=3, mareos=3))
+        self.assertNotEqual(low, normal)
+
+    def test_invalid_blood_pressure_is_rejected(self):
+        for vital_signs in ({'blood_pressure': 'alta'}, {'blood_pressure': '120/80', 'diastolic': 70},
+                            {'blood_pressure': None, 'systolic': 120}):
+            response = self.vital_signs(**vital_signs)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('blood_pressure', response.data)
+
+
+class DiagnosisHistoryFilterTests(DiagnosesApiTestCase):
+    def setUp(self):
+        super().setUp()
+        encounters = [encounter(heart_rate=70 + 20 * index) for index in range(4)]
+        self.client.post('/api/diagnoses/batch/', encounters, format='json')
+        self.diagnoses = list(Diagnosis.objects.order_by('pk'))
+        for days, diagnosis in zip((30, 10, 5, 1), self.diagnoses):
+            Diagnosis.objects.filter(pk=diagnosis.pk).update(created_at=timezone.now() - timedelta(days=days))
+
+    def listed(self, **params):
+        response = self.client.get('/api/diagnoses/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in json.loads(b''.join(response.streaming_content))]
+
+    def test_filters_select_the_matching_diagnoses(self):
+        since = (timezone.now() - timedelta(days=7)).date().isoformat()
+        self.assertEqual(self.listed(created_after=since), [d.pk for d in self.diagnoses[2:]])
+        self.assertEqual(self.listed(created_before=since), [d.pk for d in self.diagnoses[:2]])
+
+        probability = DiagnosisGroupProbability.objects.order_by('-probability_level').first()
+        group = probability.disease_group
+        expected = sorted(set(DiagnosisGroupProbability.objects.filter(
+            disease_group=group, probability_level__gte=probability.probability_level,
+        ).values_list('diagnosis_id', flat=True)))
+        self.assertEqual(self.listed(group=group.pk, min_probability=probability.probability_level), expected)
+        self.assertEqual(self.listed(group=group.name, min_probability=probability.probability_level), expected)
+        # Dígitos Unicode que no son un id: se buscan como nombre y no hay coincidencias
+        self.assertEqual(self.listed(group='²'), [])
+        self.assertEqual(self.listed(group='٣'), [])
+
+        paginated = self.client.get('/api/diagnoses/', {'page_size': 10, 'created_after': since})
+        self.assertEqual(len(paginated.data['results']), 2)
+
+    def test_blood_pressure_filters(self):
+        response = self.client.post('/api/diagnoses/', encounter(blood_pressure='160/100'), format='json')
+        self.assertEqual(self.listed(min_systolic=140), [response.data['id']])
+        self.assertEqual(self.listed(max_diastolic=90), [d.pk for d in self.diagnoses])
+        self.assertEqual(self.listed(min_systolic=120, max_systolic=120, min_diastolic=80), [d.pk for d in self.diagnoses])
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/diagnoses/', {'created_after': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/diagnoses/', {'min_probability': 'high'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/diagnoses/', {'min_systolic': 'high'}).status_code, 400)
+
+    def test_filters_are_served_by_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite query plans")
+        queryset = Diagnosis.objects.order_by('pk')
+        plan = filter_diagnoses(queryset, QueryDict('created_after=2024-01-01&created_before=2024-02-01')).explain()
+        self.assertIn('USING INDEX diagnosis_created_at_idx', plan)
+
+        plan = filter_diagnoses(queryset, QueryDict('group=1&min_probability=0.5')).explain()
+        self.assertIn('USING COVERING INDEX diag_group_probability_idx (disease_group_id=? AND probability_level>?)', plan)
+        self.assertNotIn('SCAN', plan)
+
+        plan = filter_diagnoses(queryset, QueryDict('group=Infecciones Respiratorias Agudas')).explain()
+        self.assertIn('sqlite_autoindex_diagnoses_diseasegroup_1 (name=?)', plan)
+        self.assertNotIn('SCAN', plan)
+
+        plan = Symptom.objects.filter(name='Fiebre').explain()
+        self.assertIn('USING INDEX symptom_name_idx', plan)
+
+        plan = filter_diagnoses(queryset, QueryDict('min_systolic=140&max_systolic=160')).explain()
+        self.assertIn('INDEX vitals_systolic_idx (systolic>? AND systolic<?)', plan)
+
+
+class GroupTrendsApiTests(DiagnosesApiTestCase):
+    def rollups(self):
+        return sorted(DailyGroupRollup.objects.values_list(
+            'date', 'disease_group_id', 'diagnoses', 'top_diagnoses', 'probability_sum'))
+
+    def test_rollups_are_maintained_on_insert(self):
+        self.client.post('/api/diagnoses/batch/', [encounter(heart_rate=70 + 15 * n) for n in range(6)], format='json')
+        self.client.post('/api/diagnoses/', encounter(temperature=36.5), format='json')
+        incremental = self.rollups()
+        self.assertEqual(sum(row[3] for row in incremental), 7)
+        self.assertEqual(sum(row[2] for row in incremental), DiagnosisGroupProbability.objects.count())
+
+        call_command('rebuild_group_rollups', stdout=io.StringIO())
+        rebuilt = self.rollups()
+        self.assertEqual([row[:4] for row in rebuilt], [row[:4] for row in incremental])
+        for before, after in zip(incremental, rebuilt):
+            self.assertAlmostEqual(before[4], after[4])
+
+    def test_trends_are_served_from_the_rollups(self):
+        self.client.post('/api/diagnoses/batch/', [encounter(heart_rate=70 + 15 * n) for n in range(4)], format='json')
+        yesterday = timezone.localdate() - timedelta(days=1)
+        DailyGroupRollup.objects.create(date=yesterday, disease_group_id=1, diagnoses=4, top_diagnoses=3, probability_sum=2.0)
+
+        # Una sola consulta, sin leer las probabilidades de cada diagnóstico
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/analytics/group-trends/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['date'], yesterday.isoformat())
+        self.assertEqual(response.data[0]['mean_probability'], 0.5)
+        self.assertEqual(sum(item['top_diagnoses'] for item in response.data), 7)
+
+        response = self.client.get('/api/analytics/group-trends/', {'date_from': timezone.localdate().isoformat(), 'group': 1})
+        self.assertTrue(all(item['disease_group_id'] == 1 for item in response.data))
+        self.assertNotIn(yesterday.isoformat(), [item['date'] for item in response.data])
+        self.assertEqual(self.client.get('/api/analytics/group-trends/', {'date_to': 'today'}).status_code, 400)
+        response = self.client.get('/api/analytics/group-trends/', {'group': '²'})
+        self.assertEqual((response.status_code, response.data), (200, []))
+
+
+class AsyncDiagnosesApiTests(DiagnosesApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+
+    async def post(self, payload):
+        return await self.async_client.post(
+            '/api/async/diagnoses/', payload, content_type='application/json', headers={'Authorization': 'xyz123'})
+
+    async def test_async_create_matches_sync_endpoint(self):
+        response = await self.post(encounter(heart_rate=150))
+        self.assertEqual(response.status_code, 201)
+        created = response.json()
+
+        reference = await sync_to_async(self.client.post)('/api/diagnoses/', encounter(heart_rate=150), format='json')
+        self.assertEqual(
+            [group['probability_level'] for group in created['groups']],
+            [group['probability_level'] for group in reference.json()['groups']],
+        )
+        self.assertEqual(await Diagnosis.objects.acount(), 2)
+
+    async def test_async_list_streams_every_diagnosis(self):
+        for heart_rate in (70, 90, 110):
+            await self.post(encounter(heart_rate=heart_rate))
+        response = await self.async_client.get('/api/async/diagnoses/', headers={'Authorization': 'xyz123'})
+        body = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(len(body), 3)
+        self.assertEqual(body[0]['groups'][0]['disease_group']['cie_codes'][0]['cie_code'], 'J00')
+
+    async def test_invalid_payload_keeps_serializer_errors(self):
+        payload = encounter()
+        del payload['vital_signs']['heart_rate']
+        response = await self.post(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('heart_rate', response.json())
+
+        response = await self.post({**encounter(), 'symptoms': [{'symptom_id': 999, 'intensity': 2}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await Diagnosis.objects.aexists())
+
+    async def test_async_create_honours_the_idempotency_key(self):
+        headers = {'Authorization': 'xyz123', 'Idempotency-Key': 'kiosk-9-0001'}
+        first = await self.async_client.post(
+            '/api/async/diagnoses/', encounter(), content_type='application/json', headers=headers)
+        retry = await self.async_client.post(
+            '/api/async/diagnoses/', encounter(), content_type='application/json', headers=headers)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(await Diagnosis.objects.acount(), 1)
+
+    async def test_async_create_rejects_a_reused_key_with_another_body(self):
+        headers = {'Authorization': 'xyz123', 'Idempotency-Key': 'kiosk-9-0002'}
+        first = await self.async_client.post(
+            '/api/async/diagnoses/', encounter(heart_rate=90), content_type='application/json', headers=headers)
+        other = await self.async_client.post(
+            '/api/async/diagnoses/', encounter(heart_rate=150), content_type='application/json', headers=headers)
+        self.assertEqual((first.status_code, other.status_code), (201, 422))
+        self.assertEqual(await Diagnosis.objects.acount(), 1)
+
+    @override_settings(DIAGNOSIS_ASYNC_MAX_PENDING=0)
+    async def test_full_queue_sheds_load(self):
+        rejected = get_inference_queue().stats()['rejected']
+        response = await self.post(encounter())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(await Diagnosis.objects.aexists())
+        self.assertEqual(get_inference_queue().stats()['rejected'], rejected + 1)
+
+    async def test_async_endpoints_require_token(self):
+        response = await self.async_client.get('/api/async/diagnoses/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(DIAGNOSIS_WRITE_BEHIND=True)
+class WriteBehindApiTests(DiagnosesApiTestCase):
+    def drain(self):
+        call_command('drain_diagnosis_queue', stdout=io.StringIO())
+
+    def test_ranking_is_returned_before_the_diagnosis_is_stored(self):
+        get_diagnosis_engine()
+        # in_bulk de síntomas y la inserción en la cola
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/diagnoses/', encounter(heart_rate=150), format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(len(response.data['groups']), 3)
+        self.assertFalse(Diagnosis.objects.exists())
+
+        self.drain()
+        self.assertFalse(PendingDiagnosis.objects.exists())
+        diagnosis = Diagnosis.objects.get()
+        self.assertEqual(diagnosis.idempotency_key, response.data['idempotency_key'])
+        stored = self.client.get(f'/api/diagnosis/{diagnosis.pk}/').json()
+        self.assertEqual(stored['groups'], response.data['groups'])
+        self.assertEqual(stored['symptoms'], response.data['symptoms'])
+        self.assertEqual(stored['created_at'], response.data['created_at'])
+
+        with override_settings(DIAGNOSIS_WRITE_BEHIND=False):
+            direct = self.client.post('/api/diagnoses/', encounter(heart_rate=150), format='json')
+        self.assertEqual(direct.status_code, 201)
+        self.assertEqual(direct.data['groups'], stored['groups'])
+
+    def test_retries_with_the_same_key_do_not_duplicate(self):
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'kiosk-7-0001'}
+        first = self.client.post('/api/diagnoses/', encounter(), format='json', **headers)
+        retry = self.client.post('/api/diagnoses/', encounter(), format='json', **headers)
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(PendingDiagnosis.objects.count(), 1)
+
+        self.drain()
+        stored = self.client.post('/api/diagnoses/', encounter(), format='json', **headers)
+        self.assertEqual(stored.status_code, 200)
+        self.assertEqual(stored.data['id'], Diagnosis.objects.get().pk)
+
+        # Una fila que ya se persistió (vaciado interrumpido) se descarta sin duplicar
+        PendingDiagnosis.objects.create(idempotency_key='kiosk-7-0001', payload={'encounter': encounter(), 'groups': []})
+        self.drain()
+        self.assertEqual(Diagnosis.objects.count(), 1)
+        self.assertFalse(PendingDiagnosis.objects.exists())
+
+    def test_reused_key_with_another_body_is_rejected(self):
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'kiosk-7-0004'}
+        first = self.client.post('/api/diagnoses/', encounter(heart_rate=90), format='json', **headers)
+        self.assertEqual(first.status_code, 202)
+        other = self.client.post('/api/diagnoses/', encounter(heart_rate=150), format='json', **headers)
+        self.assertEqual(other.status_code, 422)
+        self.assertEqual(PendingDiagnosis.objects.count(), 1)
+
+        # Tras el vaciado la huella sigue con el diagnóstico guardado; el orden de las claves del JSON no cuenta
+        self.drain()
+        self.assertEqual(self.client.post('/api/diagnoses/', encounter(heart_rate=150), format='json', **headers).status_code, 422)
+        reordered = json.dumps(dict(reversed(list(encounter(heart_rate=90).items()))))
+        retry = self.client.post('/api/diagnoses/', reordered, content_type='application/json', **headers)
+        self.assertEqual(retry.status_code, 200)
+
+    def test_unreadable_key_answers_409_with_retry_after(self):
+        # La fila encolada con esa clave no se puede reconstruir: el cliente debe reintentar, no recibir un 500
+        PendingDiagnosis.objects.create(
+            idempotency_key='kiosk-7-0002', payload={'encounter': encounter(), 'groups': [[999, 0.5]]})
+        response = self.client.post('/api/diagnoses/', encounter(), format='json', HTTP_IDEMPOTENCY_KEY='kiosk-7-0002')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # Igual que tras un IntegrityError cuya fila rival aún no es visible
+        data, code, headers = existing_result('kiosk-7-0003', None)
+        self.assertEqual(code, 409)
+        self.assertEqual(headers, {'Retry-After': '1'})
+
+    async def test_async_endpoint_queues_and_honours_the_key(self):
+        headers = {'Authorization': 'xyz123', 'Idempotency-Key': 'kiosk-8-0001'}
+        client = AsyncClient()
+        first = await client.post('/api/async/diagnoses/', encounter(), content_type='application/json', headers=headers)
+        retry = await client.post('/api/async/diagnoses/', encounter(), content_type='application/json', headers=headers)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(await PendingDiagnosis.objects.acount(), 1)
+        self.assertFalse(await Diagnosis.objects.aexists())
+
+    def test_unresolvable_rows_are_set_aside(self):
+        self.client.post('/api/diagnoses/', encounter(), format='json')
+        self.client.post('/api/diagnoses/', encounter(), format='json')
+        broken = PendingDiagnosis.objects.first()
+        broken.payload['groups'][0][0] = 999
+        broken.save()
+
+        self.drain()
+        self.assertEqual(Diagnosis.objects.count(), 1)
+        broken.refresh_from_db()
+        self.assertEqual(broken.attempts, 1)
+        self.assertIn('999', broken.last_error)
+
+
+class HttpCacheTests(DiagnosesApiTestCase):
+    def create_diagnosis(self):
+        response = self.client.post('/api/diagnoses/', encounter(), format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_symptoms_answer_304_until_the_catalogue_changes(self):
+        response = self.client.get('/api/symptoms/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/symptoms/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(
+            self.client.get('/api/symptoms/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        symptom = Symptom.objects.get(pk=4)
+        symptom.name = 'Fiebre alta'
+        symptom.save()
+        changed = self.client.get('/api/symptoms/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn('Fiebre alta', [item['name'] for item in changed.json()])
+
+    def test_diagnosis_is_served_from_the_response_cache(self):
+        pk = self.create_diagnosis()
+        response = self.client.get(f'/api/diagnosis/{pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], pk)
+
+        with self.assertNumQueries(0):
+            again = self.client.get(f'/api/diagnosis/{pk}/')
+            not_modified = self.client.get(f'/api/diagnosis/{pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.client.get('/api/diagnosis/999999/').status_code, 404)
+
+    def test_catalogue_changes_and_deletions_reach_cached_diagnoses(self):
+        pk = self.create_diagnosis()
+        response = self.client.get(f'/api/diagnosis/{pk}/')
+        version = VersionStamp.current(CATALOGUE_VERSION)
+
+        Symptom.objects.filter(pk=4).get().save()
+        self.assertEqual(VersionStamp.current(CATALOGUE_VERSION), version + 1)
+        changed = self.client.get(f'/api/diagnosis/{pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+        Diagnosis.objects.filter(pk=pk).delete()
+        self.assertEqual(self.client.get(f'/api/diagnosis/{pk}/').status_code, 404)
+
+    def test_deletions_reach_the_shared_response_cache(self):
+        pk = self.create_diagnosis()
+        response = self.client.get(f'/api/diagnosis/{pk}/')
+        key = diagnosis_response_key(pk, VersionStamp.current(CATALOGUE_VERSION))
+        self.assertIsNotNone(get_response_cache().get(key))
+
+        # El borrado en cascada desde los signos vitales también quita la respuesta guardada
+        VitalSigns.objects.filter(diagnosis__pk=pk).delete()
+        self.assertIsNone(get_response_cache().get(key))
+        self.assertEqual(self.client.get(f'/api/diagnosis/{pk}/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+        self.assertEqual(caches.settings['diagnosis_responses']['BACKEND'],
+                         'django.core.cache.backends.filebased.FileBasedCache')
+
+
+@override_settings(DIAGNOSIS_INSTRUMENTATION=True)
+class InstrumentationTests(DiagnosesApiTestCase):
+    def test_create_reports_stage_timings(self):
+        response = self.client.post('/api/diagnoses/', encounter(), format='json')
+        self.assertEqual(response.status_code, 201)
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for name in ('validate', 'engine', 'inference', 'store', 'serialize', 'db', 'total'):
+            self.assertIn(name, stages)
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertIn('diagnosis_stage_seconds_bucket{stage="inference"', metrics.content.decode())
+        self.assertIn('diagnosis_requests_total{view="diagnoses_list_create",method="POST",status="201"}', metrics.content.decode())
+
+    @override_settings(DIAGNOSIS_RESULT_CACHE=None)
+    def test_create_reports_per_group_defuzzify_timings(self):
+        response = self.client.post('/api/diagnoses/', encounter(heart_rate=150), format='json')
+        self.assertIn('defuzzify;dur=', response['Server-Timing'])
+        self.assertIn(';desc="Infecciones Respiratorias Agudas"', response['Server-Timing'])
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('diagnosis_group_seconds_bucket{stage="defuzzify",group="Infecciones Respiratorias Agudas"', metrics)
+
+    @override_settings(DIAGNOSIS_RESULT_CACHE=None)
+    def test_per_group_defuzzify_matches_the_vectorized_path(self):
+        engine = get_diagnosis_engine()
+        rng = np.random.default_rng(5)
+        rows = [engine.normalize_inputs(random_inputs(engine, rng)) for _ in range(40)]
+        expected = [engine.evaluate(rows), engine.evaluate(rows, top_k=3)]
+        timings, token = start_request()
+        try:
+            measured = [engine.evaluate(rows), engine.evaluate(rows, top_k=3)]
+        finally:
+            end_request(token)
+        for values, reference in zip(measured, expected):
+            np.testing.assert_array_equal(values, reference)
+        self.assertEqual(len({group for name, group in timings.groups if name == 'defuzzify'}), 7)
+
+    def test_sampled_requests_write_a_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DIAGNOSIS_PROFILE_SAMPLE_RATE=1.0, DIAGNOSIS_PROFILE_DIR=directory):
+                response = APIClient(HTTP_AUTHORIZATION='xyz123').get('/api/symptoms/')
+            self.assertIn('profile;desc=', response['Server-Timing'])
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    @override_settings(DIAGNOSIS_INSTRUMENTATION=False)
+    def test_disabled_instrumentation_adds_nothing(self):
+        response = self.client.get('/api/symptoms/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+@override_settings(DIAGNOSIS_WARM_START=True)
+class WarmStartTests(TestCase):
+    fixtures = FIXTURES
+
+    def test_only_server_processes_warm_start(self):
+        self.assertTrue(should_warm_start(['/usr/local/bin/gunicorn', 'fuzzy_diagnosis.asgi:application'], {}))
+        self.assertTrue(should_warm_start(['/venv/lib/python3.11/site-packages/uvicorn/__main__.py'], {}))
+        self.assertTrue(should_warm_start(['daphne', 'fuzzy_diagnosis.asgi:application'], {}))
+        self.assertTrue(should_warm_start(['manage.py', 'runserver'], {'RUN_MAIN': 'true'}))
+        self.assertTrue(should_warm_start(['manage.py', 'runserver', '--noreload'], {}))
+        self.assertFalse(should_warm_start(['manage.py', 'runserver'], {}))
+        for command in ('migrate', 'test', 'clear_data'):
+            self.assertFalse(should_warm_start(['manage.py', command], {}))
+        for argv in (['-c'], ['/venv/bin/pytest'], ['/venv/bin/celery', 'worker'], ['/venv/bin/ipython'], ['etl.py'], []):
+            self.assertFalse(should_warm_start(argv, {}))
+        with override_settings(DIAGNOSIS_WARM_START=False):
+            self.assertFalse(should_warm_start(['gunicorn'], {}))
+
+    def test_warm_start_compiles_the_shared_engine(self):
+        invalidate_diagnosis_engine()
+        timings = warm_start()
+        self.assertEqual(set(timings), {'imports', 'engine', 'inference', 'total'})
+        with self.assertNumQueries(0):
+            get_diagnosis_engine()
+        self.assertIn('diagnosis_warm_start_seconds{phase="engine"}', metrics.render())
+
+    def test_loading_the_app_does_not_import_skfuzzy(self):
+        script = (
+            "import sys, time, django; django.setup(); import diagnoses.urls, diagnoses.admin; time.sleep(0.5); "
+            "from diagnoses import fuzzy_inference; "
+            "print(','.join(name for name in ('skfuzzy', 'scipy', 'networkx') if name in sys.modules), fuzzy_inference._engine)"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'fuzzy_diagnosis.settings'},
+        )
+        self.assertEqual(result.stdout.strip(), 'None')
+
+    def test_setting_is_read_from_the_environment(self):
+        script = "from django.conf import settings; print(settings.DIAGNOSIS_WARM_START)"
+        for value, expected in (('0', 'False'), ('off', 'False'), ('1', 'True')):
+            result = subprocess.run(
+                [sys.executable, '-c', f"import django; django.setup(); {script}"], capture_output=True, text=True, check=True,
+                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'fuzzy_diagnosis.settings', 'DIAGNOSIS_WARM_START': value},
+            )
+            self.assertEqual(result.stdout.strip(), expected)
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_connections_apply_the_profile_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite profile")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_connections_are_not_persistent_by_default(self):
+        # Bajo ASGI una conexión persistente por hilo no se cierra nunca
+        script = "from django.conf import settings; print(settings.DATABASES['default']['CONN_MAX_AGE'])"
+        for environ, expected in (({}, '0'), ({'SQLITE_CONN_MAX_AGE': '600'}, '600')):
+            env = {key: value for key, value in os.environ.items() if key != 'SQLITE_CONN_MAX_AGE'}
+            result = subprocess.run(
+                [sys.executable, '-c', f"import django; django.setup(); {script}"], capture_output=True, text=True, check=True,
+                env={**env, 'DJANGO_SETTINGS_MODULE': 'fuzzy_diagnosis.settings', 'DB_PROFILE': 'sqlite', **environ},
+            )
+            self.assertEqual(result.stdout.strip(), expected)
+
+
+class InferenceResultCacheTests(DiagnosesApiTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['diagnosis_results'].clear()
+
+    def test_repeated_profiles_hit_the_cache(self):
+        engine = get_diagnosis_engine()
+        cache = get_result_cache()
+        before = cache.stats()
+        first = engine.diagnose(sample_inputs(engine, fiebre=3, tos=2))
+        second = engine.diagnose(sample_inputs(engine, fiebre=3, tos=2))
+        after = cache.stats()
+        self.assertEqual(first, second)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_cached_results_match_uncached_engine(self):
+        engine = get_diagnosis_engine()
+        inputs = sample_inputs(engine, náuseas=3, vómitos=2, diarrea=3)
+        engine.diagnose(inputs)
+        with override_settings(DIAGNOSIS_RESULT_CACHE=None):
+            expected = engine.diagnose(inputs)
+        self.assertEqual(engine.diagnose(inputs), expected)
+
+    def test_off_grid_inputs_match_uncached_engine(self):
+        # 38.45 °C cae entre dos puntos de la malla: se evalúa tal cual y no se guarda con la clave de 38.4/38.5
+        engine = get_diagnosis_engine()
+        off_grid = [sample_inputs(engine, fiebre=3, tos=2, temperature=38.45),
+                    sample_inputs(engine, fiebre=3, tos=2, temperature=38.5)]
+        encounters = [{'vital_signs': {**off_grid[0], 'blood_pressure': '120/80'},
+                       'symptoms': [{'symptom_id': 4, 'intensity': 3}, {'symptom_id': 6, 'intensity': 2}]}]
+        with override_settings(DIAGNOSIS_RESULT_CACHE=None):
+            expected = [engine.diagnose(inputs) for inputs in off_grid]
+            expected_batch = engine.evaluate(engine.encode(encounters)[0])
+
+        cache = get_result_cache()
+        before = cache.stats()
+        for _ in range(2):
+            self.assertEqual([engine.diagnose(inputs) for inputs in off_grid], expected)
+            np.testing.assert_array_equal(engine.evaluate(engine.encode(encounters)[0]), expected_batch)
+        after = cache.stats()
+        # Solo la entrada en la malla se sirve desde la caché la segunda vez
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_stats_endpoint(self):
+        self.client.post('/api/diagnoses/batch/', [encounter(), encounter()], format='json')
+        response = self.client.get('/api/inference-cache/')
+        self.assertTrue(response.data['enabled'])
+        self.assertGreaterEqual(response.data['hits'], 1)
+
+
+@override_settings(DIAGNOSIS_RESULT_CACHE=None)
+class BenchmarkSuiteTests(TestCase):
+    fixtures = FIXTURES
+
+    def test_suite_reports_every_stage_against_a_baseline(self):
+        options = {'samples': 6, 'requests': 3, 'batch_size': 4, 'repeat': 1, 'use_current_database': True}
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = f'{directory}/baseline.json'
+            call_command('benchmark_suite', baseline=baseline, save_baseline=True, stdout=io.StringIO(), **options)
+            with open(baseline, encoding='utf-8') as handle:
+                recorded = json.load(handle)
+            stages = recorded['stages']
+            self.assertEqual(
+                list(stages), ['engine_build', 'create_system_for_group', 'diagnose', 'diagnose_batch', 'api_create', 'api_list_page'])
+            self.assertGreater(stages['api_create']['queries_per_operation'], 0)
+            self.assertEqual(stages['diagnose']['queries_per_operation'], 0)
+
+            # Más consultas por operación que en la línea base es una regresión
+            stages['api_list_page']['queries_per_operation'] = 0
+            with open(baseline, 'w', encoding='utf-8') as handle:
+                json.dump({'meta': {key: recorded['meta'][key] for key in ('engine', 'workload')}, 'stages': stages}, handle)
+            with self.assertRaisesMessage(CommandError, 'api_list_page'):
+                call_command('benchmark_suite', baseline=baseline, fail_on_regression=True, tolerance=100,
+                             stdout=io.StringIO(), **options)
+
+            # Una línea base de otra base de reglas no se compara
+            with open(baseline, 'w', encoding='utf-8') as handle:
+                json.dump({'meta': {**recorded['meta'], 'engine': 'stale'}, 'stages': stages}, handle)
+            output = io.StringIO()
+            call_command('benchmark_suite', baseline=baseline, tolerance=100, stdout=output, **options)
+            self.assertIn('different engine', output.getvalue())
+            self.assertNotIn('REGRESSION', output.getvalue())
+            with self.assertRaisesMessage(CommandError, 'different engine'):
+                call_command('benchmark_suite', baseline=baseline, fail_on_regression=True, stdout=io.StringIO(), **options)
+
+
+class LookupTableModeTests(TestCase):
+    fixtures = FIXTURES
+
+    def test_lookup_tables_match_compiled_engine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = io.StringIO()
+            # Con este límite solo cabe la tabla del sistema circulatorio
+            call_command('build_fuzzy_luts', output_dir=directory, max_cells=1_000_000, check=20, stdout=output)
+            self.assertIn('max error', output.getvalue())
+
+            with override_settings(DIAGNOSIS_LUT_DIR=directory):
+                engine = FuzzyDiseaseGroupDiagnosis()
+            self.assertIsInstance(engine.evaluator, LookupTableEvaluator)
+            self.assertEqual(len(engine.evaluator.tables), 1)
+
+            rng = np.random.default_rng(11)
+            rows = [engine.normalize_inputs(random_inputs(engine, rng)) for _ in range(30)]
+            rows.append(engine.normalize_inputs(sample_inputs(engine, mareos=3, fatiga=2)))
+            _, quantized = engine.compiled.quantize(rows)
+            np.testing.assert_array_equal(engine.evaluator.evaluate(rows), engine.compiled.evaluate(quantized))
+            np.testing.assert_array_equal(
+                engine.evaluator.evaluate(input_matrix(engine, rows[:30])), engine.evaluator.evaluate(rows[:30]))
+
+
+    def test_failed_parity_check_leaves_no_manifest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('build_fuzzy_luts', output_dir=directory, max_cells=1_000_000, check=5, stdout=io.StringIO())
+            self.assertTrue(os.path.exists(os.path.join(directory, 'manifest.json')))
+
+            # Ningún error es menor que 0: la comprobación falla y el manifiesto anterior tampoco queda
+            with self.assertRaisesMessage(CommandError, 'manifest not written'):
+                call_command('build_fuzzy_luts', output_dir=directory, max_cells=1_000_000, check=5, tolerance=0,
+                             stdout=io.StringIO())
+            self.assertFalse(os.path.exists(os.path.join(directory, 'manifest.json')))
+            with override_settings(DIAGNOSIS_LUT_DIR=directory):
+                self.assertNotIsInstance(FuzzyDiseaseGroupDiagnosis().evaluator, LookupTableEvaluator)
+
+class FuzzyRuleBaseTests(TestCase):
+    fixtures = FIXTURES
+
+    def setUp(self):
+        invalidate_diagnosis_engine()
+
+    def test_migration_loads_every_group_rule_base(self):
+        counts = dict(DiseaseGroup.objects.values_list('name').annotate(total=Count('fuzzy_rules')))
+        self.assertEqual(counts['Infecciones Respiratorias Agudas'], 11)
+        self.assertEqual(sum(counts.values()), 122)
+        engine = get_diagnosis_engine()
+        self.assertEqual(engine.compiled.clause_index.shape[0], 122)
+
+    def test_fixture_restores_the_rule_base_after_clear_data(self):
+        migrated = list(FuzzyRule.objects.values_list('disease_group__name', 'order', 'antecedent', 'consequent', 'weight'))
+        call_command('clear_data', stdout=io.StringIO())
+        self.assertFalse(FuzzyRule.objects.exists())
+
+        call_command('loaddata', *FIXTURES, 'fuzzy_rules.json', verbosity=0)
+        reloaded = list(FuzzyRule.objects.values_list('disease_group__name', 'order', 'antecedent', 'consequent', 'weight'))
+        self.assertEqual(reloaded, migrated)
+        engine = get_diagnosis_engine()
+        self.assertEqual(len(engine.diagnose(sample_inputs(engine, fiebre=3, tos=3))), 3)
+
+    def test_migration_attaches_rules_by_group_name(self):
+        load_default_rules = importlib.import_module('diagnoses.migrations.0003_default_fuzzy_rules').load_default_rules
+        FuzzyRule.objects.all().delete()
+        first, second = DiseaseGroup.objects.order_by('pk')[:2]
+        # Base existente con los pk en otro orden que diseasegroup.json
+        names = first.name, second.name
+        DiseaseGroup.objects.filter(pk=first.pk).update(name='-')
+        DiseaseGroup.objects.filter(pk=second.pk).update(name=names[0])
+        DiseaseGroup.objects.filter(pk=first.pk).update(name=names[1])
+        load_default_rules(django_apps, None)
+        self.assertEqual(FuzzyRule.objects.filter(disease_group=second).count(), 11)
+        self.assertEqual(DiseaseGroup.objects.get(pk=second.pk).name, 'Infecciones Respiratorias Agudas')
+
+        # Sin un grupo con ese nombre y con su pk ocupado por otro, la migración se detiene
+        FuzzyRule.objects.all().delete()
+        DiseaseGroup.objects.filter(pk=second.pk).update(name='Otro grupo')
+        with self.assertRaisesMessage(RuntimeError, "expected 'Infecciones Respiratorias Agudas'"):
+            load_default_rules(django_apps, None)
+
+    def test_rule_changes_recompile_engine(self):
+        engine = get_diagnosis_engine()
+        version = VersionStamp.current(RULE_BASE_VERSION)
+        group = DiseaseGroup.objects.get(name='Enfermedades de la Piel y Tejido Subcutáneo')
+        inputs = sample_inputs(engine, mareos=3)
+        before = engine.group_probabilities(inputs)[group.name]
+
+        FuzzyRule.objects.create(
+            disease_group=group, order=99, consequent='high', weight=0.5,
+            antecedent={'variable': 'mareos', 'term': 'high'},
+        )
+        fresh = get_diagnosis_engine()
+        self.assertIsNot(fresh, engine)
+        self.assertGreater(VersionStamp.current(RULE_BASE_VERSION), version)
+        self.assertNotEqual(fresh.compiled.version, engine.compiled.version)
+        after = fresh.group_probabilities(inputs)[group.name]
+        self.assertGreater(after, before)
+        self.assertAlmostEqual(after, fresh.reference_probabilities(inputs)[group.name], places=9)
+
+    @override_settings(DIAGNOSIS_RULE_VERSION_CHECK_INTERVAL=0)
+    def test_version_stamp_invalidates_engines_of_other_processes(self):
+        engine = get_diagnosis_engine()
+        self.assertIs(get_diagnosis_engine(), engine)
+        # Simula el cambio hecho por otro proceso: sin señales en este
+        VersionStamp.objects.filter(name=RULE_BASE_VERSION).update(version=F('version') + 1)
+        self.assertIsNot(get_diagnosis_engine(), engine)
+
+    def test_groups_only_use_the_inputs_their_rules_reference(self):
+        engine = get_diagnosis_engine()
+        self.assertEqual(
+            set(engine.group_inputs['Enfermedades de la Piel y Tejido Subcutáneo']),
+            {'picazón', 'erupciones_cutáneas', 'fatiga', 'fiebre', 'dolor_abdominal',
+             'heart_rate', 'temperature', 'respiratory_rate'},
+        )
+        used = engine.inputs_by_group(sample_inputs(engine, picazón=3))
+        self.assertEqual(used['Enfermedades de la Piel y Tejido Subcutáneo']['picazón'], 3)
+        self.assertNotIn('weight', used['Enfermedades de la Piel y Tejido Subcutáneo'])
+
+        # Síntomas sin reglas no crean variables ni columnas en el motor
+        Symptom.objects.bulk_create([Symptom(name=f'Síntoma {index}') for index in range(50)])
+        Symptom.objects.create(name='Hipo')
+        fresh = get_diagnosis_engine()
+        self.assertEqual(fresh.compiled.variable_names, engine.compiled.variable_names)
+        self.assertNotIn('hipo', fresh.variables)
+        self.assertNotIn('hipo', fresh.build_inputs(sample_inputs(fresh), {'hipo': 3}))
+
+    def test_antecedent_validation(self):
+        validate_antecedent({'and': [{'variable': 'fiebre', 'term': 'high'}, {'not': {'variable': 'tos', 'term': 'low'}}]})
+        for invalid in [{'and': [{'variable': 'fiebre', 'term': 'high'}]}, {'xor': []}, {'variable': 'fiebre', 'term': 'very_high'}]:
+            with self.assertRaises(ValueError):
+                validate_antecedent(invalid)
+        with self.assertRaises(ValueError):
+            validate_antecedent({'variable': 'hipo', 'term': 'high'}, variables=['fiebre'])
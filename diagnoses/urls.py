@@ -1,8 +1,14 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('diagnoses/', views.DiagnosesListCreateView.as_view(), name='diagnoses_list_create'),
+    path('diagnoses/batch/', views.DiagnosesBatchCreateView.as_view(), name='diagnoses_batch_create'),
+    path('diagnoses/export/', views.DiagnosesExportView.as_view(), name='diagnoses_export'),
     path('diagnosis/<int:pk>/', views.DiagnosisDetailView.as_view(), name='diagnosis_detail'),
     path('symptoms/', views.SymptomListView.as_view(), name='symptom_list'),
+    path('inference-cache/', views.InferenceCacheStatsView.as_view(), name='inference_cache_stats'),
+    path('analytics/group-trends/', views.GroupTrendsView.as_view(), name='group_trends'),
+    path('async/diagnoses/', async_views.diagnoses_list_create, name='async_diagnoses_list_create'),
+    path('async/inference-queue/', async_views.inference_queue_stats, name='async_inference_queue_stats'),
 ]
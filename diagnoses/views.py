@@ -1,74 +1,230 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse
+from django.utils import timezone
 from rest_framework import generics
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Diagnosis, VitalSigns, DiseaseGroup, Symptom, DiagnosisSymptom, DiagnosisGroupProbability
-from .serializers import DiagnosisSerializer, VitalSignsSerializer, SymptomSerializer
-from .fuzzy_inference import FuzzyDiseaseGroupDiagnosis  # Cambiado para el nuevo sistema
+from rest_framework.views import APIView
+from .export import ExportColumns, stream_export
+from .filters import filter_diagnoses, group_lookup, parse_day
+from .http_cache import catalogue_stamp, conditional_response, diagnosis_response_key, get_response_cache, make_etag
+from .inference_cache import get_result_cache
+from .instrumentation import instrumentation_enabled, metrics, stage
+from .models import DailyGroupRollup, Diagnosis, Symptom
+from .pagination import DiagnosisCursorPagination
+from .renderers import CSVRenderer, NDJSONRenderer, stream_json_array, streaming_response
+from .serializers import DailyGroupRollupSerializer, DiagnosisSerializer, PendingDiagnosisSerializer, SymptomSerializer, EncounterSerializer
+from .services import create_diagnoses
+from .write_behind import enqueue_diagnoses, find_diagnosis, new_idempotency_key, request_hash
+
+# Relaciones que recorre DiagnosisSerializer, cargadas con un número fijo de consultas
+DIAGNOSIS_SELECT_RELATED = ('vital_signs',)
+DIAGNOSIS_PREFETCH_RELATED = (
+    'diagnosissymptom_set__symptom',
+    'diagnosisgroupprobability_set__disease_group__cie_codes',
+)
 
 class DiagnosesListCreateView(generics.ListCreateAPIView):
-    queryset = Diagnosis.objects.all()
+    queryset = Diagnosis.objects.select_related(*DIAGNOSIS_SELECT_RELATED).prefetch_related(*DIAGNOSIS_PREFETCH_RELATED)
     serializer_class = DiagnosisSerializer
+    pagination_class = DiagnosisCursorPagination
+
+    def filter_queryset(self, queryset):
+        # ?created_after=&created_before=&group=&min_probability=
+        return filter_diagnoses(super().filter_queryset(queryset), self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        # Sin paginación el historial se transmite por bloques con memoria acotada
+        serializer = self.get_serializer()
+        rows = queryset.order_by('pk').iterator(chunk_size=settings.DIAGNOSIS_LIST_CHUNK_SIZE)
+        items = (serializer.to_representation(diagnosis) for diagnosis in rows)
+        return streaming_response(request, stream_json_array(items), content_type='application/json')
 
     def create(self, request, *args, **kwargs):
-        vital_signs_data = request.data.get('vital_signs')
-        symptoms_data = request.data.get('symptoms')
-
-        # Crear signos vitales
-        vital_signs_serializer = VitalSignsSerializer(data=vital_signs_data)
-        if vital_signs_serializer.is_valid():
-            vital_signs = vital_signs_serializer.save()
-        else:
-            return Response(vital_signs_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        # Crear diagnóstico sin grupos de enfermedades por ahora
-        diagnosis = Diagnosis.objects.create(vital_signs=vital_signs)
-
-        # Inicializar intensidades de síntomas
-        symptom_intensities = {}
-
-        # Obtener todos los síntomas de la base de datos
-        all_symptoms = Symptom.objects.all()
-
-        # Establecer intensidad de 0 para todos los síntomas, si no están en la solicitud
-        for symptom in all_symptoms:
-            symptom_name_normalized = symptom.name.lower().replace(" ", "_")
-            symptom_intensities[symptom_name_normalized] = 0  # Intensidad por defecto
-
-        # Actualizar las intensidades para los síntomas presentes en la solicitud
-        for symptom_data in symptoms_data:
-            symptom = Symptom.objects.get(id=symptom_data['symptom_id'])
-            normalized_name = symptom.name.lower().replace(" ", "_")
-            DiagnosisSymptom.objects.create(diagnosis=diagnosis, symptom=symptom, intensity=symptom_data['intensity'])
-            symptom_intensities[normalized_name] = symptom_data['intensity']  # Usar la intensidad proporcionada
-
-        # Usar FuzzyDiseaseGroupDiagnosis para obtener probabilidades por grupo de enfermedades
-        fuzzy_system = FuzzyDiseaseGroupDiagnosis()
-        inputs = {
-            'blood_pressure': vital_signs_data['blood_pressure'],
-            'heart_rate': vital_signs_data['heart_rate'],
-            'respiratory_rate': vital_signs_data['respiratory_rate'],
-            'temperature': vital_signs_data['temperature'],
-            'weight': vital_signs_data['weight'],
-            **symptom_intensities  # Agregar todos los síntomas con su intensidad
-        }
-        group_probabilities = fuzzy_system.diagnose(inputs)
-
-        # Asignar probabilidades calculadas a cada grupo de enfermedades
-        for group_prob in group_probabilities:
-            group = DiseaseGroup.objects.get(name=group_prob['group'])
-            DiagnosisGroupProbability.objects.create(
-                diagnosis=diagnosis,
-                disease_group=group,
-                probability_level=group_prob['probability']
+        # Un reintento con la misma Idempotency-Key devuelve el diagnóstico ya creado o encolado
+        key = request.headers.get('Idempotency-Key')
+        fingerprint = ''
+        if key is not None:
+            error = idempotency_key_error(key)
+            if error is not None:
+                return Response(error, status=status.HTTP_400_BAD_REQUEST)
+            fingerprint = request_hash(request.data)
+            found = find_diagnosis(self.get_queryset(), key)
+            if found is not None:
+                return self.existing_response(key, found, fingerprint)
+
+        serializer = EncounterSerializer(data=request.data)
+        with stage('validate'):
+            valid = serializer.is_valid()
+        if not valid:
+            # Los errores de signos vitales se devuelven en el mismo formato que VitalSignsSerializer
+            return Response(serializer.errors.get('vital_signs', serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if settings.DIAGNOSIS_WRITE_BEHIND:
+                # El ranking se devuelve ya; el diagnóstico queda en la cola hasta drain_diagnosis_queue
+                key = key or new_idempotency_key()
+                diagnosis, = enqueue_diagnoses([serializer.validated_data], [key], [fingerprint])
+                return Response(pending_data(key, diagnosis), status=status.HTTP_202_ACCEPTED)
+
+            # Diagnóstico, síntomas y probabilidades en una sola transacción con inserciones masivas
+            diagnosis, = create_diagnoses([serializer.validated_data], [key], [fingerprint])
+        except IntegrityError:
+            if key is None:
+                raise
+            # Otra petición con la misma clave se adelantó entre la búsqueda y la inserción
+            return self.existing_response(key, find_diagnosis(self.get_queryset(), key), fingerprint)
+
+        # La respuesta se arma con los objetos ya creados, sin volver a leerlos
+        with stage('serialize'):
+            data = DiagnosisSerializer(diagnosis).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def existing_response(self, key, found, fingerprint):
+        data, code, headers = existing_result(key, found, fingerprint)
+        return Response(data, status=code, headers=headers)
+
+
+def idempotency_key_error(key):
+    if not 0 < len(key) <= 64:
+        return {'error': 'Idempotency-Key must be 1 to 64 characters.'}
+    return None
+
+
+def existing_result(key, found, fingerprint=''):
+    # (datos, estado, cabeceras) para una clave ya vista. Sin diagnóstico legible (la otra petición aún no ha
+    # confirmado su transacción, o la fila de la cola no se puede reconstruir) se responde 409 para reintentar.
+    # La misma clave con otro cuerpo es un error del cliente (422); los guardados sin huella se devuelven sin más
+    diagnosis, pending = found or (None, False)
+    if diagnosis is not None and diagnosis.request_hash and fingerprint and diagnosis.request_hash != fingerprint:
+        return (
+            {'error': 'This Idempotency-Key was already used with a different request body.'},
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            None,
+        )
+    if diagnosis is None:
+        return (
+            {'error': 'A request with this Idempotency-Key is still in progress, retry later.'},
+            status.HTTP_409_CONFLICT,
+            {'Retry-After': str(settings.DIAGNOSIS_IDEMPOTENCY_RETRY_AFTER)},
+        )
+    if pending:
+        return pending_data(key, diagnosis), status.HTTP_202_ACCEPTED, None
+    return DiagnosisSerializer(diagnosis).data, status.HTTP_200_OK, None
+
+
+def pending_data(key, diagnosis):
+    return {**PendingDiagnosisSerializer(diagnosis).data, 'idempotency_key': key, 'status': 'pending'}
+
+class DiagnosesBatchCreateView(generics.CreateAPIView):
+    serializer_class = EncounterSerializer
+
+    def create(self, request, *args, **kwargs):
+        # Acepta una lista de encuentros o {"encounters": [...]}
+        encounters = request.data if isinstance(request.data, list) else request.data.get('encounters')
+        if not isinstance(encounters, list) or not encounters:
+            return Response({'encounters': ['Expected a non-empty list of encounters.']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(encounters) > settings.DIAGNOSIS_BATCH_MAX_SIZE:
+            return Response(
+                {'encounters': [f'At most {settings.DIAGNOSIS_BATCH_MAX_SIZE} encounters per request.']},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-        serializer = DiagnosisSerializer(diagnosis)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        serializer = self.get_serializer(data=encounters, many=True)
+        serializer.is_valid(raise_exception=True)
+        diagnoses = create_diagnoses(serializer.validated_data)
+        return Response(DiagnosisSerializer(diagnoses, many=True).data, status=status.HTTP_201_CREATED)
+
+class DiagnosesExportView(APIView):
+    # Historial plano para análisis: ?format=ndjson|csv (o la cabecera Accept) y los filtros del listado.
+    # Con created_after/created_before se exporta por ventanas de tiempo, de forma incremental
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request, *args, **kwargs):
+        queryset = filter_diagnoses(Diagnosis.objects.all(), request.query_params)
+        columns = ExportColumns()
+        renderer = request.accepted_renderer
+        rows = columns.rows(queryset, settings.DIAGNOSIS_EXPORT_CHUNK_SIZE)
+        response = streaming_response(
+            request, stream_export(columns, rows, renderer.format), content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="diagnoses.{renderer.format}"'
+        return response
 
 class DiagnosisDetailView(generics.RetrieveAPIView):
-    queryset = Diagnosis.objects.all()
+    queryset = Diagnosis.objects.select_related(*DIAGNOSIS_SELECT_RELATED).prefetch_related(*DIAGNOSIS_PREFETCH_RELATED)
     serializer_class = DiagnosisSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        # La API navegable se renderiza siempre; solo el JSON se cachea y admite peticiones condicionales
+        if request.accepted_renderer.format != 'json':
+            return super().retrieve(request, *args, **kwargs)
+
+        # Un diagnóstico no cambia tras crearse: su JSON depende solo del id y de la versión del catálogo
+        pk = self.kwargs['pk']
+        version, catalogue_changed_at = catalogue_stamp()
+        cache = get_response_cache()
+        key = diagnosis_response_key(pk, version)
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            diagnosis = self.get_object()
+            cached = (JSONRenderer().render(self.get_serializer(diagnosis).data), diagnosis.created_at)
+            if cache is not None:
+                cache.set(key, cached, settings.DIAGNOSIS_RESPONSE_CACHE_TIMEOUT)
+
+        content, created_at = cached
+        last_modified = max(created_at, catalogue_changed_at) if catalogue_changed_at else created_at
+        return conditional_response(
+            request, make_etag('diagnosis', pk, 'catalogue', version), last_modified,
+            lambda: HttpResponse(content, content_type='application/json'),
+        )
+
 class SymptomListView(generics.ListAPIView):
     queryset = Symptom.objects.all()
-    serializer_class = SymptomSerializer
\ No newline at end of file
+    serializer_class = SymptomSerializer
+
+    def list(self, request, *args, **kwargs):
+        # El listado solo cambia con el catálogo: con el ETag vigente se responde 304 sin consultarlo
+        version, catalogue_changed_at = catalogue_stamp()
+        return conditional_response(
+            request, make_etag('symptoms', 'catalogue', version, request.accepted_renderer.format), catalogue_changed_at,
+            lambda: super(SymptomListView, self).list(request, *args, **kwargs),
+        )
+
+class InferenceCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        cache = get_result_cache()
+        if cache is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, **cache.stats()})
+
+class GroupTrendsView(generics.ListAPIView):
+    # Totales diarios por grupo leídos de DailyGroupRollup: el coste depende de días x grupos, no del
+    # número de diagnósticos. ?date_from=&date_to= (inclusive, por defecto los últimos 30 días) y ?group=
+    serializer_class = DailyGroupRollupSerializer
+    default_days = 30
+
+    def get_queryset(self):
+        params = self.request.query_params
+        date_to = parse_day(params, 'date_to') or timezone.localdate()
+        date_from = parse_day(params, 'date_from') or date_to - timedelta(days=self.default_days - 1)
+        queryset = DailyGroupRollup.objects.select_related('disease_group').filter(date__range=(date_from, date_to))
+        group = params.get('group')
+        if group:
+            queryset = queryset.filter(**group_lookup(group))
+        return queryset
+
+def metrics_view(request):
+    # Métricas de este proceso en el formato de texto de Prometheus
+    if not instrumentation_enabled():
+        raise Http404("Instrumentation is disabled")
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,101 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# Arranque en caliente: cada proceso servidor importa skfuzzy, compila la base de reglas y hace una
+# inferencia de prueba al arrancar, en lugar de cargar todo ello en la primera petición que atiende.
+
+# Signos vitales normales para la inferencia de prueba; los síntomas van con intensidad 0
+WARM_START_VITAL_SIGNS = {
+    'systolic': 120,
+    'diastolic': 80,
+    'heart_rate': 80,
+    'respiratory_rate': 16,
+    'temperature': 36.8,
+    'weight': 70,
+}
+
+# Servidores cuyos procesos atienden peticiones (también con "python -m <servidor>")
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne')
+
+# Nombres con los que se ejecuta "manage.py" (o "django-admin", "python -m django")
+MANAGEMENT_PROGRAMS = ('manage.py', 'django-admin', 'django-admin.py', 'django')
+
+
+def program_name(path):
+    # "python -m paquete" deja en argv[0] la ruta de paquete/__main__.py
+    name = os.path.basename(path)
+    if name == '__main__.py':
+        name = os.path.basename(os.path.dirname(path))
+    return name
+
+
+def should_warm_start(argv=None, environ=None):
+    # Lista blanca: solo los procesos que atienden peticiones. Comandos, scripts, shells, pytest o
+    # celery no deben importar skfuzzy ni consultar la base de datos al cargar Django
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    if not getattr(settings, 'DIAGNOSIS_WARM_START', False) or not argv:
+        return False
+    program = program_name(argv[0])
+    if program in SERVER_PROGRAMS:
+        return True
+    if program not in MANAGEMENT_PROGRAMS or len(argv) < 2 or argv[1] != 'runserver':
+        return False
+    # Con el autorecargador el proceso padre solo vigila los ficheros
+    return environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+
+
+def warm_start():
+    # Devuelve la duración de cada fase en segundos y la publica en /metrics
+    timings = {}
+    started = time.perf_counter()
+    from . import fuzzy_inference
+    import skfuzzy.control  # noqa: F401
+    timings['imports'] = time.perf_counter() - started
+
+    phase_started = time.perf_counter()
+    engine = fuzzy_inference.get_diagnosis_engine()
+    timings['engine'] = time.perf_counter() - phase_started
+
+    phase_started = time.perf_counter()
+    engine.diagnose(engine.build_inputs(WARM_START_VITAL_SIGNS, {}))
+    timings['inference'] = time.perf_counter() - phase_started
+    timings['total'] = time.perf_counter() - started
+
+    metrics.record_warm_start(timings)
+    logger.info(
+        "Diagnosis engine warmed up in %.0f ms (imports %.0f ms, engine %.0f ms, first inference %.0f ms)",
+        *(timings[phase] * 1000 for phase in ('total', 'imports', 'engine', 'inference')),
+    )
+    return timings
+
+
+def start_warm_start():
+    # ready() se ejecuta antes de que el registro de aplicaciones esté listo y Django desaconseja
+    # consultar la base de datos ahí, así que la compilación corre en un hilo que espera a que lo esté
+    thread = threading.Thread(target=_warm_start_when_ready, name='diagnosis-warm-start', daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_start_when_ready():
+    try:
+        while not apps.ready:
+            time.sleep(0.01)
+        warm_start()
+    except Exception:
+        # Un fallo aquí no impide servir: la primera petición compilará el motor como antes
+        logger.exception("Diagnosis engine warm start failed")
+    finally:
+        connections.close_all()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .fuzzy_inference import get_diagnosis_engine
+from .inference_queue import get_inference_queue
+from .instrumentation import stage
+from .models import Diagnosis, DiseaseGroup, PendingDiagnosis, Symptom, parse_blood_pressure
+from .services import build_diagnoses, encounter_inputs, encounter_symptom_ids, save_diagnoses
+
+# Modo write-behind: el ranking se devuelve en cuanto se calcula y el diagnóstico completo se guarda
+# como una sola fila en la cola PendingDiagnosis. drain_pending_diagnoses() lo persiste más tarde.
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def request_hash(data):
+    # Huella del cuerpo de una petición con Idempotency-Key: JSON canónico, así el orden de las claves y los
+    # espacios no cuentan. Un reintento con la misma clave y otra huella es otra petición y se rechaza
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def enqueue_diagnoses(encounters, idempotency_keys, request_hashes=None):
+    # Devuelve diagnósticos sin guardar, listos para serializar. Una clave repetida lanza IntegrityError
+    with stage('engine'):
+        engine = get_diagnosis_engine()
+    with stage('symptoms'):
+        symptoms = Symptom.objects.in_bulk(encounter_symptom_ids(encounters))
+    with stage('inputs'):
+        inputs, rejected = encounter_inputs(engine, encounters, symptoms)
+    with stage('inference'):
+        rankings = engine.diagnose_batch(inputs)
+    return queue_diagnoses(engine, encounters, symptoms, rankings, idempotency_keys, rejected, request_hashes)
+
+
+async def aenqueue_diagnoses(encounters, idempotency_keys, request_hashes=None):
+    # Variante asíncrona, como acreate_diagnoses: inferencia en la cola acotada. Lanza QueueFull si está llena
+    with stage('engine'):
+        engine = await sync_to_async(get_diagnosis_engine)()
+    with stage('symptoms'):
+        symptoms = await Symptom.objects.ain_bulk(encounter_symptom_ids(encounters))
+    with stage('inputs'):
+        inputs, rejected = encounter_inputs(engine, encounters, symptoms)
+    with stage('inference'):
+        rankings = await get_inference_queue().run(engine.diagnose_batch, inputs)
+    return await sync_to_async(queue_diagnoses)(
+        engine, encounters, symptoms, rankings, idempotency_keys, rejected, request_hashes)
+
+
+def queue_diagnoses(engine, encounters, symptoms, rankings, idempotency_keys, rejected, request_hashes=None):
+    groups = {group.name: group for group in engine.disease_groups}
+    created_at = timezone.now()
+    request_hashes = request_hashes or [''] * len(encounters)
+    diagnoses = build_diagnoses(encounters, symptoms, rankings, groups, created_at, idempotency_keys, rejected, request_hashes)
+    with stage('enqueue'):
+        PendingDiagnosis.objects.bulk_create([
+            PendingDiagnosis(
+                idempotency_key=key,
+                request_hash=fingerprint,
+                created_at=created_at,
+                payload={
+                    'encounter': encounter,
+                    'groups': [[groups[result['group']].pk, result['probability']] for result in ranking],
+                    'rejected_inputs': report,
+                },
+            )
+            for encounter, ranking, key, report, fingerprint in zip(encounters, rankings, idempotency_keys, rejected, request_hashes)
+        ])
+    return diagnoses
+
+
+def rebuild_pending(pending):
+    # Diagnósticos sin guardar a partir de las filas de la cola; devuelve (diagnósticos, [(fila, error)])
+    encounters = [item.payload['encounter'] for item in pending]
+    for encounter in encounters:
+        vital_signs = encounter['vital_signs']
+        if 'systolic' not in vital_signs:
+            # Encolado antes de guardar la presión sistólica y diastólica por separado
+            vital_signs['systolic'], vital_signs['diastolic'] = parse_blood_pressure(vital_signs['blood_pressure']) or (None, None)
+    symptoms = Symptom.objects.in_bulk(encounter_symptom_ids(encounters))
+    groups = DiseaseGroup.objects.prefetch_related('cie_codes').in_bulk(
+        {group_id for item in pending for group_id, _ in item.payload['groups']}
+    )
+
+    diagnoses, failed = [], []
+    for item, encounter in zip(pending, encounters):
+        ranking = [{'group': group_id, 'probability': probability} for group_id, probability in item.payload['groups']]
+        missing = sorted({entry['symptom_id'] for entry in encounter['symptoms']} - symptoms.keys())
+        if missing:
+            failed.append((item, f"Unknown symptom ids {missing}"))
+            continue
+        missing = sorted({result['group'] for result in ranking} - groups.keys())
+        if missing:
+            failed.append((item, f"Unknown disease group ids {missing}"))
+            continue
+        # Los reintentos con la misma clave devuelven también el informe de entradas de la primera petición
+        report = item.payload.get('rejected_inputs')
+        diagnoses += build_diagnoses([encounter], symptoms, [ranking], groups, item.created_at, [item.idempotency_key],
+                                     None if report is None else [report], [item.request_hash])
+    return diagnoses, failed
+
+
+def find_diagnosis(queryset, idempotency_key):
+    # (diagnóstico, pendiente) para una clave ya vista, o None. Los pendientes se devuelven sin guardar
+    diagnosis = queryset.filter(idempotency_key=idempotency_key).first()
+    if diagnosis is not None:
+        return diagnosis, False
+    pending = PendingDiagnosis.objects.filter(idempotency_key=idempotency_key).first()
+    if pending is None:
+        return None
+    diagnoses, _ = rebuild_pending([pending])
+    return (diagnoses[0] if diagnoses else None), True
+
+
+def drain_pending_diagnoses(batch_size):
+    # Persiste un lote de la cola en una transacción; devuelve (filas vaciadas, fallidas).
+    # Las claves que ya tienen Diagnosis (por ejemplo, tras un vaciado interrumpido) se descartan sin duplicar
+    with transaction.atomic():
+        pending = list(
+            PendingDiagnosis.objects.select_for_update(skip_locked=True)
+            .filter(last_error='').order_by('pk')[:batch_size]
+        )
+        if not pending:
+            return 0, 0
+        stored = set(
+            Diagnosis.objects.filter(idempotency_key__in=[item.idempotency_key for item in pending])
+            .values_list('idempotency_key', flat=True)
+        )
+        diagnoses, failed = rebuild_pending([item for item in pending if item.idempotency_key not in stored])
+        save_diagnoses(diagnoses)
+
+        failed_pks = {item.pk for item, _ in failed}
+        PendingDiagnosis.objects.filter(pk__in=[item.pk for item in pending if item.pk not in failed_pks]).delete()
+        for item, error in failed:
+            PendingDiagnosis.objects.filter(pk=item.pk).update(attempts=F('attempts') + 1, last_error=error)
+    return len(pending) - len(failed), len(failed)
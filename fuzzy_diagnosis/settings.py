@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'diagnoses.middlewares.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -78,11 +83,86 @@ WSGI_APPLICATION = 'fuzzy_diagnosis.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The profile is chosen with the DB_PROFILE environment variable: 'sqlite' (default) or
+# 'postgres'. Compare them with "python manage.py benchmark_writes".
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'fuzzy_diagnosis'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # psycopg 3 connection pool shared by the threads of each process. CONN_MAX_AGE must
+            # stay 0 with the pool: connections go back to the pool at the end of each request.
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                    'timeout': 10,
+                },
+            },
+        }
+    }
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            # WAL lets readers run while a diagnosis is being written, synchronous=NORMAL is durable
+            # in WAL mode apart from the last commits on power loss, and mmap serves reads from the
+            # page cache. Write transactions take the lock at BEGIN (IMMEDIATE) and wait up to
+            # `timeout` seconds for it instead of failing with "database is locked".
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=134217728;'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA temp_store=MEMORY'
+                ),
+            },
+            # Persistent connections keep their pragmas across requests under WSGI (e.g. SQLITE_CONN_MAX_AGE=600
+            # with gunicorn). Leave it at 0 under ASGI: each request may run in a different thread and
+            # a persistent connection per thread is never closed.
+            'CONN_MAX_AGE': int(os.environ.get('SQLITE_CONN_MAX_AGE', 0)),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+else:
+    raise ImproperlyConfigured(f"Unknown DB_PROFILE '{DB_PROFILE}'; expected 'sqlite' or 'postgres'")
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# 'diagnosis_results' memoizes fuzzy inference results. LocMemCache is per process (LRU
+# with TTL); use a FileBasedCache or DatabaseCache to share it between workers.
+# 'diagnosis_responses' holds rendered diagnoses and must be shared by every worker: deleting a
+# diagnosis drops its entry from this cache, and cache hits are served without checking the
+# database. The default file cache is shared by the workers of one host; point it at a shared
+# backend (e.g. Redis or memcached) when workers run on several hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'diagnosis_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'diagnosis-results',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'diagnosis_responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'DIAGNOSIS_RESPONSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fuzzy-diagnosis-responses')),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
 }
 
 
@@ -128,4 +208,90 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Cors authorization
-CORS_ALLOWED_ORIGINS = ['http://localhost:5173']
\ No newline at end of file
+CORS_ALLOWED_ORIGINS = ['http://localhost:5173']
+
+# Maximum number of encounters accepted by /api/diagnoses/batch/
+DIAGNOSIS_BATCH_MAX_SIZE = 1000
+
+# Rows fetched per query (plus its prefetches) when streaming GET /api/diagnoses/
+DIAGNOSIS_LIST_CHUNK_SIZE = 500
+
+# Rows fetched per query by the flat export (GET /api/diagnoses/export/ and "python manage.py
+# export_diagnoses"); each row carries one column per symptom and per disease group
+DIAGNOSIS_EXPORT_CHUNK_SIZE = 2000
+
+# Cache alias used to memoize inference results by quantized input (None disables it)
+DIAGNOSIS_RESULT_CACHE = 'diagnosis_results'
+
+# Precomputed lookup tables for the fuzzy engine (python manage.py build_fuzzy_luts).
+# LUT mode is used only when this directory holds an up-to-date manifest.
+DIAGNOSIS_LUT_DIR = BASE_DIR / 'fuzzy_luts'
+DIAGNOSIS_LUT_MAX_CELLS = 16_000_000
+
+# Seconds between checks of the rule base version stamp, so rule edits made by other
+# processes reach this one (None disables the check)
+DIAGNOSIS_RULE_VERSION_CHECK_INTERVAL = 5
+
+# Conditional GETs on /api/symptoms/ and /api/diagnosis/<pk>/: ETag and Last-Modified come from
+# the catalogue version stamp (symptoms, groups, diseases) and the diagnosis id, and matching
+# If-None-Match / If-Modified-Since requests get a 304. Rendered diagnosis JSON is kept in the
+# DIAGNOSIS_RESPONSE_CACHE alias (None disables it) for DIAGNOSIS_RESPONSE_CACHE_TIMEOUT seconds.
+# Catalogue edits made by other processes are picked up within the check interval (seconds).
+DIAGNOSIS_RESPONSE_CACHE = 'diagnosis_responses'
+DIAGNOSIS_RESPONSE_CACHE_TIMEOUT = 60 * 60
+DIAGNOSIS_CATALOGUE_VERSION_CHECK_INTERVAL = 5
+
+# How the fuzzy engine evaluates the disease groups: 'serial', 'thread' or 'process'.
+# Parallel executors split the groups across DIAGNOSIS_EXECUTOR_WORKERS workers (default:
+# CPU count) and only for batches of at least DIAGNOSIS_EXECUTOR_MIN_ROWS rows; see
+# "python manage.py benchmark_engine" for where parallelism starts to pay off.
+DIAGNOSIS_EXECUTOR = 'serial'
+DIAGNOSIS_EXECUTOR_WORKERS = None
+DIAGNOSIS_EXECUTOR_MIN_ROWS = 256
+
+# Skip centroid defuzzification for groups whose upper bound cannot reach the top 3.
+# Rankings are identical to the full evaluation; only the discarded groups are not computed.
+DIAGNOSIS_TOP_K_PRUNING = True
+
+# Defuzzification of each group's output: 'centroid' reproduces skfuzzy's resampled
+# centroid; 'analytic' integrates the clipped triangles in closed form (much faster on
+# batches, within a few hundredths of a probability point of 'centroid')
+DIAGNOSIS_DEFUZZIFIER = 'centroid'
+
+# Async endpoints (/api/async/...) run inference on DIAGNOSIS_ASYNC_WORKERS threads off the
+# event loop. Requests beyond DIAGNOSIS_ASYNC_MAX_PENDING in flight get a 503 with Retry-After
+# (seconds) instead of queueing without bound. Serve with an ASGI server, e.g.
+# "uvicorn fuzzy_diagnosis.asgi:application".
+DIAGNOSIS_ASYNC_WORKERS = 4
+DIAGNOSIS_ASYNC_MAX_PENDING = 64
+DIAGNOSIS_ASYNC_RETRY_AFTER = 1
+
+# Write-behind mode for POST /api/diagnoses/: the ranking is returned right away (202) and the
+# diagnosis is queued as one row, to be stored later by "python manage.py drain_diagnosis_queue"
+# (use --loop to run it as a worker). Queued diagnoses are not listed until drained. Clients may
+# send an Idempotency-Key header so retries return the same diagnosis instead of a new one; both
+# the sync and the async endpoints honour the key and this setting. A retry that arrives while the
+# first request is still being stored gets a 409 with this Retry-After (seconds). Reusing a key
+# with a different request body is rejected with a 422 instead of replaying the first result.
+DIAGNOSIS_WRITE_BEHIND = False
+DIAGNOSIS_WRITE_BEHIND_BATCH_SIZE = 500
+DIAGNOSIS_IDEMPOTENCY_RETRY_AFTER = 1
+
+# Opt-in request instrumentation: per-stage durations (engine, symptoms, inference, store,
+# serialize...) and query counts in a Server-Timing header, and per-process Prometheus metrics
+# at /metrics. Instrumented requests also defuzzify one disease group at a time and report each
+# group's time as a "defuzzify" entry ("lookup" for LUT groups) with the group name in desc and
+# in diagnosis_group_seconds. Rule evaluation is shared by all groups and only has an overall
+# time; batches sharded by the 'thread' or 'process' executor are not split per group. A DIAGNOSIS_PROFILE_SAMPLE_RATE fraction of the instrumented requests is also
+# profiled with cProfile and dumped to DIAGNOSIS_PROFILE_DIR (open with snakeviz or pstats).
+DIAGNOSIS_INSTRUMENTATION = False
+DIAGNOSIS_PROFILE_SAMPLE_RATE = 0.0
+DIAGNOSIS_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Warm start: server processes (gunicorn, uvicorn or daphne workers and the runserver child)
+# import skfuzzy, compile the rule base and run one dummy inference right after boot, in a
+# background thread, so the first request does not pay for it. Anything else (management
+# commands, scripts, shells, test runners) never does. Set DIAGNOSIS_WARM_START=0 in the
+# environment to turn it off. The phase timings are logged and exposed at /metrics;
+# "python manage.py warm_start" measures them too.
+DIAGNOSIS_WARM_START = os.environ.get('DIAGNOSIS_WARM_START', '1').lower() not in ('0', 'false', 'no', 'off')